@@ -0,0 +1,379 @@
+"""
+Analysis layer of the main_analysis notebook. The DataFrame of download_all is turned once into a typed feature
+table (ratios, log transforms, rating and follower segments), and the statistics over it (correlations, linear
+regressions, bootstrap confidence intervals) are computed with vectorized NumPy. The feature table and every result
+are cached in memory and on the disk under the hash of the input dataset, so re-running the notebook on an unchanged
+dataset only loads them.
+
+Usage in the notebook::
+
+    from analysis import Analysis
+    a = Analysis(data)
+    a.features.head()
+    a.correlations(['reviews', 'log_instagram_followers', 'reviews_positive_ratio'])
+    a.regression('log_reviews', 'log_instagram_followers')
+    a.bootstrap('reviews', 'log_instagram_followers', statistic='corr')
+    a.compare('reviews_positive_ratio', by='has_instagram')
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+# version of the feature definitions, changing the features invalidates the cached results
+FEATURES_VERSION = 1
+
+# numeric columns of download_all used by the features, missing columns are filled with NaN
+NUMERIC_COLUMNS = ('reviews', 'rating', 'reviews_positive_count', 'reviews_negative_count', 'instagram_followers',
+                   'instagram_posts_count', 'instagram_posts_analyzed', 'instagram_posts_average_like',
+                   'instagram_posts_average_comments')
+
+# log1p transformed columns, log_<column> in the feature table
+LOG_COLUMNS = ('reviews', 'instagram_followers', 'instagram_posts_count', 'instagram_posts_average_like',
+               'instagram_posts_average_comments')
+
+# edges and labels of the segments, the rating is the average number of stars (0-5)
+RATING_BINS = (0, 4.0, 4.5, 4.8, 5.0)
+RATING_LABELS = ('<4', '4-4.5', '4.5-4.8', '4.8+')
+FOLLOWER_BINS = (0, 1000, 10000, 100000, np.inf)
+FOLLOWER_LABELS = ('<1k', '1k-10k', '10k-100k', '100k+')
+
+# maximum number of the resampled values held in memory at once by the bootstrap
+BOOTSTRAP_BATCH_VALUES = 2 ** 22
+
+
+def dataset_hash(data):
+    """
+    :param pandas.DataFrame data: Output of download_all.
+    :return str: Hash of the columns of the dataset used by the features, and of the feature definitions.
+    """
+    columns = [column for column in (*NUMERIC_COLUMNS, 'instagram') if column in data.columns]
+    digest = hashlib.sha1(json.dumps([FEATURES_VERSION, columns]).encode())
+    # hashed row by row in C, the dataset is never serialized
+    digest.update(pd.util.hash_pandas_object(data[columns], index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def build_features(data):
+    """
+    Materializes the typed feature table.
+
+    :param pandas.DataFrame data: Output of download_all.
+    :return pandas.DataFrame: Feature table with the same index, float64 numeric columns (NaN for missing values),
+                              bool flags and categorical segments.
+    """
+    features = pd.DataFrame(index=data.index)
+    for column in NUMERIC_COLUMNS:
+        features[column] = (pd.to_numeric(data[column], errors='coerce').astype('float64') if column in data.columns
+                            else np.nan)
+
+    # zeros in the denominators give NaN, not infinity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reviews = features['reviews'].to_numpy()
+        followers = features['instagram_followers'].to_numpy()
+        features['reviews_positive_ratio'] = np.where(reviews > 0, features['reviews_positive_count'] / reviews,
+                                                      np.nan)
+        features['reviews_negative_ratio'] = np.where(reviews > 0, features['reviews_negative_count'] / reviews,
+                                                      np.nan)
+        features['reviews_per_follower'] = np.where(followers > 0, reviews / followers, np.nan)
+        features['likes_per_follower'] = np.where(
+            followers > 0, features['instagram_posts_average_like'].to_numpy() / followers, np.nan)
+    for column in LOG_COLUMNS:
+        features[f'log_{column}'] = np.log1p(features[column].clip(lower=0))
+
+    instagram = data['instagram'] if 'instagram' in data.columns else pd.Series(None, index=data.index)
+    features['has_instagram'] = instagram.notna().to_numpy()
+    # active accounts post at least as much as the median account
+    posts = features['instagram_posts_count']
+    features['instagram_active'] = (posts >= posts.median()).to_numpy() & posts.notna().to_numpy()
+
+    features['rating_segment'] = pd.cut(features['rating'], RATING_BINS, labels=RATING_LABELS, include_lowest=True)
+    features['follower_segment'] = pd.cut(features['instagram_followers'], FOLLOWER_BINS, labels=FOLLOWER_LABELS,
+                                          include_lowest=True, right=False)
+    return features
+
+
+def _complete(*arrays):
+    """
+    :return list: The arrays without the rows where any of them is NaN.
+    """
+    mask = np.logical_and.reduce([~np.isnan(array) for array in arrays])
+    return [array[mask] for array in arrays]
+
+
+def _pair_moments(x, y):
+    """
+    :param numpy.ndarray x: Values of the first column.
+    :param numpy.ndarray y: Values of the second column.
+    :return numpy.ndarray: Matrix with the columns x, y, x*x, y*y and x*y, centered by the means of the sample
+                           first, so the squares of the large values do not lose precision.
+    """
+    x, y = x - x.mean(), y - y.mean()
+    return np.column_stack([x, y, x * x, y * y, x * y])
+
+
+def _corr(means):
+    """
+    :param numpy.ndarray means: Means of the columns of _pair_moments in every resample (a row each).
+    :return numpy.ndarray: Pearson correlation of every resample.
+    """
+    mean_x, mean_y, mean_xx, mean_yy, mean_xy = means.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean_xy - mean_x * mean_y) / np.sqrt((mean_xx - mean_x ** 2) * (mean_yy - mean_y ** 2))
+
+
+def _slope(means):
+    """
+    :return numpy.ndarray: Slope of the least squares line of every resample, see _corr.
+    """
+    mean_x, mean_y, mean_xx, _, mean_xy = means.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean_xy - mean_x * mean_y) / (mean_xx - mean_x ** 2)
+
+
+# statistics of a pair of columns computed from the means of _pair_moments
+PAIR_STATISTICS = {'corr': _corr, 'slope': _slope}
+
+
+def resampled_means(values, n_resamples, rng):
+    """
+    Means of the columns in the bootstrap resamples. Every batch of the resamples is drawn as a matrix of the counts
+    of the rows (how many times every row is drawn), the means are then a single matrix product.
+
+    :param numpy.ndarray values: Matrix, a row per observation.
+    :param int n_resamples: Number of the resamples.
+    :param numpy.random.Generator rng: Random generator.
+    :return numpy.ndarray: Matrix with a row of the means per resample.
+    """
+    n = len(values)
+    if not n:
+        return np.full((n_resamples, values.shape[1]), np.nan)
+    batch = max(1, BOOTSTRAP_BATCH_VALUES // n)
+    means = []
+    for start in range(0, n_resamples, batch):
+        size = min(batch, n_resamples - start)
+        # the rows of every resample are numbered apart, so one bincount counts all the resamples
+        indices = rng.integers(0, n, size=(size, n)) + np.arange(size)[:, None] * n
+        counts = np.bincount(indices.ravel(), minlength=size * n).reshape(size, n)
+        means.append(counts @ values / n)
+    return np.concatenate(means)
+
+
+class AnalysisCache:
+    """
+    Results of the analysis by their key, kept in memory and, if the directory is supplied, in pickle files, so they
+    survive the restart of the notebook kernel.
+    """
+
+    def __init__(self, directory=None):
+        """
+        __init__ method for the class.
+
+        :param str directory: Directory of the cache files, it is created if it does not exist. None keeps the
+                              results in memory only.
+        """
+        self.directory = directory
+        self._results = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key, compute):
+        """
+        :param str key: Key of the result.
+        :param callable compute: Function without arguments computing the result if it is not cached.
+        :return: The cached or computed result.
+        """
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        if self.directory and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                result = pickle.load(f)
+        else:
+            result = compute()
+            if self.directory:
+                # written to a temporary file first, an interrupted write never leaves a broken result
+                with open(self._path(key) + '.tmp', 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(self._path(key) + '.tmp', self._path(key))
+        with self._lock:
+            self._results[key] = result
+        return result
+
+    def clear(self):
+        """
+        Removes all the results, from the directory too.
+        """
+        with self._lock:
+            self._results.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+class Analysis:
+    """
+    Feature table and statistics of a single dataset, every result is computed once and cached under the hash of
+    the dataset.
+    """
+
+    def __init__(self, data, cache=None):
+        """
+        __init__ method for the class.
+
+        :param pandas.DataFrame data: Output of download_all.
+        :param cache: AnalysisCache instance or path to its directory. If not supplied, the results are cached in
+                      '.analysis_cache' directory. False keeps them in memory only.
+        """
+        if cache is None:
+            cache = AnalysisCache('.analysis_cache')
+        elif isinstance(cache, str):
+            cache = AnalysisCache(cache)
+        self.cache = cache or AnalysisCache()
+        self.data = data
+        self.dataset_hash = dataset_hash(data)
+
+    def _cached(self, name, compute, **params):
+        """
+        :param str name: Name of the result.
+        :param callable compute: Function without arguments computing the result.
+        :param params: Parameters of the result, part of its key.
+        :return: The cached or computed result.
+        """
+        key = f'{self.dataset_hash[:16]}-{name}'
+        if params:
+            key += '-' + hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        return self.cache.get(key, compute)
+
+    @property
+    def features(self):
+        """
+        :return pandas.DataFrame: Feature table of the dataset, see build_features.
+        """
+        return self._cached('features', lambda: build_features(self.data))
+
+    def _values(self, *columns):
+        """
+        :return list: Float arrays of the columns of the feature table, without the rows with a missing value.
+        """
+        features = self.features
+        return _complete(*(features[column].to_numpy(dtype='float64') for column in columns))
+
+    def correlations(self, columns=None, method='pearson'):
+        """
+        :param list columns: Numeric columns of the feature table, all of them if None.
+        :param str method: 'pearson' or another method of pandas.DataFrame.corr.
+        :return pandas.DataFrame: Correlation matrix, every pair over the rows where both values are present.
+        """
+        def compute():
+            features = self.features
+            selected = list(columns or features.select_dtypes('float64').columns)
+            if method != 'pearson':
+                # the ranks depend on the rows of the pair, pandas computes them pair by pair
+                return features[selected].corr(method=method)
+            values = features[selected].to_numpy(dtype='float64')
+            present = ~np.isnan(values)
+            filled = np.where(present, values, 0.0)
+            both = present.T.astype('float64') @ present.astype('float64')
+            # sums over the rows where both columns are present, for all pairs at once
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sum_x = filled.T @ present
+                sum_xx = (filled ** 2).T @ present
+                sum_xy = filled.T @ filled
+                covariance = sum_xy - sum_x * sum_x.T / both
+                variance_x = sum_xx - sum_x ** 2 / both
+                matrix = covariance / np.sqrt(variance_x * variance_x.T)
+            return pd.DataFrame(np.clip(matrix, -1.0, 1.0), index=selected, columns=selected)
+
+        return self._cached('correlations', compute, columns=columns, method=method)
+
+    def regression(self, x, y):
+        """
+        Least squares line y = intercept + slope * x.
+
+        :param str x: Column of the feature table of the explanatory variable.
+        :param str y: Column of the response variable.
+        :return dict: slope, intercept, r2, stderr of the slope and n, the number of the rows with both values.
+        """
+        def compute():
+            xs, ys = self._values(x, y)
+            n = len(xs)
+            design = np.column_stack([np.ones(n), xs])
+            (intercept, slope), residuals, _, _ = np.linalg.lstsq(design, ys, rcond=None)
+            sse = float(residuals[0]) if len(residuals) else float(((ys - design @ (intercept, slope)) ** 2).sum())
+            sst = float(((ys - ys.mean()) ** 2).sum())
+            sxx = float(((xs - xs.mean()) ** 2).sum())
+            stderr = np.sqrt(sse / (n - 2) / sxx) if n > 2 and sxx > 0 else np.nan
+            return {'slope': float(slope), 'intercept': float(intercept), 'r2': 1 - sse / sst if sst > 0 else np.nan,
+                    'stderr': float(stderr), 'n': n}
+
+        return self._cached('regression', compute, x=x, y=y)
+
+    def bootstrap(self, x, y, statistic='corr', n_resamples=2000, confidence=0.95, seed=0):
+        """
+        Percentile bootstrap confidence interval of a statistic of a pair of columns, see resampled_means.
+
+        :param str x: Column of the feature table.
+        :param str y: Column of the feature table.
+        :param str statistic: One of PAIR_STATISTICS.
+        :param int n_resamples: Number of the resamples.
+        :param float confidence: Confidence level of the interval.
+        :param int seed: Seed of the random generator, the same seed gives the same interval.
+        :return dict: Statistic of the data, low and high end of the interval and n.
+        """
+        def compute():
+            moments = _pair_moments(*self._values(x, y))
+            estimate = PAIR_STATISTICS[statistic]
+            estimates = estimate(resampled_means(moments, n_resamples, np.random.default_rng(seed)))
+            low, high = np.nanquantile(estimates, [(1 - confidence) / 2, (1 + confidence) / 2])
+            return {'statistic': float(estimate(moments.mean(axis=0)[None, :])[0]), 'low': float(low),
+                    'high': float(high), 'n': len(moments)}
+
+        return self._cached('bootstrap', compute, x=x, y=y, statistic=statistic, n_resamples=n_resamples,
+                            confidence=confidence, seed=seed)
+
+    def compare(self, column, by='has_instagram', n_resamples=2000, confidence=0.95, seed=0):
+        """
+        Difference of the means of the column between the eshops with and without the flag, with the bootstrap
+        confidence interval (both groups are resampled independently).
+
+        :param str column: Numeric column of the feature table.
+        :param str by: Bool column of the feature table splitting the eshops.
+        :param int n_resamples: Number of the resamples.
+        :param float confidence: Confidence level of the interval.
+        :param int seed: Seed of the random generator.
+        :return dict: Means of both groups, their difference (with - without), low and high end of its interval
+                      and the sizes of the groups.
+        """
+        def compute():
+            features = self.features
+            values = features[column].to_numpy(dtype='float64')
+            flag = features[by].to_numpy(dtype=bool)
+            groups = [values[flag & ~np.isnan(values)], values[~flag & ~np.isnan(values)]]
+            rng = np.random.default_rng(seed)
+            means = [resampled_means(group[:, None], n_resamples, rng)[:, 0] for group in groups]
+            low, high = np.nanquantile(means[0] - means[1], [(1 - confidence) / 2, (1 + confidence) / 2])
+            mean_with, mean_without = (float(group.mean()) if len(group) else np.nan for group in groups)
+            return {'mean_with': mean_with, 'mean_without': mean_without, 'difference': mean_with - mean_without,
+                    'low': float(low), 'high': float(high), 'n_with': len(groups[0]), 'n_without': len(groups[1])}
+
+        return self._cached('compare', compute, column=column, by=by, n_resamples=n_resamples,
+                            confidence=confidence, seed=seed)
+
+    def segments(self, column, by='rating_segment'):
+        """
+        :param str column: Numeric column of the feature table.
+        :param str by: Categorical column of the feature table.
+        :return pandas.DataFrame: Count, mean and median of the column in every segment.
+        """
+        return self._cached('segments', lambda: self.features.groupby(by, observed=False)[column].agg(
+            ['count', 'mean', 'median']), column=column, by=by)
@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+import threading
+from urllib.parse import urlsplit
+
+from tqdm import tqdm
+
+from req import RequestHelper
+
+
+class AsyncFetcher:
+    """
+    Downloads many pages concurrently on a single asyncio event loop. Used by the BaseDownload subclasses when they
+    are created with use_async=True. Requires the aiohttp package.
+    """
+
+    def __init__(self, req=None, *, max_concurrency=1000, per_host_concurrency=8, request_kwargs=None):
+        """
+        __init__ method for the class.
+
+        :param RequestHelper req: Request helper objects, if not supplied, instantiated automatically.
+        :param int max_concurrency: Maximum number of requests in flight.
+        :param int per_host_concurrency: Maximum number of requests in flight to a single host.
+        :param dict request_kwargs: Keyword arguments of every RequestHelper.make_request_async call, e.g. max_bytes.
+        """
+        self.r = req or RequestHelper()
+        if not isinstance(self.r, RequestHelper):
+            raise NotImplementedError('Only RequestHelper instance can be passed in req argument, otherwise'
+                                      'leave it to its default value.')
+
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.request_kwargs = request_kwargs or {}
+
+        self._loop = None
+        self._tasks = []
+
+    async def _worker(self, session, queue, url_for, parse, results, host_semaphores, progress):
+        """
+        Takes the items from the queue until it is empty, downloads and parses them.
+        """
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            url = url_for(item)
+            host = urlsplit(url).hostname
+            semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host_concurrency))
+            async with semaphore:
+                r = await self.r.make_request_async(session, url, **self.request_kwargs)
+            results[index] = parse(item, r)
+            progress.update()
+
+    async def _run(self, items, url_for, parse):
+        """
+        Coroutine behind the run method.
+        """
+        import aiohttp
+
+        self._loop = asyncio.get_running_loop()
+
+        queue = asyncio.Queue()
+        for index_item in enumerate(items):
+            queue.put_nowait(index_item)
+        results = [None] * len(items)
+        host_semaphores = {}
+
+        # the DNSCache of the RequestHelper is shared with the threads, it caches the addresses by itself
+        resolver_kwargs = ({'resolver': self.r.resolver.aiohttp_resolver(), 'use_dns_cache': False}
+                           if self.r.resolver is not None else {})
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_concurrency,
+                                         **resolver_kwargs)
+        timeout = aiohttp.ClientTimeout(total=self.r.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            with tqdm(total=len(items)) as progress:
+                # there are never more workers than items, each worker keeps exactly one request in flight
+                self._tasks = [
+                    asyncio.ensure_future(
+                        self._worker(session, queue, url_for, parse, results, host_semaphores, progress))
+                    for _ in range(min(self.max_concurrency, len(items)))]
+                try:
+                    await asyncio.gather(*self._tasks)
+                except BaseException:
+                    for task in self._tasks:
+                        task.cancel()
+                    raise
+                finally:
+                    self._tasks = []
+        return results
+
+    def run(self, items, url_for, parse):
+        """
+        Downloads the page for every item and parses it.
+
+        :param list items: Input items, e.g. urls or eshop dictionaries.
+        :param callable url_for: Function returning url for the given item.
+        :param callable parse: Function taking the item and requests.Response of its page, its return value is
+                               stored in the output.
+        :return list: Parsed values in the same order as items.
+        """
+        items = list(items)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run(items, url_for, parse))
+
+        # there is already a loop running in this thread (e.g. in Jupyter notebook), so the work is done in another one
+        output = {}
+
+        def target():
+            try:
+                output['results'] = asyncio.run(self._run(items, url_for, parse))
+            except BaseException as e:
+                output['error'] = e
+
+        # the context is copied, so the context variables (e.g. the stage label of the metrics) are kept
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(target,))
+        thread.start()
+        thread.join()
+        if 'error' in output:
+            raise output['error']
+        return output['results']
+
+    def cancel(self):
+        """
+        Cancels all requests in flight, can be called from any thread. The run method then raises CancelledError.
+        """
+        if self._loop is not None:
+            for task in list(self._tasks):
+                self._loop.call_soon_threadsafe(task.cancel)
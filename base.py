@@ -1,7 +1,140 @@
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+
+from canonical import deduplicate
+from journal import Journal
+from metrics import stage_label
 
 
 class BaseDownload(ABC):
+    # name of the stage in the ResultStore
+    STAGE = None
+
+    # checkpoint journal of the stage, None if the progress is not recorded
+    journal = None
+
+    # ResultStore receiving the output of the stage, None if the output is kept in the output attribute
+    store = None
+
     @abstractmethod
     def run(self, input_data):
         pass
+
+    def _set_journal(self, journal):
+        """
+        Sets the checkpoint journal of the stage.
+
+        :param journal: Journal instance, path to the journal file or None.
+        """
+        self.journal = Journal(journal) if isinstance(journal, str) else journal
+
+    def _set_store(self, store):
+        """
+        Sets the ResultStore receiving the output of the stage instead of the output attribute.
+
+        :param ResultStore store: ResultStore instance or None.
+        """
+        self.store = store
+
+    def _emit(self, records):
+        """
+        Passes the finished records to the ResultStore if set, otherwise appends them to the output attribute.
+
+        :param records: Iterable of finished records.
+        """
+        if self.store is None:
+            self.output.extend(records)
+        else:
+            self.store.extend(self.STAGE, records)
+
+    @property
+    def metrics(self):
+        """
+        :return Metrics: Metrics of the RequestHelper of the stage, None if disabled.
+        """
+        return self.r.metrics
+
+    def _unit(self):
+        """
+        :return: Context manager measuring a unit of work of the stage, see Metrics.unit.
+        """
+        return self.metrics.unit(self.STAGE) if self.metrics else nullcontext()
+
+    def _record_run(self, seconds):
+        """
+        :param float seconds: Duration of the run method.
+        """
+        if self.metrics:
+            self.metrics.observe('run_seconds', seconds, stage=self.STAGE)
+
+    def _deduplicate(self, items, key):
+        """
+        Finds the distinct items, so the same page is downloaded only once, see canonical.deduplicate.
+
+        :param list items: Input items.
+        :param callable key: Function returning the canonical key of the item.
+        :return tuple: Distinct items and the position of the distinct item of every input item.
+        """
+        distinct, index = deduplicate(items, key)
+        if self.metrics and len(distinct) < len(index):
+            self.metrics.increment('units_total', len(index) - len(distinct), stage=self.STAGE, source='dedup')
+        return distinct, index
+
+    def _journaled(self, key, func):
+        """
+        Returns the result recorded in the journal for the key, otherwise calls the func and records its result.
+
+        :param str key: Identifier of the unit of work, usually its url.
+        :param callable func: Function without arguments doing the work.
+        :return: Result of the work.
+        """
+        if self.journal is not None and key in self.journal:
+            if self.metrics:
+                self.metrics.increment('units_total', stage=self.STAGE, source='journal')
+            return self.journal[key]
+        with self._unit():
+            result = func()
+        if self.journal is not None:
+            self.journal.record(key, result)
+        return result
+
+    def _journaled_async(self, fetcher, items, key_for, url_for, parse, final=None):
+        """
+        Runs the AsyncFetcher only for the items which are not in the journal yet.
+
+        :param AsyncFetcher fetcher: Fetcher used for the download.
+        :param list items: Input items.
+        :param callable key_for: Function returning the journal key of the item.
+        :param callable url_for: Function returning url for the item.
+        :param callable parse: Function taking the item and requests.Response of its page.
+        :param callable final: Function taking the item and its result, False if the result is not final yet and
+                               the caller records it to the journal later. All results are final if None.
+        :return list: Results in the same order as items.
+        """
+        items = list(items)
+
+        def measured_parse(item, r):
+            # the requests are made on the event loop, so the unit consists of the parsing only
+            with self._unit():
+                return parse(item, r)
+
+        if self.journal is None:
+            with stage_label(self.STAGE):
+                return fetcher.run(items, url_for=url_for, parse=measured_parse)
+
+        unfinished = {}
+
+        def parse_and_record(item, r):
+            result = measured_parse(item, r)
+            if final is None or final(item, result):
+                self.journal.record(key_for(item), result)
+            else:
+                unfinished[key_for(item)] = result
+            return result
+
+        pending = [item for item in items if key_for(item) not in self.journal]
+        if self.metrics:
+            self.metrics.increment('units_total', len(items) - len(pending), stage=self.STAGE, source='journal')
+        with stage_label(self.STAGE):
+            fetcher.run(pending, url_for=url_for, parse=parse_and_record)
+        return [unfinished[key] if key in unfinished else self.journal[key] for key in map(key_for, items)]
@@ -0,0 +1,106 @@
+"""
+Benchmark of the analysis layer on a synthetic dataset with the columns of download_all: the first run builds the
+feature table and computes the statistics of the notebook, the second run (a new Analysis object, as after
+restarting the notebook kernel) loads them from the cache. The vectorized bootstrap is compared with a loop over
+the resamples in pandas.
+
+Run from the repository root::
+
+    python -m benchmarks.analysis --eshops 50000 --resamples 2000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis import Analysis
+
+# statistics of the notebook, computed by every run
+PAIRS = (('reviews', 'instagram_followers'), ('reviews', 'log_instagram_followers'),
+         ('log_reviews', 'log_instagram_followers'), ('reviews_positive_ratio', 'instagram_followers'))
+
+
+def synthetic_dataset(eshops, seed=0):
+    """
+    :param int eshops: Number of rows.
+    :param int seed: Seed of the random generator.
+    :return pandas.DataFrame: Dataset with the columns of download_all, two thirds of the eshops have Instagram.
+    """
+    rng = np.random.default_rng(seed)
+    reviews = rng.lognormal(6, 1.5, eshops).astype(int) + 1
+    has_instagram = rng.random(eshops) < 2 / 3
+    followers = np.where(has_instagram, rng.lognormal(7, 2, eshops) * (1 + np.log1p(reviews) / 5), np.nan)
+    positive = (reviews * rng.uniform(0.6, 1.0, eshops)).astype(int)
+    return pd.DataFrame({
+        'link': [f'https://shop-{i}.cz/' for i in range(eshops)],
+        'reviews': reviews,
+        'rating': np.round(rng.uniform(3.5, 5.0, eshops), 1),
+        'reviews_positive_count': positive,
+        'reviews_negative_count': reviews - positive,
+        'instagram': np.where(has_instagram, [f'shop_{i}' for i in range(eshops)], None),
+        'instagram_followers': followers,
+        'instagram_posts_count': np.where(has_instagram, rng.lognormal(5, 1, eshops).astype(int), np.nan),
+        'instagram_posts_average_like': np.where(has_instagram, followers * rng.uniform(0.01, 0.05, eshops), np.nan),
+    }).set_index('link')
+
+
+def notebook(a, resamples):
+    """
+    Computes the statistics of the notebook.
+    """
+    a.features
+    a.correlations()
+    for x, y in PAIRS:
+        a.regression(x, y)
+        a.bootstrap(x, y, n_resamples=resamples)
+    a.compare('reviews_positive_ratio', by='has_instagram', n_resamples=resamples)
+    a.segments('log_instagram_followers', by='rating_segment')
+
+
+def loop_bootstrap(features, x, y, resamples, seed=0):
+    """
+    :return tuple: Percentile interval of the correlation, one pandas resample after another.
+    """
+    pair = features[[x, y]].dropna()
+    estimates = [pair.sample(len(pair), replace=True, random_state=seed + i).corr().iloc[0, 1]
+                 for i in range(resamples)]
+    return tuple(np.quantile(estimates, [0.025, 0.975]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--eshops', type=int, default=50000, help='Number of eshops in the dataset.')
+    parser.add_argument('--resamples', type=int, default=2000, help='Number of bootstrap resamples.')
+    args = parser.parse_args()
+
+    data = synthetic_dataset(args.eshops)
+    directory = tempfile.mkdtemp()
+    try:
+        timings = {}
+        for name in ('first run', 'cached run'):
+            start_time = time.perf_counter()
+            notebook(Analysis(data, cache=directory), args.resamples)
+            timings[name] = time.perf_counter() - start_time
+
+        a = Analysis(data, cache=False)
+        x, y = PAIRS[1]
+        start_time = time.perf_counter()
+        vectorized = a.bootstrap(x, y, n_resamples=args.resamples)
+        timings['bootstrap (vectorized)'] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        low, high = loop_bootstrap(a.features, x, y, args.resamples)
+        timings['bootstrap (pandas loop)'] = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(directory)
+
+    for name, seconds in timings.items():
+        print(f'{name:24} {seconds:8.3f} s')
+    print(f'interval vectorized ({vectorized["low"]:.4f}, {vectorized["high"]:.4f}), pandas loop ({low:.4f}, '
+          f'{high:.4f})')
+
+
+if __name__ == '__main__':
+    main()
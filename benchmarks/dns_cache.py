@@ -0,0 +1,101 @@
+"""
+Benchmark of the DNS cache: downloads the pages of many distinct eshop domains from the local server, with
+socket.getaddrinfo replaced by a stand-in resolver with the given latency, which maps the live domains to the local
+server and answers NXDOMAIN for the dead ones. It compares the lookups made by every connection (and every retry)
+with the DNSCache prefetching all the domains ahead of the requests.
+
+Run from the repository root::
+
+    python -m benchmarks.dns_cache --eshops 300 --dead 0.2 --latency 0.2 --threads 30
+"""
+import argparse
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from req import RequestHelper
+from benchmarks.server import LocalServer
+
+_system_getaddrinfo = socket.getaddrinfo
+
+
+class StandInResolver:
+    """
+    Replacement of socket.getaddrinfo: the hostnames ending with .test are resolved after the latency, those
+    starting with dead- do not exist. The other hostnames go to the system resolver.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lookups = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, host, port, *args, **kwargs):
+        if not isinstance(host, str) or not host.endswith('.test'):
+            return _system_getaddrinfo(host, port, *args, **kwargs)
+        with self._lock:
+            self.lookups += 1
+        time.sleep(self.latency)
+        if host.startswith('dead-'):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return _system_getaddrinfo('127.0.0.1', port, *args, **kwargs)
+
+
+def measure(req, urls, threads, prefetch):
+    """
+    :param RequestHelper req: Helper used for the requests.
+    :param list urls: Urls of the eshop pages.
+    :param int threads: Number of threads.
+    :param bool prefetch: If True, the domains are resolved ahead of the requests.
+    :return tuple: Pages per second and the number of the pages downloaded.
+    """
+    def fetch(url):
+        try:
+            return req.make_request(url).ok
+        except Exception:
+            return False
+
+    start_time = time.perf_counter()
+    if prefetch:
+        req.prefetch(urls)
+    with ThreadPoolExecutor(threads) as t:
+        ok = list(t.map(fetch, urls))
+    return len(urls) / (time.perf_counter() - start_time), sum(ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--eshops', type=int, default=300, help='Number of eshop domains.')
+    parser.add_argument('--dead', type=float, default=0.2, help='Fraction of the domains which do not exist.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds of every DNS lookup.')
+    parser.add_argument('--threads', type=int, default=30, help='Number of threads downloading the pages.')
+    parser.add_argument('--backoff-base', type=float, default=0.5, help='Wait after the first failed attempt.')
+    args = parser.parse_args()
+
+    resolver = StandInResolver(args.latency)
+    socket.getaddrinfo = resolver
+    try:
+        with LocalServer() as server:
+            port = server.url.rsplit(':', 1)[1].rstrip('/')
+            dead_every = round(1 / args.dead) if args.dead else 0
+            urls = [f'http://{"dead" if dead_every and i % dead_every == 0 else "shop"}-{i}.test:{port}/'
+                    for i in range(args.eshops)]
+            options = dict(disable_debug_print=True, cache=False, scheduler=False, metrics=False,
+                           backoff_base=args.backoff_base)
+
+            results = {}
+            for name, resolver_option, prefetch in (('getaddrinfo', False, False), ('DNSCache', None, True)):
+                resolver.lookups = 0
+                rate, ok = measure(RequestHelper(resolver=resolver_option, **options), urls, args.threads, prefetch)
+                results[name] = rate, ok, resolver.lookups
+    finally:
+        socket.getaddrinfo = _system_getaddrinfo
+
+    print(f'{"":12} {"pages/sec":>10} {"downloaded":>10} {"lookups":>8}')
+    for name, (rate, ok, lookups) in results.items():
+        print(f'{name:12} {rate:10.1f} {ok:10} {lookups:8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark of the size-capped streaming download of the eshop pages against the local ReplayServer with limited
+bandwidth. It compares reading the whole pages with reading only their beginning (stopped early once the Instagram
+links decide the account, or cut at max_page_bytes and completed by the footer fetched by a Range request), and
+checks that both find the same accounts.
+
+Run from the repository root::
+
+    python -m benchmarks.eshop_pages --eshops 200 --max-page-bytes 65536 --bandwidth 2000000
+"""
+import argparse
+import time
+
+from eshop_web import EshopWebsite
+from req import RequestHelper
+from benchmarks.server import ReplayServer
+
+
+def measure(server, urls, **kwargs):
+    """
+    :param ReplayServer server: Running server.
+    :param list urls: Urls of the eshop pages.
+    :param kwargs: Arguments of EshopWebsite limiting the read part of the pages.
+    :return tuple: Dictionary with the measured values and the found accounts by the url.
+    """
+    req = RequestHelper(disable_debug_print=True, cache=False, scheduler=False, metrics=False)
+    sizes = []
+    stage = EshopWebsite(req, **kwargs)
+    download_page = stage._download_page
+
+    def measured_download(url):
+        r = download_page(url)
+        sizes.append(len(r.content))
+        return r
+
+    stage._download_page = measured_download
+    sent_before, start_time = server.bytes_sent, time.perf_counter()
+    stage.run(urls)
+    seconds = time.perf_counter() - start_time
+    return {'pages/sec': len(urls) / seconds, 'bytes read': sum(sizes), 'bytes sent': server.bytes_sent - sent_before,
+            'largest body': max(sizes)}, {result['url']: result['instagram'] for result in stage.output}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--eshops', type=int, default=200, help='Number of eshop pages.')
+    parser.add_argument('--max-page-bytes', type=int, default=64 * 1024, help='Maximum number of bytes read.')
+    parser.add_argument('--tail-bytes', type=int, default=16 * 1024, help='Size of the footer fetched by Range.')
+    parser.add_argument('--bandwidth', type=float, default=2e6, help='Bytes per second of every response.')
+    args = parser.parse_args()
+
+    with ReplayServer(bandwidth=args.bandwidth) as server:
+        urls = [f'{server.url}eshop/shop-{i}/' for i in range(args.eshops)]
+        whole, whole_accounts = measure(server, urls, max_page_bytes=None, tail_bytes=0, early_abort_links=None)
+        capped, capped_accounts = measure(server, urls, max_page_bytes=args.max_page_bytes,
+                                          tail_bytes=args.tail_bytes)
+
+    assert whole_accounts == capped_accounts
+    print(f'{"":14} {"whole pages":>14} {"capped pages":>14}')
+    for name in whole:
+        print(f'{name:14} {whole[name]:14.1f} {capped[name]:14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Micro-benchmark of the parsing code over the saved fixture pages. For every extractor it reports pages/sec and
+peak memory allocated while parsing a single page, for the current implementation and for the previous one
+(full parsel.Selector built from decoded text, XPath strings evaluated per page).
+
+Run from the repository root::
+
+    python -m benchmarks.parsing --seconds 2
+"""
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from collections import Counter
+
+from parsel import Selector
+
+from heureka import Heureka
+from eshop_web import EshopWebsite
+from instagram import Instagram
+from parsing import selector_from_bytes
+from req import RequestHelper
+from benchmarks.server import load_fixture
+
+
+def _previous_listing(content):
+    sel = Selector(content.decode('utf-8'))
+    return [{'reviews': float(re.sub(r'[^\d]+', '', tr.xpath('./td[4]/a/ul/li[2]/text()').get())),
+             'inner_link': tr.xpath('./td[4]/a/@href').get(),
+             'name': tr.xpath('./th/a/text()').get()}
+            for tr in sel.xpath('/html/body/div[2]/div/div[2]/div/table//tr')]
+
+
+def _previous_detail(content):
+    sel = Selector(content.decode('utf-8'))
+    return {
+        'link': sel.xpath('/html/body/div[2]/div/div[2]/aside//dd[@class="c-pair-list__value"]/'
+                          'a[contains(@href,"heureka.cz/exit")]/text()').get().strip(),
+        'rating': float(sel.css('body > div.scope-essentials.scope-shop-detail > div > div.l-shop-detail__wrapper > '
+                                'aside > div > section.c-shop-detail-stats.c-aside__section > table > tbody > '
+                                'tr:nth-child(1) > td > span.c-shop-detail-stats__value::text').get()
+                        .replace(',', '.')),
+        'reviews_negative_count': float(re.sub(r'&nbsp;|\s+', '', sel.xpath(
+            '//*[@id="filtr"]/div/nav/ul/li[3]/a/@data-count').get())),
+        'reviews_positive_count': float(re.sub(r'&nbsp;|\s+', '', sel.xpath(
+            '//*[@id="filtr"]/div/nav/ul/li[2]/a/@data-count').get())),
+    }
+
+
+def _previous_instagram_links(content):
+    sel = Selector(content.decode('utf-8'))
+    candidates = []
+    for link in sel.xpath('//a[contains(@href,"instag")]/@href').getall():
+        match = re.search(r'(instagram.com|instagr.am)/(?P<id>[\w\.]{3,})', link)
+        if match:
+            candidates.append(match['id'])
+    return Counter(candidates).most_common()[0][0] if candidates else None
+
+
+_RGX_PATTERN_INSTAGRAM = r"""
+^                         # start of string
+[^\{]*?                   # any characters except "{", as few as possible
+(?P<json_obj>\{.*\})      # json_obj: starts with "{" and ends with "}"
+[^\}]*?                   # any characters except "}", as few as possible
+$                         # end of string
+"""
+
+
+def _previous_instagram_profile(content):
+    i_s = Selector(content.decode('utf-8'))
+    if 'Sorry, this page' in i_s.get():
+        return None
+    output_object = json.loads(
+        re.match(_RGX_PATTERN_INSTAGRAM, i_s.xpath('/html/body/script[1]/text()').get(), re.VERBOSE)['json_obj'])
+    return output_object['entry_data']['ProfilePage'][0]['graphql']['user']
+
+
+def _current_listing(content):
+    return Heureka._parse_listing_rows(selector_from_bytes(content), 'https://obchody.heureka.cz/')
+
+
+def _current_detail(content):
+    return Heureka._parse_detail_page(selector_from_bytes(content))
+
+
+_instagram = Instagram(RequestHelper(disable_debug_print=True, cache=False))
+
+
+def _current_instagram_profile(content):
+    return _instagram.parse_instagram_data(content)
+
+
+# extractor name -> fixture, previous implementation, current implementation
+CASES = {
+    'heureka_listing': ('heureka_listing.html', _previous_listing, _current_listing),
+    'heureka_detail': ('heureka_detail.html', _previous_detail, _current_detail),
+    'eshop_instagram_small': ('eshop_small.html', _previous_instagram_links, EshopWebsite._parse_instagram_links),
+    'eshop_instagram_large': ('eshop_large.html', _previous_instagram_links, EshopWebsite._parse_instagram_links),
+    'eshop_instagram_variants': ('eshop_variants.html', _previous_instagram_links,
+                                 EshopWebsite._parse_instagram_links),
+    'eshop_instagram_none': ('eshop_no_instagram.html', _previous_instagram_links,
+                             EshopWebsite._parse_instagram_links),
+    'instagram_profile': ('instagram_profile.html', _previous_instagram_profile, _current_instagram_profile),
+    'instagram_not_found': ('instagram_not_found.html', _previous_instagram_profile, _current_instagram_profile),
+}
+
+
+def measure(func, content, seconds):
+    """
+    Runs func repeatedly for the given time.
+
+    :param callable func: Function taking raw page content.
+    :param bytes content: Raw page content.
+    :param float seconds: Time budget.
+    :return tuple: pages/sec and peak memory in KiB allocated during a single call.
+    """
+    func(content)
+    runs, start_time = 0, time.perf_counter()
+    while time.perf_counter() - start_time < seconds:
+        func(content)
+        runs += 1
+    pages_per_sec = runs / (time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pages_per_sec, peak / 1024
+
+
+def run(seconds=1.0):
+    """
+    Runs all benchmark cases.
+
+    :param float seconds: Time budget for every case and implementation.
+    :return dict: Results keyed by the extractor name.
+    """
+    results = {}
+    for name, (fixture, previous, current) in CASES.items():
+        content = load_fixture(fixture)
+        results[name] = {'size_kib': len(content) / 1024}
+        if previous is not None:
+            results[name]['previous'] = measure(previous, content, seconds)
+        results[name]['current'] = measure(current, content, seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1.0, help='Time budget for every measurement.')
+    args = parser.parse_args()
+
+    print(f'{"extractor":24} {"size":>8} {"impl":>9} {"pages/sec":>10} {"peak KiB":>9}')
+    for name, result in run(args.seconds).items():
+        for impl in ('previous', 'current'):
+            if impl in result:
+                pages_per_sec, peak = result[impl]
+                print(f'{name:24} {result["size_kib"]:7.0f}K {impl:>9} {pages_per_sec:10.1f} {peak:9.0f}')
+
+
+if __name__ == '__main__':
+    main()
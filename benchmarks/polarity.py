@@ -0,0 +1,112 @@
+"""
+Benchmark of the review-term polarity analysis over synthetic Czech reviews. It reports rows/sec of the polarity
+module in a single process and in the process pool, compared to the naive approach (pandas str.split and a Counter
+per polarity), and checks that both count the same.
+
+Run from the repository root::
+
+    python -m benchmarks.polarity --reviews 200000 --chunk-size 20000 --processes 4
+"""
+import argparse
+import os
+import random
+import time
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from polarity import TermStats, analyze
+
+_NEUTRAL = ('obchod', 'zboží', 'objednávka', 'doprava', 'balík', 'kurýr', 'cena', 'zákaznický', 'servis', 'web',
+            'platba', 'kartou', 'dobírka', 'týden', 'den', 'výdejní', 'místo', 'email', 'telefon', 'reklamace')
+_POSITIVE = ('rychlé', 'spokojenost', 'výborný', 'doporučuji', 'skvělá', 'ochotný', 'levné', 'bezproblémové')
+_NEGATIVE = ('pozdě', 'nespokojen', 'rozbité', 'nereagují', 'drahé', 'zdržení', 'nedoporučuji', 'chybí')
+
+
+def generate(count, seed=0):
+    """
+    :param int count: Number of reviews.
+    :param int seed: Seed of the random generator.
+    :return tuple: Texts and ratings of the reviews, the ratings from 0.5 to 5 skew the words to the polarity.
+    """
+    rnd = random.Random(seed)
+    texts, ratings = [], []
+    for _ in range(count):
+        rating = rnd.randint(1, 10) / 2
+        polar = _POSITIVE if rating >= 3 else _NEGATIVE
+        words = rnd.choices(_NEUTRAL, k=rnd.randint(5, 40)) + rnd.choices(polar, k=rnd.randint(0, 5))
+        rnd.shuffle(words)
+        # no punctuation, so that str.split of the naive approach finds the same words
+        texts.append(' '.join(words).capitalize())
+        ratings.append(rating)
+    return texts, ratings
+
+
+def _chunks(texts, ratings, chunk_size):
+    for start in range(0, len(texts), chunk_size):
+        yield texts[start:start + chunk_size], ratings[start:start + chunk_size]
+
+
+def naive(texts, ratings, positive_min=4.0, negative_max=2.0):
+    """
+    The naive approach: words split by pandas str.split, counted by Counters and summed in Python loops.
+
+    :return tuple: Counters of the words in positive and negative reviews and the mean rating of every word.
+    """
+    df = pd.DataFrame({'words': pd.Series(texts).str.lower().str.split(), 'rating': ratings})
+    positive = Counter(word for words in df.loc[df.rating >= positive_min, 'words'] for word in words)
+    negative = Counter(word for words in df.loc[df.rating <= negative_max, 'words'] for word in words)
+    sums, docs = defaultdict(float), Counter()
+    for words, rating in zip(df['words'], df['rating']):
+        for word in set(words):
+            sums[word] += rating
+            docs[word] += 1
+    return positive, negative, {word: sums[word] / docs[word] for word in docs}
+
+
+def run(reviews=100000, chunk_size=10000, processes=None):
+    """
+    :param int reviews: Number of synthetic reviews.
+    :param int chunk_size: Number of reviews in a chunk.
+    :param int processes: Number of worker processes of the pool, os.cpu_count() if None.
+    :return dict: rows/sec keyed by the implementation.
+    """
+    texts, ratings = generate(reviews)
+    processes = processes or os.cpu_count()
+    results = {}
+
+    start_time = time.perf_counter()
+    positive, negative, _ = naive(texts, ratings)
+    results['naive'] = reviews / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    stats = analyze(_chunks(texts, ratings, chunk_size), processes=1)
+    results['polarity/1 process'] = reviews / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    pooled = analyze(_chunks(texts, ratings, chunk_size), processes=processes)
+    results[f'polarity/{processes} processes'] = reviews / (time.perf_counter() - start_time)
+
+    # the engine must count the same as the naive approach (the synthetic words do not collide)
+    table = stats.table(min_count=1)
+    for word in _POSITIVE + _NEGATIVE:
+        assert table.loc[word, 'positive_count'] == positive[word], word
+        assert table.loc[word, 'negative_count'] == negative[word], word
+    assert (pooled.values == TermStats().merge(stats).values).all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=100000, help='Number of synthetic reviews.')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Number of reviews in a chunk.')
+    parser.add_argument('--processes', type=int, help='Number of worker processes, all CPUs by default.')
+    args = parser.parse_args()
+
+    print(f'{"implementation":24} {"rows/sec":>10}')
+    for name, rows_per_sec in run(args.reviews, args.chunk_size, args.processes).items():
+        print(f'{name:24} {rows_per_sec:10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of the proxy pool against local stand-in proxies: a few healthy ones, some dead (refusing the connections)
+and some refusing the access (answering 403 by themselves). It compares the random choice of the proxy on every
+attempt with the health-scored ProxyPool, reports the throughput and the success rate, and the capacity of the
+healthy proxies alone.
+
+Run from the repository root::
+
+    python -m benchmarks.proxies --requests 600 --threads 32 --healthy 4 --dead 2 --banned 2
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from proxies import ProxyPool
+from req import RequestHelper
+from benchmarks.server import LocalServer, ProxyServer
+
+
+def measure(req, urls, threads):
+    """
+    :param RequestHelper req: Helper with the proxies.
+    :param list urls: Urls to fetch.
+    :param int threads: Number of threads.
+    :return tuple: Requests per second and the fraction of the requests ending with 200.
+    """
+    def fetch(url):
+        try:
+            return req.make_request(url).status_code == 200
+        except Exception:
+            return False
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(threads) as t:
+        ok = list(t.map(fetch, urls))
+    return len(urls) / (time.perf_counter() - start_time), sum(ok) / len(ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=600, help='Number of requests.')
+    parser.add_argument('--threads', type=int, default=32, help='Number of threads.')
+    parser.add_argument('--healthy', type=int, default=4, help='Number of healthy proxies.')
+    parser.add_argument('--dead', type=int, default=2, help='Number of proxies refusing the connections.')
+    parser.add_argument('--banned', type=int, default=2, help='Number of proxies refusing the access.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added by every proxy.')
+    parser.add_argument('--max-concurrency', type=int, default=4, help='Requests in flight through a proxy.')
+    parser.add_argument('--backoff-base', type=float, default=0.5, help='Wait after the first failed attempt.')
+    args = parser.parse_args()
+
+    with LocalServer() as target:
+        healthy = [ProxyServer(latency=args.latency).start() for _ in range(args.healthy)]
+        banned = [ProxyServer(latency=args.latency, ban_rate=1.0).start() for _ in range(args.banned)]
+        dead = [ProxyServer() for _ in range(args.dead)]
+        proxy_list = [proxy.url.rstrip('/') for proxy in healthy + banned + dead]
+        for proxy in dead:
+            proxy.stop()
+
+        urls = [f'{target.url}page/{i}' for i in range(args.requests)]
+        options = dict(disable_debug_print=True, cache=False, scheduler=False, metrics=False,
+                       backoff_base=args.backoff_base)
+        pool = ProxyPool(proxy_list, max_concurrency=args.max_concurrency)
+        results = {
+            'healthy only': measure(RequestHelper(proxy_list=proxy_list[:args.healthy], proxy_pool=False, **options),
+                                    urls, min(args.threads, args.healthy * args.max_concurrency)),
+            'random.choice': measure(RequestHelper(proxy_list=proxy_list, proxy_pool=False, **options), urls,
+                                     args.threads),
+            'ProxyPool': measure(RequestHelper(proxy_list=proxy_list, proxy_pool=pool, **options), urls,
+                                 args.threads),
+        }
+        for proxy in healthy + banned:
+            proxy.stop()
+
+    print(f'{"":16} {"requests/sec":>12} {"success":>8}')
+    for name, (rate, success) in results.items():
+        print(f'{name:16} {rate:12.1f} {success:8.1%}')
+    print()
+    for label, stats in pool.stats().items():
+        print(f'{label:22} {stats}')
+
+
+if __name__ == '__main__':
+    main()
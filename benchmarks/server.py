@@ -0,0 +1,379 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote
+
+import requests
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Range header asking for the last N bytes of the body, the only kind of ranges supported
+_RGX_SUFFIX_RANGE = re.compile(r'^bytes=-(\d+)$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serves the response of the LocalServer under its network conditions, keeping the connection alive.
+    """
+
+    # HTTP/1.1 is needed for keep-alive connections
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, Nagle's algorithm would delay the body until the client's ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server.local_server
+        status, headers, body = server.conditioned_response(self.path)
+        match = _RGX_SUFFIX_RANGE.match(self.headers.get('Range', ''))
+        if status == 200 and match and int(match[1]) < len(body):
+            size = len(body)
+            status, body = 206, body[size - int(match[1]):]
+            headers = {**headers, 'Content-Range': f'bytes {size - len(body)}-{size - 1}/{size}'}
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            server.write_body(self.wfile, body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client has closed the connection without reading the whole body
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # keep the benchmark output clean
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    # the default backlog of 5 drops the connections opened by many threads at once, they wait for the SYN retry
+    request_queue_size = 128
+
+
+class LocalServer:
+    """
+    Local HTTP server running in a background thread, used as a stand-in for the real sites in benchmarks. Network
+    conditions (latency, bandwidth, server errors, rate limiting) can be simulated.
+
+    Usage::
+
+        with LocalServer() as server:
+            requests.get(server.url)
+    """
+
+    def __init__(self, body=b'<html><body>benchmark</body></html>', host='127.0.0.1', port=0, *, latency=0.0,
+                 jitter=0.0, bandwidth=None, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+        """
+        __init__ method for the class.
+
+        :param bytes body: Body served for every request.
+        :param str host: Interface to listen on.
+        :param int port: Port to listen on, 0 picks a free port.
+        :param float latency: Seconds waited before every response.
+        :param float jitter: Maximum number of seconds randomly added to the latency.
+        :param float bandwidth: Bytes per second for sending the body of every response, unlimited if None.
+        :param float error_rate: Fraction of requests answered by 503.
+        :param float throttle_rate: Fraction of requests answered by 429 with Retry-After header.
+        :param int retry_after: Value of the Retry-After header of the 429 responses.
+        :param int seed: Seed of the random generator deciding about the errors and the jitter.
+        """
+        self.body = body
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+        # number of responses sent by status code and number of bytes of the bodies sent
+        self.counts = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.local_server = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        :return str: Base url of the server.
+        """
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def respond(self, path):
+        """
+        Creates the response for the request, override it to serve different pages.
+
+        :param str path: Requested path including the query.
+        :return tuple: Status code, dictionary of headers and body.
+        """
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, self.body
+
+    def conditioned_response(self, path):
+        """
+        Waits for the latency and returns either the injected error or the response of the respond method.
+
+        :param str path: Requested path including the query.
+        :return tuple: Status code, dictionary of headers and body.
+        """
+        with self._lock:
+            draw = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if draw < self.throttle_rate:
+            response = 429, {'Retry-After': str(self.retry_after)}, b'Too Many Requests'
+        elif draw < self.throttle_rate + self.error_rate:
+            response = 503, {}, b'Service Unavailable'
+        else:
+            response = self.respond(path)
+        with self._lock:
+            self.counts[response[0]] += 1
+        return response
+
+    def write_body(self, wfile, body):
+        """
+        Writes the body, limited by the bandwidth.
+
+        :param wfile: Output stream of the connection.
+        :param bytes body: Body to be written.
+        """
+        if not self.bandwidth:
+            wfile.write(body)
+            self._count_sent(len(body))
+            return
+        # chunks of 1/20 s worth of data
+        chunk_size = max(1, int(self.bandwidth / 20))
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            wfile.write(chunk)
+            self._count_sent(len(chunk))
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def _count_sent(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # shutdown waits for serve_forever, which never runs if the server was not started
+        if self._thread is not None:
+            self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def load_fixture(name):
+    """
+    :param str name: File name of the fixture.
+    :return bytes: Raw content of the fixture page.
+    """
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class ReplayServer(LocalServer):
+    """
+    Replays the fixture pages as a small copy of all the crawled sites:
+
+    - /heureka/?f=N - Heureka listing pages, every page lists different eshops,
+    - /heureka/<shop>/recenze/?f=N - Heureka detail and review pages linking to the eshops,
+    - /eshop/<shop>/ - eshop homepages with different Instagram link patterns (and without any),
+    - /eshop/<shop>/kontakt/, /eshop/<shop>/o-nas/ - other pages of the eshops, one of them links Instagram for two
+      thirds of the eshops,
+    - /instagram/<account>/ - Instagram profiles, every tenth account does not exist,
+    - /instagram/graphql/query/?variables=... - next pages of the posts of the profiles, by the media cursor.
+
+    Use heureka_url, instagram_url and instagram_media_url as the START_URL of Heureka and profile_url and media_url
+    of Instagram.
+    """
+
+    HTML_HEADERS = {'Content-Type': 'text/html; charset=utf-8'}
+
+    # eshop homepages, picked by the hash of the eshop
+    ESHOP_FIXTURES = ('eshop_small.html', 'eshop_large.html', 'eshop_variants.html', 'eshop_no_instagram.html')
+
+    # other pages of the eshops, one of them (picked by the hash of the eshop) links Instagram, or none of them
+    ESHOP_PAGES = ('kontakt', 'o-nas')
+
+    # Instagram link of the contact fixture, removed from the pages which do not link Instagram
+    _CONTACT_INSTAGRAM = b'<li><a href="https://www.instagram.com/obchod.cz/">Instagram</a></li>\n'
+
+    # number of review pages of every eshop, the detail fixture says there are 12 345 reviews, 30 per page
+    REVIEW_PAGES = 412
+
+    # Instagram account of the fixture eshop pages, replaced by the account of the eshop
+    FIXTURE_ACCOUNT = b'/obchod.cz'
+
+    # number of posts of every Instagram profile, as the fixture says, and of the posts on its first page
+    INSTAGRAM_POSTS = 874
+    INSTAGRAM_FIRST_PAGE = 12
+
+    _RGX_NEXT_LINK = re.compile(rb'<a rel="next" href="\?f=\d+">')
+    _RGX_SHOP_PATH = re.compile(r'^/heureka/(?P<shop>[\w-]+)/recenze/$')
+
+    def __init__(self, *args, pages=100, **kwargs):
+        """
+        __init__ method for the class, see LocalServer for the other arguments.
+
+        :param int pages: Number of Heureka listing pages, 20 eshops each.
+        """
+        super().__init__(*args, **kwargs)
+        self.pages = pages
+        self._listing = load_fixture('heureka_listing.html')
+        self._detail = load_fixture('heureka_detail.html')
+        self._eshops = [load_fixture(name) for name in self.ESHOP_FIXTURES]
+        self._contact = load_fixture('eshop_contact.html')
+        self._profile = load_fixture('instagram_profile.html')
+        self._not_found = load_fixture('instagram_not_found.html')
+
+    @property
+    def heureka_url(self):
+        return self.url + 'heureka/'
+
+    def instagram_url(self, account):
+        """
+        :param str account: Instagram account name.
+        :return str: Url of the profile page of the account.
+        """
+        return f'{self.url}instagram/{account}/'
+
+    def instagram_media_url(self, user_id, first, after):
+        """
+        :param str user_id: Instagram id of the user.
+        :param int first: Number of posts.
+        :param str after: Media cursor.
+        :return str: Url of the page of the posts following the cursor.
+        """
+        variables = json.dumps({'id': user_id, 'first': first, 'after': after}, separators=(',', ':'))
+        return f'{self.url}instagram/graphql/query/?variables={quote(variables)}'
+
+    @staticmethod
+    def _pick(name, count):
+        """
+        :return int: Stable pseudo-random number from 0 to count - 1 for the name.
+        """
+        return zlib.crc32(name.encode()) % count
+
+    def respond(self, path):
+        split = urlsplit(path)
+        if split.path == '/heureka/':
+            return 200, self.HTML_HEADERS, self._listing_page(int(parse_qs(split.query).get('f', ['1'])[0]))
+
+        match = self._RGX_SHOP_PATH.match(split.path)
+        if match:
+            eshop_url = f'{self.url}eshop/{match["shop"]}/'
+            body = self._detail.replace(b'https://www.obchod.cz/', eshop_url.encode())
+            page = int(parse_qs(split.query).get('f', ['1'])[0])
+            return 200, self.HTML_HEADERS, self._with_next_link(body, page, self.REVIEW_PAGES)
+
+        parts = split.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'eshop':
+            return 200, self.HTML_HEADERS, self._eshop_page(parts[1], self._eshops[self._pick(parts[1],
+                                                                                              len(self._eshops))])
+        if len(parts) == 3 and parts[0] == 'eshop' and parts[2] in self.ESHOP_PAGES:
+            body = self._contact
+            if self._pick(parts[1], len(self.ESHOP_PAGES) + 1) != self.ESHOP_PAGES.index(parts[2]):
+                body = body.replace(self._CONTACT_INSTAGRAM, b'')
+            return 200, self.HTML_HEADERS, self._eshop_page(parts[1], body)
+        if split.path == '/instagram/graphql/query/':
+            variables = json.loads(parse_qs(split.query)['variables'][0])
+            return 200, {'Content-Type': 'application/json'}, self._media_page(variables['first'], variables['after'])
+        if len(parts) == 2 and parts[0] == 'instagram':
+            if self._pick(parts[1], 10) == 0:
+                return 404, self.HTML_HEADERS, self._not_found
+            return 200, self.HTML_HEADERS, self._profile
+        return 404, self.HTML_HEADERS, b'<html><body>Not Found</body></html>'
+
+    def _eshop_page(self, shop, body):
+        """
+        :param str shop: Name of the eshop.
+        :param bytes body: Fixture page.
+        :return bytes: The page with the Instagram account of the eshop, the site-relative links lead to its pages.
+        """
+        body = body.replace(b'href="/', f'href="/eshop/{shop}/'.encode())
+        return body.replace(self.FIXTURE_ACCOUNT, b'/' + shop.replace('-', '_').encode())
+
+    def _listing_page(self, page):
+        """
+        :param int page: Number of the listing page.
+        :return bytes: Listing page with eshops unique for the page and the link to the next page.
+        """
+        body = self._listing.replace(b'href="/obchod-', f'href="/heureka/p{page}-obchod-'.encode())
+        return self._with_next_link(body, page, self.pages)
+
+    def _media_page(self, first, after):
+        """
+        :param int first: Number of posts.
+        :param str after: Media cursor, 'offset-N' or the cursor of the fixture profile (the first page).
+        :return bytes: JSON of the posts following the cursor, one post a day with pseudo-random likes and comments.
+        """
+        offset = int(after[len('offset-'):]) if after.startswith('offset-') else self.INSTAGRAM_FIRST_PAGE
+        end = min(offset + first, self.INSTAGRAM_POSTS)
+        edges = []
+        for index in range(offset, end):
+            rnd = random.Random(index)
+            edges.append({'node': {'id': str(2000000000000000000 + index),
+                                   'taken_at_timestamp': 1580000000 - index * 86400,
+                                   'edge_liked_by': {'count': int(rnd.lognormvariate(6, 1))},
+                                   'edge_media_to_comment': {'count': int(rnd.lognormvariate(2, 1))}}})
+        media = {'count': self.INSTAGRAM_POSTS, 'edges': edges,
+                 'page_info': {'has_next_page': end < self.INSTAGRAM_POSTS, 'end_cursor': f'offset-{end}'}}
+        return json.dumps({'data': {'user': {'edge_owner_to_timeline_media': media}}, 'status': 'ok'}).encode()
+
+    def _with_next_link(self, body, page, pages):
+        """
+        :return bytes: The body with the link to the page after the given one, without it for the last page.
+        """
+        next_link = f'<a rel="next" href="?f={page + 1}">'.encode() if page < pages else b'<a>'
+        return self._RGX_NEXT_LINK.sub(next_link, body)
+
+
+class ProxyServer(LocalServer):
+    """
+    Forward HTTP proxy, used as a stand-in for the proxies of RequestHelper in benchmarks. It forwards the requests
+    (sent with the absolute url as the path) to the target, after the latency of the proxy. A fraction of them is
+    refused by the proxy itself (403 with the Proxy-Status header) as if it denied the access. A stopped ProxyServer
+    stands in for a dead proxy, its port refuses the connections.
+    """
+
+    def __init__(self, *args, ban_rate=0.0, **kwargs):
+        """
+        __init__ method for the class, see LocalServer for the other arguments.
+
+        :param float ban_rate: Fraction of requests refused by 403 instead of being forwarded.
+        """
+        super().__init__(*args, **kwargs)
+        self.ban_rate = ban_rate
+        # the proxy must not use the proxies of the environment
+        self._session = requests.Session()
+        self._session.trust_env = False
+
+    def respond(self, path):
+        with self._lock:
+            banned = self._random.random() < self.ban_rate
+        if banned:
+            return 403, {'Proxy-Status': 'benchmark; error=destination_ip_prohibited'}, b'Forbidden'
+        r = self._session.get(path, headers={'Accept-Encoding': 'identity'})
+        return r.status_code, {'Content-Type': r.headers.get('Content-Type', 'text/html')}, r.content
@@ -0,0 +1,54 @@
+"""
+Compares requests/sec of bare requests.get calls (a new connection per request) with the pooled keep-alive
+session of RequestHelper against a local server.
+
+Run from the repository root::
+
+    python -m benchmarks.sessions --requests 2000 --threads 30
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from req import RequestHelper
+from benchmarks.server import LocalServer
+
+
+def measure(fetch, urls, threads):
+    """
+    Runs fetch over all urls in the given number of threads.
+
+    :param callable fetch: Function taking url as the only argument.
+    :param list urls: Urls to fetch.
+    :param int threads: Number of threads.
+    :return float: Requests per second.
+    """
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(threads) as t:
+        list(t.map(fetch, urls))
+    return len(urls) / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Number of requests in each run.')
+    parser.add_argument('--threads', type=int, default=30, help='Number of concurrent threads.')
+    args = parser.parse_args()
+
+    with LocalServer() as server:
+        # distinct urls, so that the response cache does not influence the result
+        urls = [f'{server.url}?page={i}' for i in range(args.requests)]
+
+        before = measure(lambda url: requests.get(url, timeout=10), urls, args.threads)
+        req = RequestHelper(disable_debug_print=True, cache=False, scheduler=False, pool_maxsize=args.threads)
+        after = measure(req.make_request, urls, args.threads)
+
+    print(f'bare requests.get:      {before:8.1f} requests/sec')
+    print(f'RequestHelper session:  {after:8.1f} requests/sec')
+    print(f'speed-up:               {after / before:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+End-to-end benchmark of the download stages against the local ReplayServer, which serves the fixture pages in place
+of Heureka, the eshops and Instagram. Every stage (Heureka, EshopWebsite, Instagram) is run in the serial and
+the threaded mode and the suite reports items/sec, p50 and p99 latency of the requests and peak memory. Results are
+saved as JSON, so they can be compared with a previous run.
+
+Run from the repository root::
+
+    python -m benchmarks.stages --eshops 200 --latency 0.02 --throttle-rate 0.01 --compare benchmarks/results/last.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+import warnings
+
+from heureka import Heureka
+from eshop_web import EshopWebsite
+from instagram import Instagram
+from req import RequestHelper
+from benchmarks.server import ReplayServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+MODES = ('serial', 'threaded')
+
+
+class _TimedRequestHelper(RequestHelper):
+    """
+    RequestHelper recording the duration of every make_request call, including retries and waits.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def make_request(self, url, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return super().make_request(url, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+
+def _stages(server):
+    """
+    :param ReplayServer server: Running server.
+    :return dict: Stage name -> function creating the stage for the mode and the RequestHelper.
+    """
+    # the stages are pointed to the local server
+    heureka = type('Heureka', (Heureka,), {'START_URL': server.heureka_url})
+    instagram = type('Instagram', (Instagram,), {'profile_url': staticmethod(server.instagram_url)})
+    return {
+        'Heureka': lambda mode, req: heureka(req, use_multiple_threads=mode == 'threaded'),
+        'EshopWebsite': lambda mode, req: EshopWebsite(req, concurrent_threads_count=1 if mode == 'serial' else 30),
+        'Instagram': lambda mode, req: instagram(req, use_multiple_threads=mode == 'threaded', keep_full_json=False),
+    }
+
+
+def _percentile(values, percent):
+    """
+    :param list values: Measured values.
+    :param int percent: Percentile from 1 to 99.
+    :return float: The percentile, 0 for no values.
+    """
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def measure(create_stage, input_data, req_kwargs, trace_memory):
+    """
+    Runs a single stage over the input data.
+
+    :param callable create_stage: Function taking the RequestHelper and returning the stage.
+    :param list input_data: Input of the run method of the stage.
+    :param dict req_kwargs: Keyword arguments of the RequestHelper.
+    :param bool trace_memory: If True, only the peak memory is measured. Tracing slows the stage down, so the timing
+                              is measured in a separate run.
+    :return dict: Measured values.
+    """
+    req = _TimedRequestHelper(**req_kwargs)
+    stage = create_stage(req)
+    if trace_memory:
+        tracemalloc.start()
+        stage.run(input_data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {'peak_memory_kib': peak / 1024}
+
+    start_time = time.perf_counter()
+    stage.run(input_data)
+    seconds = time.perf_counter() - start_time
+    return {
+        'items': len(stage.output),
+        'requests': len(req.latencies),
+        'seconds': seconds,
+        'items_per_sec': len(stage.output) / seconds,
+        'p50_ms': _percentile(req.latencies, 50) * 1000,
+        'p99_ms': _percentile(req.latencies, 99) * 1000,
+    }
+
+
+def run(eshops=100, *, server_kwargs=None, req_kwargs=None, trace_memory=True):
+    """
+    Runs all stages in all modes. The input of the eshop and Instagram stages is the output of the previous stage.
+
+    :param int eshops: Number of eshops downloaded from Heureka.
+    :param dict server_kwargs: Keyword arguments of the ReplayServer (network conditions).
+    :param dict req_kwargs: Keyword arguments of the RequestHelper.
+    :param bool trace_memory: If True, peak memory of every stage is measured in an additional run.
+    :return dict: Results keyed by 'stage/mode'.
+    """
+    # the cache would turn all but the first run into no-ops
+    req_kwargs = {'disable_debug_print': True, 'cache': False, 'scheduler': False, **(req_kwargs or {})}
+    results = {}
+    with ReplayServer(**(server_kwargs or {})) as server:
+        stages = _stages(server)
+        inputs = {'Heureka': eshops}
+        for name, create in stages.items():
+            for mode in MODES:
+                counts_before = server.counts.copy()
+                result = measure(lambda req: create(mode, req), inputs[name], req_kwargs, trace_memory=False)
+                served = server.counts - counts_before
+                result['served_429'], result['served_503'] = served[429], served[503]
+                if trace_memory:
+                    result.update(measure(lambda req: create(mode, req), inputs[name], req_kwargs, trace_memory=True))
+                results[f'{name}/{mode}'] = result
+
+            # the output of the serial run is the input of the next stage
+            stage = create('serial', RequestHelper(**req_kwargs))
+            stage.run(inputs[name])
+            if name == 'Heureka':
+                inputs['EshopWebsite'] = [eshop['link'] for eshop in stage.output]
+            elif name == 'EshopWebsite':
+                inputs['Instagram'] = sorted({eshop['instagram'] for eshop in stage.output if eshop['instagram']})
+    return results
+
+
+def _git_revision():
+    """
+    :return str: Current git commit, None outside of the git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results, config, path=None):
+    """
+    Saves the results together with the configuration of the run.
+
+    :param dict results: Results returned by run.
+    :param dict config: Configuration of the run.
+    :param str path: Path to the JSON file, by default a new file in benchmarks/results.
+    :return str: Path to the saved file.
+    """
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, time.strftime('stages-%Y%m%d-%H%M%S.json'))
+    with open(path, 'w') as f:
+        json.dump({'revision': _git_revision(), 'created': time.time(), 'config': config, 'results': results}, f,
+                  indent=2)
+    return path
+
+
+def compare(results, previous):
+    """
+    :param dict results: Results returned by run.
+    :param dict previous: Results of the previous run.
+    :return dict: Relative change of items/sec and p99 latency keyed by 'stage/mode', positive is better.
+    """
+    changes = {}
+    for key, result in results.items():
+        if key not in previous:
+            continue
+        before = previous[key]
+        changes[key] = {
+            'items_per_sec': result['items_per_sec'] / before['items_per_sec'] - 1 if before['items_per_sec'] else 0,
+            'p99_ms': 1 - result['p99_ms'] / before['p99_ms'] if before['p99_ms'] else 0,
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--eshops', type=int, default=100, help='Number of eshops downloaded from Heureka.')
+    parser.add_argument('--latency', type=float, default=0.01, help='Server latency in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum random addition to the latency.')
+    parser.add_argument('--bandwidth', type=float, help='Server bandwidth in bytes/sec per response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 503 responses.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of 429 responses.')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of the 429 responses.')
+    parser.add_argument('--backoff-base', type=float, default=0.1, help='Backoff of the RequestHelper.')
+    parser.add_argument('--scheduler', action='store_true', help='Use the rate limiting scheduler.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the memory measurement.')
+    parser.add_argument('--save', help='Path to the results file, by default a new file in benchmarks/results.')
+    parser.add_argument('--compare', help='Path to the results file of a previous run.')
+    args = parser.parse_args()
+
+    server_kwargs = {'latency': args.latency, 'jitter': args.jitter, 'bandwidth': args.bandwidth,
+                     'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+                     'retry_after': args.retry_after, 'pages': args.eshops // 20 + 1}
+    req_kwargs = {'backoff_base': args.backoff_base}
+    if args.scheduler:
+        req_kwargs['scheduler'] = None
+
+    with warnings.catch_warnings():
+        # retries of the injected errors would flood the output
+        warnings.simplefilter('ignore')
+        results = run(args.eshops, server_kwargs=server_kwargs, req_kwargs=req_kwargs,
+                      trace_memory=not args.no_memory)
+
+    print(f'\n{"stage":24} {"items":>6} {"items/sec":>10} {"p50 ms":>8} {"p99 ms":>8} {"429":>5} {"503":>5} '
+          f'{"peak KiB":>9}')
+    for key, result in results.items():
+        print(f'{key:24} {result["items"]:6} {result["items_per_sec"]:10.1f} {result["p50_ms"]:8.1f} '
+              f'{result["p99_ms"]:8.1f} {result["served_429"]:5} {result["served_503"]:5} '
+              f'{result.get("peak_memory_kib", float("nan")):9.0f}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+        print(f'\n{"compared to " + args.compare:40}')
+        for key, change in compare(results, previous).items():
+            print(f'{key:24} items/sec {change["items_per_sec"]:+7.1%}   p99 {change["p99_ms"]:+7.1%}')
+
+    config = {'eshops': args.eshops, 'server': server_kwargs, 'req': req_kwargs}
+    print(f'\nResults saved to {save(results, config, args.save)}')
+
+
+if __name__ == '__main__':
+    main()
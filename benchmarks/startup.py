@@ -0,0 +1,77 @@
+"""
+Benchmark of the start-up time: imports every module (and runs the CLI with --help) in a fresh interpreter and
+reports the median wall time, compared to the bare interpreter. It also checks that the heavy modules (pandas,
+matplotlib, parsel, pyarrow, asyncio) are not imported by the modules which do not need them.
+
+Run from the repository root::
+
+    python -m benchmarks.startup --repeat 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# statements measured in the fresh interpreter
+TARGETS = {
+    'python (bare)': 'pass',
+    'import req': 'import req',
+    'import heureka': 'import heureka',
+    'import eshop_web': 'import eshop_web',
+    'import instagram': 'import instagram',
+    'import download': 'import download',
+    'import shard': 'import shard',
+    'import refresh': 'import refresh',
+    'import data_processing_python': 'import data_processing_python',
+    'cli --help': 'import sys, cli; sys.argv[1:] = ["--help"]; cli.main()',
+}
+
+# modules which are not needed to start a worker or to import a stage
+HEAVY_MODULES = ('pandas', 'matplotlib', 'parsel', 'pyarrow', 'asyncio', 'tqdm')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(statement, repeat):
+    """
+    :param str statement: Python statement run by `python -c`.
+    :param int repeat: Number of runs.
+    :return float: Median wall time of the interpreter in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=_ROOT, check=False, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(times)
+
+
+def heavy_modules(statement):
+    """
+    :param str statement: Python statement run by `python -c`.
+    :return list: Heavy modules imported by the statement.
+    """
+    check = f'{statement}\nimport sys; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    lines = subprocess.run([sys.executable, '-c', check], cwd=_ROOT, capture_output=True, text=True).stdout.split()
+    return lines[-1].split(',') if lines else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10, help='Number of runs of every statement.')
+    args = parser.parse_args()
+
+    print(f'{"statement":32} {"median ms":>10} {"over bare":>10}  heavy modules')
+    baseline = None
+    for name, statement in TARGETS.items():
+        milliseconds = measure(statement, args.repeat)
+        baseline = milliseconds if baseline is None else baseline
+        heavy = ', '.join(heavy_modules(statement)) if name != 'cli --help' else ''
+        print(f'{name:32} {milliseconds:10.1f} {milliseconds - baseline:10.1f}  {heavy}')
+
+
+if __name__ == '__main__':
+    main()
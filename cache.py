@@ -0,0 +1,284 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class CachedResponse:
+    """
+    A single entry read from the ResponseCache.
+    """
+
+    def __init__(self, url, status_code, headers, content, etag, last_modified, fetched_at, ttl):
+        """
+        __init__ method for the class.
+
+        :param str url: Url the response belongs to.
+        :param int status_code: HTTP status code of the stored response.
+        :param dict headers: Stored response headers.
+        :param bytes content: Decoded (uncompressed) body of the response.
+        :param str etag: Value of the ETag header, if any.
+        :param str last_modified: Value of the Last-Modified header, if any.
+        :param float fetched_at: Unix time of the last (re)validation.
+        :param float ttl: Number of seconds the entry is considered fresh.
+        """
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+    @property
+    def is_fresh(self):
+        """
+        :return bool: True if the entry can be served without contacting the server.
+        """
+        return time.time() - self.fetched_at < self.ttl
+
+    def validators(self):
+        """
+        Headers for the conditional revalidation of the entry.
+
+        :return dict: If-None-Match and/or If-Modified-Since headers.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_response(self):
+        """
+        Builds requests.Response object, so the cached entry can be used as if it was downloaded.
+
+        :return requests.Response: Response object
+        """
+        r = requests.Response()
+        r.url = self.url
+        r.status_code = self.status_code
+        r.headers = CaseInsensitiveDict(self.headers)
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = self.content
+        r.from_cache = True
+        return r
+
+
+class ResponseCache:
+    """
+    Persistent HTTP cache stored in SQLite. Bodies are zlib-compressed and stored by their sha1 hash, so the same
+    page served under several urls is stored only once. One instance can be shared by all threads.
+    """
+
+    # only these status codes are worth storing, the rest is retried anyway
+    CACHEABLE_STATUS_CODES = {200, 203, 300, 301, 404, 410}
+
+    # headers describing the transfer, they are not valid for the decoded body we store
+    _DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+    def __init__(self, path='.http_cache.sqlite', *, default_ttl=24 * 3600, domain_ttl=None,
+                 max_size_bytes=512 * 1024 ** 2, compression_level=6):
+        """
+        __init__ method for the class.
+
+        :param str path: Path to the SQLite file, ':memory:' keeps the cache only for the lifetime of the object.
+        :param float default_ttl: Number of seconds after which the entry needs to be revalidated.
+        :param dict domain_ttl: Mapping of domain to TTL in seconds, e.g. {'instagram.com': 3600}. Subdomains match too.
+        :param int max_size_bytes: Maximum size of the compressed bodies, least recently used entries are evicted.
+        :param int compression_level: zlib compression level.
+        """
+        self.path = path
+        self.default_ttl = default_ttl
+        self.domain_ttl = domain_ttl or {}
+        self.max_size_bytes = max_size_bytes
+        self.compression_level = compression_level
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body_hash TEXT NOT NULL REFERENCES bodies(hash),
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries(accessed_at);
+            CREATE INDEX IF NOT EXISTS entries_body_hash ON entries(body_hash);
+        """)
+
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stored': 0, 'evicted': 0,
+                       'bytes_served': 0, 'bytes_stored': 0}
+        # running size of the bodies, so store does not sum the table every time
+        self._size = self._total_size()
+
+    def ttl_for(self, url):
+        """
+        Returns TTL for the given url based on its domain.
+
+        :param str url: Url
+        :return float: TTL in seconds.
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        for domain, ttl in self.domain_ttl.items():
+            if host == domain or host.endswith('.' + domain):
+                return ttl
+        return self.default_ttl
+
+    def get(self, url):
+        """
+        Reads the entry for the url, both fresh and stale entries are returned.
+
+        :param str url: Url
+        :return CachedResponse: Cached entry or None if the url is not in the cache.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT e.status_code, e.headers, b.data, e.etag, e.last_modified, e.fetched_at '
+                'FROM entries e JOIN bodies b ON b.hash = e.body_hash WHERE e.url = ?', (url,)).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            self._connection.execute('UPDATE entries SET accessed_at = ? WHERE url = ?', (time.time(), url))
+
+        status_code, headers, data, etag, last_modified, fetched_at = row
+        entry = CachedResponse(url, status_code, json.loads(headers), zlib.decompress(data), etag, last_modified,
+                               fetched_at, self.ttl_for(url))
+        with self._lock:
+            if entry.is_fresh:
+                self._stats['hits'] += 1
+                self._stats['bytes_served'] += len(entry.content)
+            else:
+                self._stats['misses'] += 1
+        return entry
+
+    def revalidated(self, entry):
+        """
+        Marks the entry as fresh again after the server answered 304 Not Modified.
+
+        :param CachedResponse entry: Entry returned by the get method.
+        """
+        entry.fetched_at = time.time()
+        with self._lock:
+            self._connection.execute('UPDATE entries SET fetched_at = ? WHERE url = ?', (entry.fetched_at, entry.url))
+            self._stats['revalidated'] += 1
+            self._stats['bytes_served'] += len(entry.content)
+
+    def store(self, url, response):
+        """
+        Stores the response in the cache, if it is cacheable.
+
+        :param str url: Url which was requested (can differ from response.url after redirects).
+        :param requests.Response response: Downloaded response.
+        """
+        if response.status_code not in self.CACHEABLE_STATUS_CODES:
+            return
+        if 'no-store' in response.headers.get('cache-control', '').lower():
+            return
+
+        content = response.content
+        body_hash = hashlib.sha1(content).hexdigest()
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in self._DROPPED_HEADERS}
+        now = time.time()
+
+        with self._lock:
+            previous = self._connection.execute('SELECT body_hash FROM entries WHERE url = ?', (url,)).fetchone()
+            exists = self._connection.execute('SELECT 1 FROM bodies WHERE hash = ?', (body_hash,)).fetchone()
+            if not exists:
+                data = zlib.compress(content, self.compression_level)
+                self._connection.execute('INSERT INTO bodies (hash, data, size) VALUES (?, ?, ?)',
+                                         (body_hash, data, len(data)))
+                self._stats['bytes_stored'] += len(data)
+                self._size += len(data)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(url, status_code, headers, body_hash, etag, last_modified, fetched_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, response.status_code, json.dumps(headers), body_hash, response.headers.get('etag'),
+                 response.headers.get('last-modified'), now, now))
+            self._stats['stored'] += 1
+            if previous and previous[0] != body_hash:
+                self._delete_body_if_orphan(previous[0])
+            if self._size > self.max_size_bytes:
+                self._evict()
+
+    def _delete_body_if_orphan(self, body_hash):
+        """
+        Removes the body if it is not referenced by any entry. Must be called with the lock held.
+
+        :param str body_hash: Hash of the body.
+        """
+        row = self._connection.execute('SELECT size FROM bodies WHERE hash = ? AND NOT EXISTS '
+                                       '(SELECT 1 FROM entries WHERE body_hash = ?)', (body_hash, body_hash)).fetchone()
+        if row is not None:
+            self._connection.execute('DELETE FROM bodies WHERE hash = ?', (body_hash,))
+            self._size -= row[0]
+
+    def _total_size(self):
+        """
+        :return int: Size of all stored bodies, summed over the whole table.
+        """
+        return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    def _evict(self):
+        """
+        Evicts the least recently used entries until the cache fits into max_size_bytes. Must be called with
+        the lock held.
+        """
+        # the running size is recounted once, other processes sharing the file may have changed it
+        self._size = self._total_size()
+        while self._size > self.max_size_bytes:
+            row = self._connection.execute(
+                'SELECT url, body_hash FROM entries ORDER BY accessed_at LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._connection.execute('DELETE FROM entries WHERE url = ?', (row[0],))
+            self._delete_body_if_orphan(row[1])
+            self._stats['evicted'] += 1
+
+    def clear(self):
+        """
+        Removes everything from the cache.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+            self._connection.execute('DELETE FROM bodies')
+            self._size = 0
+
+    @property
+    def stats(self):
+        """
+        Statistics of the cache usage since the object was created.
+
+        :return dict: hits, misses, revalidated, stored and evicted counts, bytes served from and stored to the cache,
+                      number of entries and size of the stored (compressed) bodies.
+        """
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            return dict(self._stats, entries=entries, size_bytes=self._total_size())
+
+    def close(self):
+        """
+        Closes the underlying SQLite connection.
+        """
+        with self._lock:
+            self._connection.close()
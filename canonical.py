@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# query parameters which only track the visitor, they do not change the page
+TRACKING_PARAMETERS = {'gclid', 'fbclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid'}
+
+# paths of instagram.com which are not accounts
+INSTAGRAM_RESERVED = {'p', 'explore', 'accounts', 'stories', 'tv', 'reel', 'reels', 'direct', 'about', 'developer',
+                      'legal', 'web', 'graphql', 'static', '_u', 'instagram'}
+
+# redirects cached without time limit
+PERMANENT_REDIRECTS = {301, 308}
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_RGX_ACCOUNT = re.compile(r'^[\w][\w.]{0,29}$')
+
+
+def url_key(url):
+    """
+    Canonical form of the url used to find the urls of the same page: lowercase host without 'www.' and the default
+    port, path without the trailing slash, query without the tracking parameters, no scheme and no fragment.
+
+    :param str url: Url, the scheme can be missing.
+    :return str: Canonical key of the url, e.g. 'obchod.cz/kontakt' for 'HTTPS://www.Obchod.cz/kontakt/#top'.
+    """
+    url = url.strip()
+    split = urlsplit(url if '//' in url else '//' + url)
+    host = (split.hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    port = split.port if split.port and split.port != _DEFAULT_PORTS.get(split.scheme.lower()) else None
+    path = re.sub(r'/{2,}', '/', split.path).rstrip('/')
+    query = urlencode([(name, value) for name, value in parse_qsl(split.query, keep_blank_values=True)
+                       if name.lower() not in TRACKING_PARAMETERS and not name.lower().startswith('utm_')])
+    return f'{host}{f":{port}" if port else ""}{path}{"?" + query if query else ""}'
+
+
+def canonical_account(account):
+    """
+    Instagram accounts are case-insensitive, links to them can have trailing dots or slashes.
+
+    :param str account: Instagram account name as found in the link.
+    :return str: Lowercase account name, None if it is not an account (e.g. 'p' of the links to posts).
+    """
+    account = (account or '').strip().strip('/').rstrip('.').lower()
+    if account in INSTAGRAM_RESERVED or not _RGX_ACCOUNT.match(account):
+        return None
+    return account
+
+
+def deduplicate(items, key):
+    """
+    :param list items: Input items, e.g. urls.
+    :param callable key: Function returning the canonical key of the item.
+    :return tuple: Distinct items (the first item of every key) and the position of the distinct item of every
+                   input item, so the results can be fanned out by fan_out.
+    """
+    positions, distinct, index = {}, [], []
+    for item in items:
+        item_key = key(item)
+        if item_key not in positions:
+            positions[item_key] = len(distinct)
+            distinct.append(item)
+        index.append(positions[item_key])
+    return distinct, index
+
+
+def fan_out(items, index, results, copy_for=None):
+    """
+    :param list items: Input items passed to deduplicate.
+    :param list index: Positions returned by deduplicate.
+    :param list results: Results of the distinct items.
+    :param callable copy_for: Function taking the item and the result of its distinct item and returning the result
+                              for the item, e.g. with the url of the item. The result itself is used if None.
+    :return list: Result of every input item.
+    """
+    if copy_for is None:
+        return [results[position] for position in index]
+    return [copy_for(item, results[position]) for item, position in zip(items, index)]
+
+
+class SingleFlight:
+    """
+    Calls the function only once per key: concurrent callers with the same key wait for the first call and share its
+    result, later callers get the kept result. Used by the streaming download, where the duplicates are not known
+    in advance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def call(self, key, func):
+        """
+        :param key: Canonical key of the work, e.g. url_key of the url.
+        :param callable func: Function without arguments doing the work.
+        :return: Result of the first call for the key.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            first = future is None
+            if first:
+                future = self._futures[key] = Future()
+        if first:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                # the failed work is not kept, the next caller tries again
+                with self._lock:
+                    del self._futures[key]
+                future.set_exception(e)
+        return future.result()
+
+
+class RedirectCache:
+    """
+    Remembers where the urls redirect, so the next request for the url (or for any url of the same redirect chain)
+    goes directly to the target without the redirect hops. Permanent redirects are kept forever, the temporary ones
+    for the ttl. One instance can be shared by all threads.
+    """
+
+    def __init__(self, ttl=3600, max_entries=100000):
+        """
+        __init__ method for the class.
+
+        :param float ttl: Number of seconds temporary redirects (302, 303, 307) are kept.
+        :param int max_entries: Maximum number of cached urls, the oldest entries are dropped first.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # url -> (target url, expiration time or None)
+        self._targets = {}
+
+    def record(self, hops, final_url):
+        """
+        Records the redirect chain of a response.
+
+        :param list hops: Url and status code of every redirect response, in order.
+        :param str final_url: Url of the final response.
+        """
+        expires = None
+        with self._lock:
+            # the hop leads to the final url permanently only if all the following hops are permanent too
+            for url, status_code in reversed(hops):
+                if status_code not in PERMANENT_REDIRECTS:
+                    expires = time.time() + self.ttl
+                if url != final_url:
+                    self._targets.pop(url, None)
+                    self._targets[url] = (final_url, expires)
+            while len(self._targets) > self.max_entries:
+                del self._targets[next(iter(self._targets))]
+
+    def resolve(self, url):
+        """
+        :param str url: Requested url.
+        :return str: Known target of the url, the url itself if it does not redirect or the entry has expired.
+        """
+        with self._lock:
+            target, expires = self._targets.get(url, (url, None))
+            if expires is not None and expires < time.time():
+                del self._targets[url]
+                return url
+            return target
+
+    def __len__(self):
+        return len(self._targets)
@@ -0,0 +1,88 @@
+"""
+Command line entry point of the crawl: downloads the eshops of a Heureka category with their pages and Instagram
+profiles (see download.download_all) and writes the merged results.
+
+Usage from the repository root::
+
+    python -m cli --category elektronika --count 200 --threads 50 --cache crawl/cache.sqlite --output results.csv
+    python -m cli --count 2000 --pipelined --journal-dir crawl/journal --store-dir crawl/store
+
+The stages and pandas are imported only after the arguments are parsed, so --help and the argument errors are
+instant.
+"""
+import argparse
+import os
+
+# output formats by the extension of the output file
+OUTPUT_FORMATS = {'.csv': 'to_csv', '.parquet': 'to_parquet', '.json': 'to_json', '.pkl': 'to_pickle'}
+
+
+def parse_args(argv=None):
+    """
+    :param list argv: Arguments, sys.argv[1:] if None.
+    :return argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m cli', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--category', help='Heureka category (e.g. elektronika) or url of its listing page. All '
+                                           'eshops if not supplied.')
+    parser.add_argument('--count', type=int, default=30, help='Number of eshops.')
+    parser.add_argument('--threads', type=int, default=30, help='Number of threads downloading eshop pages.')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Download eshop pages on asyncio event loop instead of threads (needs aiohttp).')
+    parser.add_argument('--pipelined', action='store_true', help='Run the stages at the same time.')
+
+    requests_group = parser.add_argument_group('requests')
+    requests_group.add_argument('--cache', help='Path to the SQLite response cache, kept in memory if not supplied.')
+    requests_group.add_argument('--no-cache', action='store_true', help='Disable the response cache.')
+    requests_group.add_argument('--timeout', type=float, default=10, help='Timeout of a request in seconds.')
+    requests_group.add_argument('--retries', type=int, default=5, help='Maximum number of attempts of a request.')
+    requests_group.add_argument('--verbose', action='store_true', help='Print every attempt of every request.')
+
+    output_group = parser.add_argument_group('output')
+    output_group.add_argument('--output', default='results.csv',
+                              help=f'Path to the results, the format by the extension: {", ".join(OUTPUT_FORMATS)}.')
+    output_group.add_argument('--journal-dir', help='Directory with the journals, an interrupted run is resumed.')
+    output_group.add_argument('--store-dir', help='Directory of the ResultStore, for large runs.')
+    output_group.add_argument('--metrics', help='Path to the metrics report, Prometheus format for .prom files, JSON '
+                                                'otherwise.')
+
+    args = parser.parse_args(argv)
+    extension = os.path.splitext(args.output)[1].lower()
+    if extension not in OUTPUT_FORMATS:
+        parser.error(f'unsupported output format {extension!r}, use one of {", ".join(OUTPUT_FORMATS)}')
+    if args.cache and args.no_cache:
+        parser.error('--cache and --no-cache cannot be used together')
+    return args
+
+
+def main(argv=None):
+    """
+    :param list argv: Arguments, sys.argv[1:] if None.
+    """
+    args = parse_args(argv)
+
+    from download import download_all
+    from req import RequestHelper
+
+    req = RequestHelper(timeout=args.timeout, maximum_retries=args.retries, disable_debug_print=not args.verbose,
+                        cache=False if args.no_cache else args.cache)
+    df = download_all(args.count, req, use_async=args.use_async, pipelined=args.pipelined,
+                      journal_dir=args.journal_dir, store_dir=args.store_dir, category=args.category,
+                      eshop_threads=args.threads)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    getattr(df, OUTPUT_FORMATS[os.path.splitext(args.output)[1].lower()])(args.output)
+    print(f'{len(df)} eshops written to {args.output}.')
+
+    if args.metrics and req.metrics:
+        if args.metrics.endswith('.prom'):
+            req.metrics.write_prometheus(args.metrics)
+        else:
+            req.metrics.write_json(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
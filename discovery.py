@@ -0,0 +1,118 @@
+"""
+Frontier of the pages of a single eshop site, used by EshopWebsite to look for the Instagram link on the pages
+other than the homepage (contacts, about us, ...). The links are scored by the hints in their path and text, only
+the links with a hint are followed, and the number of the pages per site is limited.
+"""
+import heapq
+import itertools
+import re
+from urllib.parse import unquote, urljoin, urlsplit
+
+from canonical import url_key
+
+# hints of the pages linking the social networks and their scores, in the path of the link (lowercase, no diacritics)
+PATH_HINTS = {'socialni-site': 6, 'social': 6, 'kontakt': 5, 'contact': 5, 'o-nas': 4, 'about': 4, 'kdo-jsme': 4,
+              'o-obchodu': 4, 'o-firme': 4, 'o-spolecnosti': 4, 'napiste-nam': 2, 'impressum': 2}
+
+# ... and in the text of the link (lowercase)
+TEXT_HINTS = {'instagram': 8, 'sledujte': 6, 'sociální': 6, 'social': 6, 'kontakt': 5, 'contact': 5, 'o nás': 4,
+              'about': 4, 'kdo jsme': 4, 'o obchodu': 4, 'o firmě': 4, 'o společnosti': 4, 'napište nám': 2}
+
+# links to files, not pages
+SKIPPED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.pdf', '.zip', '.css', '.js', '.xml')
+
+# <a> tag with its href and text, the text is limited so a missing </a> does not swallow the rest of the page
+_RGX_LINK = re.compile(rb"""<a\s[^>]*?href\s*=\s*["']?(?P<href>[^"'\s>]+)[^>]*>(?P<text>.{0,300}?)</a>""",
+                       re.IGNORECASE | re.DOTALL)
+_RGX_TAG = re.compile(rb'<[^>]*>')
+
+
+def _site(url):
+    """
+    :return str: Host of the url without 'www.', the pages of the same site have the same host.
+    """
+    return url_key(urlsplit(url).netloc)
+
+
+def score_link(url, text):
+    """
+    :param str url: Absolute url of the link.
+    :param str text: Text of the link.
+    :return int: Score of the link, 0 if it has no hint.
+    """
+    path, text = unquote(urlsplit(url).path).lower(), text.lower()
+    return (sum(score for hint, score in PATH_HINTS.items() if hint in path)
+            + sum(score for hint, score in TEXT_HINTS.items() if hint in text))
+
+
+def site_links(base_url, content):
+    """
+    :param str base_url: Url of the page, the relative links are resolved against it.
+    :param bytes content: Raw body of the page.
+    :return list: Absolute url and score of the links with a hint to the pages of the same site.
+    """
+    site, links = _site(base_url), []
+    for match in _RGX_LINK.finditer(content):
+        href = match['href'].decode('ascii', errors='ignore')
+        if href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
+            continue
+        url = urljoin(base_url, href).split('#')[0]
+        if (urlsplit(url).scheme not in ('http', 'https') or _site(url) != site
+                or urlsplit(url).path.lower().endswith(SKIPPED_EXTENSIONS)):
+            continue
+        text = _RGX_TAG.sub(b' ', match['text']).decode('utf-8', errors='ignore')
+        score = score_link(url, text)
+        if score:
+            links.append((url, score))
+    return links
+
+
+class SiteFrontier:
+    """
+    Pages of a single site waiting to be downloaded, the best scored first. Every page is returned once, at most
+    max_pages pages in total.
+    """
+
+    def __init__(self, homepage, max_pages):
+        """
+        __init__ method for the class.
+
+        :param str homepage: Url of the already downloaded page the crawl starts from.
+        :param int max_pages: Maximum number of pages returned by pop.
+        """
+        self.pages_left = max_pages
+        self._seen = {url_key(homepage)}
+        self._heap = []
+        # breaks the ties of the same score and path length in the order the links were found
+        self._order = itertools.count()
+
+    def add(self, base_url, content):
+        """
+        Adds the links of the downloaded page.
+
+        :param str base_url: Url of the page.
+        :param bytes content: Raw body of the page.
+        :return SiteFrontier: The frontier itself.
+        """
+        for url, score in site_links(base_url, content):
+            key = url_key(url)
+            if key not in self._seen:
+                self._seen.add(key)
+                # shorter paths first for the same score, /kontakt/ rather than /kontakt/prodejna-brno/
+                heapq.heappush(self._heap, (-score, len(urlsplit(url).path), next(self._order), url))
+        return self
+
+    def pop(self):
+        """
+        :return str: Url of the best scored page, None if there is none or the budget of the site is spent.
+        """
+        if not self:
+            return None
+        self.pages_left -= 1
+        return heapq.heappop(self._heap)[-1]
+
+    def __bool__(self):
+        return self.pages_left > 0 and bool(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
@@ -1,30 +1,66 @@
-import pandas as pd
+import os
 
 from heureka import Heureka
 from eshop_web import EshopWebsite
 from instagram import Instagram
+from canonical import SingleFlight, canonical_account, url_key
+from pipeline import Pipeline
+from reviews import Reviews
 
+# pandas and the ResultStore (pyarrow) are imported by the functions which need them, so importing the module (and
+# starting a worker) stays fast
 
-def download_all(count_of_eshops=30, req=None):
+
+def _journal_path(journal_dir, stage):
+    """
+    :param str journal_dir: Directory with the journals, can be None.
+    :param str stage: Name of the stage.
+    :return str: Path to the journal of the stage, None if journal_dir is None.
+    """
+    return os.path.join(journal_dir, f'{stage}.jsonl') if journal_dir else None
+
+
+def download_all(count_of_eshops=30, req=None, use_async=False, pipelined=False, journal_dir=None, store_dir=None,
+                 category=None, eshop_threads=30):
     """
     A function for downloading it all-at-once.
 
     :param RequestHelper req: a Request helper class to be passed
     :param int count_of_eshops: Number of eshops to include.
+    :param bool use_async: If True, eshop pages are downloaded on asyncio event loop instead of threads.
+    :param bool pipelined: If True, the stages run at the same time, see download_stream.
+    :param str journal_dir: If supplied, every stage records its progress to a journal in this directory and the
+                            interrupted run can be resumed by calling the function again with the same directory.
+    :param str store_dir: If supplied, the stages write their output in batches to typed Parquet files in this
+                          directory instead of keeping it in memory, full Instagram jsons are offloaded there as
+                          well, and the merged results are stored there too. Use it for large runs, the results can
+                          be loaded again by store.load(store_dir).
+    :param str category: Heureka category of the eshops (e.g. 'elektronika'), all eshops if None.
+    :param int eshop_threads: Number of threads downloading eshop pages.
     :return pandas.DataFrame: Data frame with all the data
     """
+    import pandas as pd
+
+    if store_dir:
+        return _download_to_store(count_of_eshops, req, use_async, pipelined, journal_dir, store_dir, category,
+                                  eshop_threads)
+    if pipelined:
+        # the url of the eshop page is the link itself, the staged mode joins on it instead of keeping it
+        return pd.DataFrame(list(download_stream(count_of_eshops, req=req, journal_dir=journal_dir, category=category,
+                                                 eshop_threads=eshop_threads))).set_index('link').drop(columns='url')
 
     # we run the Heureka first
-    h = Heureka(req=req)
+    h = Heureka(req=req, category=category, journal=_journal_path(journal_dir, 'heureka'))
     h.run(count_of_eshops)
 
-    # then we find the instagram links on the eshop's webpages
-    e = EshopWebsite(req=req)
-    e.run([shop['link'] for shop in h.output])
+    # then we find the instagram links on the eshop's webpages, every page once
+    e = EshopWebsite(req=req, concurrent_threads_count=eshop_threads, use_async=use_async,
+                     journal=_journal_path(journal_dir, 'eshop'))
+    e.run(list(dict.fromkeys(shop['link'] for shop in h.output)))
 
-    # then use the information from web pages to collect instagram accounts
-    i = Instagram(req=req)
-    i.run([shop['instagram'] for shop in e.output if shop['instagram']])
+    # then use the information from web pages to collect instagram accounts, shared accounts are joined to all eshops
+    i = Instagram(req=req, journal=_journal_path(journal_dir, 'instagram'))
+    i.run(list(dict.fromkeys(shop['instagram'] for shop in e.output if shop['instagram'])))
 
     # here we create DataFrames
     df_h = pd.DataFrame(h.output).set_index('link')
@@ -36,6 +72,139 @@ def download_all(count_of_eshops=30, req=None):
     return df_all
 
 
+def _download_to_store(count_of_eshops, req, use_async, pipelined, journal_dir, store_dir, category, eshop_threads):
+    """
+    download_all writing the stages to the ResultStore, see download_all for the parameters.
+    """
+    from store import DATASET_STAGES, ResultStore, load
+
+    full_json_dir = os.path.join(store_dir, 'instagram_json')
+    # the reviews already written to the directory are kept
+    with ResultStore(store_dir, stages=DATASET_STAGES) as store:
+        if pipelined:
+            for _ in download_stream(count_of_eshops, req=req, journal_dir=journal_dir, store=store,
+                                     full_json_dir=full_json_dir, category=category, eshop_threads=eshop_threads):
+                pass
+        else:
+            h = Heureka(req=req, category=category, journal=_journal_path(journal_dir, 'heureka'), store=store)
+            h.run(count_of_eshops)
+
+            e = EshopWebsite(req=req, concurrent_threads_count=eshop_threads, use_async=use_async,
+                             journal=_journal_path(journal_dir, 'eshop'), store=store)
+            e.run(list(dict.fromkeys(store.column('heureka', 'link'))))
+
+            i = Instagram(req=req, full_json_dir=full_json_dir, journal=_journal_path(journal_dir, 'instagram'),
+                          store=store)
+            i.run(list(dict.fromkeys(account for account in store.column('eshop', 'instagram') if account)))
+        return load(store.merge())
+
+
+def download_reviews(inner_links, path='reviews.jsonl', req=None, max_reviews_per_shop=100, store_dir=None):
+    """
+    Downloads the text reviews of the eshops. The reviews are streamed to the disk, only their counts are returned.
+
+    :param list inner_links: Links to the Heureka pages of the eshops ('inner_link' column of download_all).
+    :param str path: Path to the JSON lines file with the reviews.
+    :param RequestHelper req: a Request helper class to be passed
+    :param int max_reviews_per_shop: Maximum number of reviews per eshop, None for all.
+    :param str store_dir: If supplied, the reviews are written to the 'reviews' Parquet files in this directory
+                          instead of the JSON lines file.
+    :return pandas.DataFrame: Number of downloaded reviews indexed by inner_link.
+    """
+    import pandas as pd
+
+    if store_dir:
+        from store import ResultStore
+
+        # the other stages already written to the directory are kept
+        with ResultStore(store_dir, stages=('reviews',)) as store:
+            r = Reviews(req, max_reviews_per_shop=max_reviews_per_shop, store=store)
+            r.run(inner_links)
+    else:
+        r = Reviews(req, max_reviews_per_shop=max_reviews_per_shop, path=path)
+        r.run(inner_links)
+    return pd.DataFrame(r.output).set_index('inner_link')
+
+
+def download_stream(count_of_eshops=30, req=None, *, heureka_threads=1, eshop_threads=30, instagram_threads=1,
+                    queue_size=100, callback=None, journal_dir=None, store=None, full_json_dir=None, category=None):
+    """
+    Streaming version of download_all. Every eshop goes from Heureka to its web page and then to Instagram as soon as
+    the previous stage is done with it, and the finished records are yielded immediately. The stages are connected
+    by bounded queues, so a slow stage holds back the faster ones instead of piling up records in memory.
+
+    :param int count_of_eshops: Number of eshops to include.
+    :param RequestHelper req: a Request helper class to be passed
+    :param int heureka_threads: Number of threads downloading Heureka detail pages.
+    :param int eshop_threads: Number of threads downloading eshop pages.
+    :param int instagram_threads: Number of threads downloading Instagram profiles.
+    :param int queue_size: Maximum number of records waiting between two stages.
+    :param callable callback: If supplied, it is called with every finished record.
+    :param str journal_dir: If supplied, every stage records its progress to a journal in this directory and the
+                            interrupted run can be resumed by calling the function again with the same directory.
+    :param ResultStore store: If supplied, every finished record is also appended to the stages of the store.
+    :param str full_json_dir: If supplied, full Instagram jsons are offloaded there, see Instagram.
+    :param str category: Heureka category of the eshops, all eshops if None.
+    :return generator: Dictionaries with the same fields as the rows of download_all. Eshops without Instagram
+                       account have only the Heureka and eshop fields.
+    """
+    h = Heureka(req=req, category=category, journal=_journal_path(journal_dir, 'heureka'))
+    e = EshopWebsite(req=req, journal=_journal_path(journal_dir, 'eshop'))
+    i = Instagram(req=req, full_json_dir=full_json_dir, journal=_journal_path(journal_dir, 'instagram'))
+
+    def list_eshops():
+        # listing pages are chained by the "next" links, so they are downloaded one after another
+        remaining = count_of_eshops
+        while remaining > 0:
+            eshops = h._download_list_page()[:remaining]
+            if not eshops:
+                return
+            remaining -= len(eshops)
+            yield from eshops
+
+    # eshops sharing a page or an account (known only as they come) download it once
+    eshop_pages, instagram_profiles = SingleFlight(), SingleFlight()
+
+    def eshop_website(eshop):
+        link = eshop['link']
+        eshop.update(eshop_pages.call(url_key(link), lambda: e._parse_data_from_eshop_website(link)), url=link)
+        return eshop
+
+    def instagram_account(eshop):
+        if eshop['instagram']:
+            account = instagram_profiles.call(canonical_account(eshop['instagram']) or eshop['instagram'],
+                                              lambda: i._parse_data_from_instagram_account(eshop['instagram']))
+            eshop.update((key, value) for key, value in account.items() if key != 'account')
+        return eshop
+
+    def eshop_detail(eshop):
+        eshop = h._download_eshop_detail(eshop)
+        # the domain of the eshop is resolved while the eshop waits in the queue for the eshop stage
+        e.r.prefetch([eshop['link']])
+        return eshop
+
+    pipeline = (Pipeline(list_eshops, queue_size=queue_size)
+                .add_stage(eshop_detail, workers=heureka_threads)
+                .add_stage(eshop_website, workers=eshop_threads)
+                .add_stage(instagram_account, workers=instagram_threads))
+    stored_accounts = set()
+    try:
+        for record in pipeline:
+            if store is not None:
+                store.append('heureka', record)
+                store.append('eshop', record)
+                if record['instagram'] and record['instagram'] not in stored_accounts:
+                    stored_accounts.add(record['instagram'])
+                    store.append('instagram', {**record, 'account': record['instagram']})
+            if callback is not None:
+                callback(record)
+            yield record
+    finally:
+        for stage in (h, e, i):
+            if stage.journal is not None:
+                stage.journal.flush()
+
+
 if __name__ == '__main__':
     # testing if it works
     test = download_all(1)
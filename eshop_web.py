@@ -2,11 +2,12 @@ from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
 import re
 import time
-
-from tqdm import tqdm
+from warnings import warn
 
 from req import RequestHelper
 from base import BaseDownload
+from canonical import canonical_account, fan_out, url_key
+from discovery import SiteFrontier
 
 
 class EshopWebsite(BaseDownload):
@@ -14,12 +15,36 @@ class EshopWebsite(BaseDownload):
     Downloads the data from eshop's page.
     """
 
-    def __init__(self, req=None, *, concurrent_threads_count=30):
+    STAGE = 'eshop'
+
+    # instagram account in the href of <a> tag, the page is scanned as bytes, without building the tree
+    RGX_INSTAGRAM_LINK = re.compile(
+        rb"""<a(?:\s[^>]*?)?\shref\s*=\s*["']?[^"'\s>]*?(?:instagram\.com|instagr\.am)/(?P<id>[\w.]{3,})""",
+        re.IGNORECASE)
+
+    def __init__(self, req=None, *, concurrent_threads_count=30, use_async=False, max_concurrency=1000,
+                 per_host_concurrency=8, journal=None, store=None, max_page_bytes=512 * 1024, tail_bytes=64 * 1024,
+                 early_abort_links=3, max_pages_per_site=4):
         """
         __init__ method for the class.
 
         :param RequestHelper req: Request helper objects, if not supplied, instantiated automatically.
         :param int concurrent_threads_count: Number of threads to be used in download of data.
+        :param bool use_async: If True, asyncio event loop is used instead of threads.
+        :param int max_concurrency: Maximum number of requests in flight when use_async is True.
+        :param int per_host_concurrency: Maximum number of requests in flight to a single host when use_async is True.
+        :param journal: Journal instance or path to the journal file. If supplied, parsed eshop pages are recorded
+                        there and the next run with the same journal skips them.
+        :param ResultStore store: If supplied, the output is written there instead of the output attribute.
+        :param int max_page_bytes: Maximum number of bytes read from the page, None reads the whole page.
+        :param int tail_bytes: If the page is cut by max_page_bytes and no Instagram link is found, its last
+                               tail_bytes (the footer) are requested by a Range request. 0 disables it.
+        :param int early_abort_links: Reading of the page stops as soon as it has this number of links to Instagram
+                                      accounts, the most common of them is the result. None reads the page whole.
+        :param int max_pages_per_site: If the page has no Instagram link, the other pages of the site with
+                                       the social links (contacts, about us, ...) are searched, up to this number of
+                                       pages including the first one. The pages of a site are downloaded one by one,
+                                       the sites in parallel. 1 disables it.
         """
 
         self.r = req or RequestHelper()
@@ -28,6 +53,15 @@ class EshopWebsite(BaseDownload):
                                       'leave it to its default value.')
 
         self._concurrent_threads_count = concurrent_threads_count
+        self._use_async = use_async
+        self._max_concurrency = max_concurrency
+        self._per_host_concurrency = per_host_concurrency
+        self._set_journal(journal)
+        self._set_store(store)
+        self._max_page_bytes = max_page_bytes
+        self._tail_bytes = tail_bytes
+        self._early_abort_links = early_abort_links
+        self._max_pages_per_site = max_pages_per_site
 
         self.output = []
 
@@ -36,12 +70,77 @@ class EshopWebsite(BaseDownload):
         Wrapper for threads download.
 
         :param list website_list: List of strings containing urls (with protocol specified).
+        :return list: Parsed eshop pages.
         """
+        from tqdm import tqdm
+
         print(f' - getting data from eshop pages in {self._concurrent_threads_count} threads:')
         t = ThreadPoolExecutor(self._concurrent_threads_count)
 
-        self.output.extend(
-            list(tqdm(t.map(self._parse_data_from_eshop_website, website_list), total=len(website_list))))
+        return list(tqdm(t.map(self._parse_data_from_eshop_website, website_list), total=len(website_list)))
+
+    def _run_async(self, website_list):
+        """
+        Wrapper for download on asyncio event loop.
+
+        :param list website_list: List of strings containing urls (with protocol specified).
+        :return list: Parsed eshop pages.
+        """
+        from async_engine import AsyncFetcher
+
+        # the eshops whose domain does not exist are not handed to the fetcher at all
+        skipped = {}
+        for url in website_list:
+            if self.journal is not None and url in self.journal:
+                continue
+            result = self._skip_unresolvable(url)
+            if result is not None:
+                skipped[url] = result
+                if self.journal is not None:
+                    self.journal.record(url, result)
+        all_urls, website_list = website_list, [url for url in website_list if url not in skipped]
+
+        print(f' - getting data from eshop pages with up to {self._max_concurrency} concurrent requests:')
+        fetcher = AsyncFetcher(self.r, max_concurrency=self._max_concurrency,
+                               per_host_concurrency=self._per_host_concurrency, request_kwargs=self._request_kwargs)
+        cut, frontiers = {}, {}
+
+        def parse(url, r):
+            if self._needs_tail(r):
+                cut[url] = r.url
+            result = self._parse_eshop_website(url, r)
+            if result['instagram'] is None and self._max_pages_per_site > 1:
+                frontiers[url] = SiteFrontier(r.url, self._max_pages_per_site - 1).add(r.url, r.content)
+            return result
+
+        # the results of the cut pages and of the sites still to be searched are journaled when they are final
+        results = self._journaled_async(fetcher, website_list, key_for=lambda url: url, url_for=lambda url: url,
+                                        parse=parse, final=lambda url, result: url not in cut and url not in frontiers)
+        if cut:
+            # the footers of the cut pages are requested in threads, the beginnings have no Instagram link anyway
+            with ThreadPoolExecutor(self._concurrent_threads_count) as t:
+                tails = dict(zip(cut, t.map(self._download_tail, cut.values())))
+            for position, url in enumerate(website_list):
+                if tails.get(url) is not None:
+                    results[position] = self._parse_eshop_website(url, tails[url])
+                    if url in frontiers:
+                        frontiers[url].add(tails[url].url, tails[url].content)
+
+        # the other pages of the sites are searched in threads too, the pages of a site one by one
+        pending = [(position, url) for position, url in enumerate(website_list)
+                   if url in frontiers and results[position]['instagram'] is None]
+        if pending:
+            with ThreadPoolExecutor(self._concurrent_threads_count) as t:
+                accounts = list(t.map(lambda item: self._crawl_site(frontiers[item[1]]), pending))
+            for (position, url), account in zip(pending, accounts):
+                if account is not None:
+                    results[position] = {**results[position], 'instagram': account}
+        if self.journal is not None:
+            for position, url in enumerate(website_list):
+                if url in cut or url in frontiers:
+                    self.journal.record(url, results[position])
+        results = dict(zip(website_list, results))
+        return [skipped[url] if url in skipped else results[url] for url in all_urls]
 
     def _parse_data_from_eshop_website(self, url):
         """
@@ -49,52 +148,175 @@ class EshopWebsite(BaseDownload):
         :param str url:  url (with protocol specified).
         :return dict:
         """
+        def download():
+            skipped = self._skip_unresolvable(url)
+            if skipped is not None:
+                return skipped
+            r = self._download_page(url)
+            result = self._parse_eshop_website(url, r)
+            if result['instagram'] is None and self._max_pages_per_site > 1:
+                result['instagram'] = self._crawl_site(
+                    SiteFrontier(r.url, self._max_pages_per_site - 1).add(r.url, r.content))
+            return result
+
+        return self._journaled(url, download)
+
+    def _skip_unresolvable(self, url):
+        """
+        Waits for the DNS lookup of the eshop (started by the prefetch in run).
+
+        :param str url: url of the eshop page.
+        :return dict: Result without Instagram account if the domain of the eshop does not exist, None otherwise.
+        """
+        return None if self.r.is_resolvable(url) else {'url': url, 'instagram': None}
+
+    def _crawl_site(self, frontier):
+        """
+        Downloads the pages of the site from the frontier until one of them has an Instagram link.
+
+        :param SiteFrontier frontier: Frontier with the links of the first page of the site.
+        :return str: Instagram account, None if none of the pages has it.
+        """
+        while frontier:
+            page_url = frontier.pop()
+            try:
+                r = self._download_page(page_url)
+            except Exception as e:
+                # the other pages are optional, the site keeps the result of its first page
+                warn(f'Encountered an exception: {type(e).__name__}: {e}')
+                self._record_discovery('error')
+                continue
+            account = self._parse_instagram_links(r.content)
+            self._record_discovery('found' if account else 'empty')
+            if account:
+                return account
+            if r.ok:
+                frontier.add(r.url, r.content)
+        return None
+
+    def _record_discovery(self, outcome):
+        """
+        :param str outcome: 'found', 'empty' or 'error'.
+        """
+        if self.metrics:
+            self.metrics.increment('discovery_pages_total', stage=self.STAGE, outcome=outcome)
+
+    @property
+    def _request_kwargs(self):
+        """
+        :return dict: Keyword arguments of make_request limiting the part of the page which is read.
+        """
+        return {'max_bytes': self._max_page_bytes, 'stop': self._has_enough_links if self._early_abort_links else None}
+
+    def _has_enough_links(self, body, start):
+        """
+        Early abort hook of the streamed page, see RequestHelper.make_request.
+
+        :param bytearray body: Page read so far.
+        :param int start: Offset of the last chunk in the body.
+        :return bool: True if the page has enough Instagram links to decide the account.
+        """
+        # the links are counted again only when the new chunk mentions instagram (overlapping the previous chunk)
+        if body.find(b'instagr', max(0, start - len(b'instagr'))) < 0:
+            return False
+        # only the complete tags are searched, the last one can be cut in the middle of the account name
+        return len(self._instagram_accounts(body[:body.rfind(b'>') + 1])) >= self._early_abort_links
+
+    def _download_page(self, url):
+        """
+        Downloads the beginning of the page and, if it is cut without an Instagram link, its end too, where
+        the links to the social networks usually are.
+
+        :param str url: url (with protocol specified).
+        :return requests.Response: Downloaded page, the body of the tail is appended to the beginning.
+        """
+        r = self.r.make_request(url, **self._request_kwargs)
+        if self._needs_tail(r):
+            tail = self._download_tail(r.url)
+            if tail is not None:
+                r._content += b'\n' + tail.content
+        return r
+
+    def _needs_tail(self, r):
+        """
+        :param requests.Response r: Beginning of the page.
+        :return bool: True if the page was cut by max_page_bytes before any Instagram link.
+        """
+        return bool(self._tail_bytes and self._max_page_bytes and getattr(r, 'truncated', False)
+                    and len(r.content) >= self._max_page_bytes and not self._instagram_accounts(r.content))
+
+    def _download_tail(self, url):
+        """
+        :param str url: Final url of the page (after the redirects).
+        :return requests.Response: Last tail_bytes of the page, None if the server does not support ranges.
+        """
+        # the tail is requested in identity encoding, the range of a compressed body could not be decompressed
+        tail = self.r.make_request(url, max_bytes=self._tail_bytes,
+                                   headers={'Range': f'bytes=-{self._tail_bytes}', 'Accept-Encoding': 'identity'})
+        return tail if tail.status_code == 206 else None
+
+    def _parse_eshop_website(self, url, r):
+        """
+        Parses the data from the downloaded eshop page.
+
+        :param str url: url of the page.
+        :param requests.Response r: Downloaded page.
+        :return dict:
+        """
         output_dict = {}
-        sel = self.r.get_selector(url)
         output_dict['url'] = url
-        output_dict['instagram'] = self._parse_instagram_links(sel)
+        output_dict['instagram'] = self._parse_instagram_links(r.content)
 
         return output_dict
 
     @staticmethod
-    def _parse_instagram_links(sel):
+    def _parse_instagram_links(content):
         """
-        This method finds all candidate instagram links from the supplied object and returns the instagram account name
-        that is most common on the page.
+        This method finds all candidate instagram links from the supplied page and returns the instagram account name
+        that is most common on the page. Links are usually in the form of instagram.com/datapythonies/anything_else.
+        Accounts are compared in their canonical form, links to posts (instagram.com/p/...) are skipped.
 
-        :param parsel.Selector sel:
+        :param bytes content: Raw body of the page.
         :return str: Instagram account as string.
         """
-        # find all links containing instagram
-        instagram_links = sel.xpath('//a[contains(@href,"instag")]/@href').getall()
-
-        # if nothing found, return None
-        if not instagram_links:
-            return None
+        candidates = EshopWebsite._instagram_accounts(content)
 
-        # Get matches for all links. They are usually in the form of instagram.com/datapythonies/anything_else
-        regex_matches = (re.search(r'(instagram.com|instagr.am)/(?P<id>[\w\.]{3,})', link) for link in instagram_links)
-
-        # list where we append all instagram accounts found
-        candidates = []
-        for match in regex_matches:
-            if match:
-                candidates.append(match['id'])
-
-        # if the length is greater than 1, then we compute the most common and return it
-        if len(candidates) > 0:
+        # if anything found, we compute the most common and return it
+        if candidates:
             return Counter(candidates).most_common()[0][0]
+        return None
+
+    @staticmethod
+    def _instagram_accounts(content):
+        """
+        :param bytes content: Raw body of the page.
+        :return list: Canonical Instagram account of every link to an account, in the order on the page.
+        """
+        return [account for account in (canonical_account(m['id'].decode('ascii'))
+                                        for m in EshopWebsite.RGX_INSTAGRAM_LINK.finditer(content)) if account]
 
     def run(self, website_list):
         """
-        Triggers the download for the list of urls supplied. Result is stored in the 'output' class attribute.
+        Triggers the download for the list of urls supplied. Result is stored in the 'output' class attribute
+        (or in the ResultStore if supplied).
         Download is done in threads to speed it up - we are contacting different sites, therefore, we do not need
-        (in theory) to worry about being blocked.
+        (in theory) to worry about being blocked. Urls of the same page (differing only by www, scheme, trailing
+        slash, ...) are downloaded once and every url gets the result.
 
         :param list website_list:  List of strings containing urls (with protocol specified).
         """
         start_time = time.time()
 
-        self._run_multiple_threads(website_list=website_list)
+        distinct, index = self._deduplicate(website_list, url_key)
+        # the domains are resolved concurrently ahead of the downloads, the dead ones are skipped without a request
+        self.r.prefetch(distinct)
+        if self._use_async:
+            results = self._run_async(website_list=distinct)
+        else:
+            results = self._run_multiple_threads(website_list=distinct)
+        self._emit(fan_out(website_list, index, results, copy_for=lambda url, result: {**result, 'url': url}))
+        if self.journal is not None:
+            self.journal.flush()
 
+        self._record_run(time.time() - start_time)
         print(f'Data from Eshop pages finished in {round(time.time() - start_time, 3)}s.')
@@ -1,12 +1,12 @@
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
 import re
 import time
 
-from tqdm import tqdm
-
 from req import RequestHelper
 from base import BaseDownload
+from parsing import Extractor
 
 
 class Heureka(BaseDownload):
@@ -14,12 +14,45 @@ class Heureka(BaseDownload):
     Downloads the data from the Heureka from the obchody.heureka.cz page.
     """
 
-    def __init__(self, req=None, *, use_multiple_threads=False):
+    STAGE = 'heureka'
+
+    START_URL = 'https://obchody.heureka.cz/'
+
+    # there are 20 eshops on 1 listing page
+    ESHOPS_PER_PAGE = 20
+
+    # extractors are compiled once for all pages
+    _LISTING_NEXT = Extractor('/html/body/div[2]/div/div[2]/nav/ol//a[@rel="next"]/@href')
+    _LISTING_ROWS = Extractor('/html/body/div[2]/div/div[2]/div/table//tr')
+    _LISTING_ROW_REVIEWS = Extractor('./td[4]/a/ul/li[2]/text()')
+    _LISTING_ROW_LINK = Extractor('./td[4]/a/@href')
+    _LISTING_ROW_NAME = Extractor('./th/a/text()')
+    _DETAIL_LINK = Extractor('/html/body/div[2]/div/'
+                             'div[2]/aside//dd[@class="c-pair-list__value"]/'
+                             'a[contains(@href,"heureka.cz/exit")]/text()')
+    _DETAIL_RATING = Extractor(css='body > div.scope-essentials.scope-shop-detail > '
+                                   'div > div.l-shop-detail__wrapper > aside > div > '
+                                   'section.c-shop-detail-stats.c-aside__section > table > '
+                                   'tbody > tr:nth-child(1) > td > '
+                                   'span.c-shop-detail-stats__value::text')
+    _DETAIL_NEGATIVE_COUNT = Extractor('//*[@id="filtr"]/div/nav/ul/li[3]/a/@data-count')
+    _DETAIL_POSITIVE_COUNT = Extractor('//*[@id="filtr"]/div/nav/ul/li[2]/a/@data-count')
+
+    def __init__(self, req=None, *, category=None, use_multiple_threads=False, use_async=False,
+                 per_host_concurrency=8, journal=None, store=None):
         """
         __init__ method for the class.
 
         :param RequestHelper req: Request helper objects, if not supplied, instantiated automatically.
-        :param use_multiple_threads: If True, multiple threads are used. Handle with care.
+        :param str category: Heureka category (e.g. 'elektronika') or url of its listing page. If not supplied,
+                             all eshops are listed.
+        :param use_multiple_threads: If True, multiple threads are used. The rate is limited by the scheduler of the
+                                     RequestHelper.
+        :param bool use_async: If True, detail pages are downloaded concurrently on asyncio event loop.
+        :param int per_host_concurrency: Maximum number of requests in flight to Heureka when use_async is True.
+        :param journal: Journal instance or path to the journal file. If supplied, downloaded listing and detail
+                        pages are recorded there and the next run with the same journal skips them.
+        :param ResultStore store: If supplied, the output is written there instead of the output attribute.
         """
 
         self.r = req or RequestHelper()
@@ -27,12 +60,27 @@ class Heureka(BaseDownload):
             raise NotImplementedError('Only RequestHelper instance can be passed in req argument, otherwise'
                                       'leave it to its default value.')
 
+        self.start_url = self.category_url(category) if category else self.START_URL
         self._next_link = None
         self._output_from_list_page = []
         self._use_multiple_threads = use_multiple_threads
+        self._use_async = use_async
+        self._per_host_concurrency = per_host_concurrency
+        self._set_journal(journal)
+        self._set_store(store)
 
         self.output = []
 
+    @classmethod
+    def category_url(cls, category):
+        """
+        :param str category: Heureka category (e.g. 'elektronika') or url of its listing page.
+        :return str: Url of the first listing page of the category.
+        """
+        if category.startswith(('http://', 'https://')):
+            return category
+        return urljoin(cls.START_URL, category.strip('/') + '/')
+
     def _download_list_of_links(self, how_many_pages_download=2):
         """
         Downloads the basic info available from the listing pages.
@@ -40,52 +88,155 @@ class Heureka(BaseDownload):
         :param int how_many_pages_download: How many listings pages to open. One how_many_pages_download equals to
                                             20 eshops downloaded.
         """
-        # either continue where left or start at the beginning
-        self._next_link = self._next_link or 'https://obchody.heureka.cz/'
+        from tqdm import tqdm
 
         print(' - getting Heureka lists of eshops:')
         for _ in tqdm(range(how_many_pages_download)):
-            sel = self.r.get_selector(self._next_link)
-            # parse info from the listing page
-            self._parse_listing_page(sel)
-            # get the link for the "next" page
-            self._next_link = urljoin(self._next_link,
-                                      sel.xpath('/html/body/div[2]/div/div[2]/nav/ol//a[@rel="next"]/@href').get())
+            self._download_list_page()
+
+    def _download_list_page(self):
+        """
+        Downloads the next listing page and moves the _next_link to the page after it.
 
-    def _parse_listing_page(self, sel):
+        :return list: Eshops parsed from the listing page.
+        """
+        # either continue where left or start at the beginning
+        self._next_link = self._next_link or self.start_url
+
+        page = self._download_listing(self._next_link)
+        self._output_from_list_page.extend(page['eshops'])
+        # continue with the "next" page
+        self._next_link = page['next_link']
+        return page['eshops']
+
+    def _download_listing(self, page_url):
+        """
+        Downloads and parses a single listing page, the result is recorded in the journal.
+
+        :param str page_url: Url of the listing page.
+        :return dict: Eshops parsed from the page in 'eshops' and link to the next page in 'next_link'.
+        """
+        def download():
+            sel = self.r.get_selector(page_url)
+            # parse info from the listing page and get the link for the "next" page
+            return {'eshops': self._parse_listing_rows(sel, page_url),
+                    'next_link': urljoin(page_url, self._LISTING_NEXT.get(sel, ''))}
+
+        return self._journaled(page_url, download)
+
+    @staticmethod
+    def _parse_listing_rows(sel, page_url):
         """
-        Parses the values from the listing page.
+        Parses the eshops from the listing page.
 
         :param parsel.Selector sel: Input Selector object.
+        :param str page_url: Url of the page, relative links are resolved against it.
+        :return list: Eshops parsed from the page.
         """
-        self._output_from_list_page.extend(
-            [{
-                # re.sub -> replace all that does not match digit
-                'reviews': float(re.sub(r'[^\d]+', '', tr.xpath('./td[4]/a/ul/li[2]/text()').get())),
-                # urljoin -> solves relative vs. absolute links
-                'inner_link': urljoin(self._next_link, tr.xpath('./td[4]/a/@href').get()),
-                'name': tr.xpath('./th/a/text()').get(),
-            }
-                for tr in sel.xpath('/html/body/div[2]/div/div[2]/div/table//tr')])
+        return [{
+            # re.sub -> replace all that does not match digit
+            'reviews': int(re.sub(r'[^\d]+', '', Heureka._LISTING_ROW_REVIEWS.get(tr))),
+            # urljoin -> solves relative vs. absolute links
+            'inner_link': urljoin(page_url, Heureka._LISTING_ROW_LINK.get(tr)),
+            'name': Heureka._LISTING_ROW_NAME.get(tr),
+        }
+            for tr in Heureka._LISTING_ROWS.getall(sel)]
+
+    @staticmethod
+    def _listing_page_url_builder(second_page_url):
+        """
+        Derives the urls of all listing pages from the url of the second one, so they can be downloaded in parallel
+        instead of following the "next" links one by one.
+
+        :param str second_page_url: Absolute url of the second listing page.
+        :return callable: Function returning url for the page number, None if the page number is not in the url.
+        """
+        matches = list(re.finditer(r'(?<!\d)2(?!\d)', second_page_url or ''))
+        if not matches:
+            return None
+        prefix, suffix = second_page_url[:matches[-1].start()], second_page_url[matches[-1].end():]
+        return lambda page: f'{prefix}{page}{suffix}'
 
     def _extend_list_page_by_details(self, how_many):
         """
         For the _output_from_list_page dictionary, gets the fields from the detailed page and
         saves it to the output dictionary.
         """
+        from tqdm import tqdm
+
         print(' - getting Heureka page details:')
-        for eshop in tqdm(self._output_from_list_page[:how_many]):
-            self.output.append(self._download_eshop_detail(eshop))
+        self._emit(self._download_eshop_detail(eshop) for eshop in tqdm(self._output_from_list_page[:how_many]))
 
     def _extend_list_page_by_details_in_threads(self, how_many, threads=10):
         """
-        The same functionality as _extend_list_page_by_details method, but uses threads. Use with caution, otherwise,
-        you might get blocked.
+        The same functionality as _extend_list_page_by_details method, but uses threads. Politeness is ensured by
+        the scheduler of the RequestHelper, which adapts the request rate to what Heureka tolerates.
+
+        :param int threads: Number of connections to be opened in parallel threads.
+        """
+        with ThreadPoolExecutor(threads) as executor:
+            self._emit(executor.map(self._download_eshop_detail, self._output_from_list_page[:how_many]))
+
+    def _download_in_threads(self, how_many, threads=10):
+        """
+        The same functionality as _download_list_of_links and _extend_list_page_by_details methods together, but uses
+        threads. All needed listing pages are requested at once and the detail pages of the eshops on each listing page
+        are requested as soon as that page is parsed. Politeness is ensured by the scheduler of the RequestHelper,
+        which adapts the request rate to what Heureka tolerates.
 
+        :param int how_many: Number of eshops to download.
         :param int threads: Number of connections to be opened in parallel threads.
         """
-        self.output.extend(list(
-            ThreadPoolExecutor(threads).map(self._download_eshop_detail, self._output_from_list_page[:how_many])))
+        from tqdm import tqdm
+
+        print(f' - getting Heureka lists and page details in {threads} threads:')
+        first_page = self._download_listing(self.start_url)
+        second_page_url = first_page['next_link']
+        page_url = self._listing_page_url_builder(second_page_url)
+        pages_needed = math.ceil(how_many / self.ESHOPS_PER_PAGE)
+
+        listings = {1: first_page['eshops']}
+        details = {}
+        with ThreadPoolExecutor(threads) as executor, tqdm(total=how_many) as progress:
+
+            def submit_details(page, eshops):
+                # only the eshops within the first how_many are needed
+                first_position = (page - 1) * self.ESHOPS_PER_PAGE
+                for position, eshop in enumerate(eshops[:max(0, how_many - first_position)], first_position):
+                    future = executor.submit(self._download_eshop_detail, eshop)
+                    future.add_done_callback(lambda _: progress.update())
+                    details[position] = future
+
+            submit_details(1, listings[1])
+            if page_url is not None:
+                pages = {executor.submit(self._download_listing, page_url(page)): page
+                         for page in range(2, pages_needed + 1)}
+                for future in as_completed(pages):
+                    listings[pages[future]] = future.result()['eshops']
+                    submit_details(pages[future], listings[pages[future]])
+                self._next_link = page_url(pages_needed + 1)
+            else:
+                # the listing pages cannot be derived, so there is only the first one
+                self._next_link = second_page_url
+
+            self._emit(details[position].result() for position in sorted(details))
+        self._output_from_list_page.extend(eshop for page in sorted(listings) for eshop in listings[page])
+
+    def _extend_list_page_by_details_async(self, how_many):
+        """
+        The same functionality as _extend_list_page_by_details method, but uses asyncio event loop.
+        """
+        from async_engine import AsyncFetcher
+
+        print(f' - getting Heureka page details with {self._per_host_concurrency} concurrent requests:')
+        fetcher = AsyncFetcher(self.r, per_host_concurrency=self._per_host_concurrency)
+        eshops = self._output_from_list_page[:how_many]
+        details = self._journaled_async(fetcher, eshops, key_for=lambda eshop: eshop['inner_link'],
+                                        url_for=lambda eshop: eshop['inner_link'],
+                                        parse=lambda eshop, r: self._parse_detail_page(self.r.to_selector(r)))
+        for eshop, detail in zip(eshops, details):
+            eshop.update(detail)
+        self._emit(eshops)
 
     def _download_eshop_detail(self, eshop):
         """
@@ -94,8 +245,8 @@ class Heureka(BaseDownload):
         :param dict eshop: Dictionary, must contain the 'inner_link' key.
         :return dict: Dictionary enhanced by the values from the detail page.
         """
-        sel = self.r.get_selector(eshop['inner_link'])
-        eshop.update(self._parse_detail_page(sel))
+        eshop.update(self._journaled(eshop['inner_link'],
+                                     lambda: self._parse_detail_page(self.r.get_selector(eshop['inner_link']))))
         return eshop
 
     @staticmethod
@@ -107,39 +258,41 @@ class Heureka(BaseDownload):
         :return dict: Returns the detailed values from the page.
         """
         output = {}
-        link = sel.xpath('/html/body/div[2]/div/'
-                         'div[2]/aside//dd[@class="c-pair-list__value"]/'
-                         'a[contains(@href,"heureka.cz/exit")]/text()').get().strip()
+        link = Heureka._DETAIL_LINK.get(sel).strip()
         output['link'] = link
 
-        rating = sel.css('body > div.scope-essentials.scope-shop-detail > '
-                         'div > div.l-shop-detail__wrapper > aside > div > '
-                         'section.c-shop-detail-stats.c-aside__section > table > '
-                         'tbody > tr:nth-child(1) > td > '
-                         'span.c-shop-detail-stats__value::text').get()
+        rating = Heureka._DETAIL_RATING.get(sel)
         output['rating'] = float(rating.replace(',', '.'))
 
-        negative_reviews_count = sel.xpath('//*[@id="filtr"]/div/nav/ul/li[3]/a/@data-count').get()
-        output['reviews_negative_count'] = float(re.sub(r'&nbsp;|\s+', '', negative_reviews_count))
+        negative_reviews_count = Heureka._DETAIL_NEGATIVE_COUNT.get(sel)
+        output['reviews_negative_count'] = int(re.sub(r'&nbsp;|\s+', '', negative_reviews_count))
 
-        positive_reviews_count = sel.xpath('//*[@id="filtr"]/div/nav/ul/li[2]/a/@data-count').get()
-        output['reviews_positive_count'] = float(re.sub(r'&nbsp;|\s+', '', positive_reviews_count))
+        positive_reviews_count = Heureka._DETAIL_POSITIVE_COUNT.get(sel)
+        output['reviews_positive_count'] = int(re.sub(r'&nbsp;|\s+', '', positive_reviews_count))
         return output
 
     def run(self, how_many_pages_download):
         """
-        Main method for the class, output is stored in the output attribute.
+        Main method for the class, output is stored in the output attribute (or in the ResultStore if supplied).
 
         :param int how_many_pages_download: How many pages should be there in the output.
         """
         start_time = time.time()
 
-        # there are 20 eshops on 1 listing page
-        listings_needed = (how_many_pages_download // 20) + 1
-        self._download_list_of_links(listings_needed)
-        if self._use_multiple_threads:
-            self._extend_list_page_by_details_in_threads(how_many_pages_download)
+        if self._use_multiple_threads and not self._next_link:
+            # listing pages are derived and downloaded in parallel together with the detail pages
+            self._download_in_threads(how_many_pages_download)
         else:
-            self._extend_list_page_by_details(how_many_pages_download)
+            listings_needed = math.ceil(how_many_pages_download / self.ESHOPS_PER_PAGE)
+            self._download_list_of_links(listings_needed)
+            if self._use_async:
+                self._extend_list_page_by_details_async(how_many_pages_download)
+            elif self._use_multiple_threads:
+                self._extend_list_page_by_details_in_threads(how_many_pages_download)
+            else:
+                self._extend_list_page_by_details(how_many_pages_download)
+        if self.journal is not None:
+            self.journal.flush()
 
+        self._record_run(time.time() - start_time)
         print(f'Data from Heureka finished in {round(time.time() - start_time, 3)}s.')
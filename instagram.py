@@ -1,12 +1,16 @@
+import gzip
 import json
+import os
 import re
 import time
 from concurrent.futures import ThreadPoolExecutor
-
-from tqdm import tqdm
+from urllib.parse import quote
+from warnings import warn
 
 from req import RequestHelper
 from base import BaseDownload
+from canonical import canonical_account, fan_out
+from metrics import RunningStats
 
 
 class Instagram(BaseDownload):
@@ -14,20 +18,39 @@ class Instagram(BaseDownload):
     Downloads the data from Instagram profile pages.
     """
 
-    RGX_PATTERN_INSTAGRAM = r"""
-^                         # start of string
-[^\{]*?                   # any characters except "{", as few as possible
-(?P<json_obj>\{.*\})      # json_obj: starts with "{" and ends with "}"
-[^\}]*?                   # any characters except "}", as few as possible
-$                         # end of string
-"""
+    STAGE = 'instagram'
+
+    # the json with the profile data is assigned to this variable in the first script of the page
+    SHARED_DATA_MARKER = b'window._sharedData'
+
+    # query of the GraphQL endpoint returning the next page of the posts of the account
+    MEDIA_QUERY_HASH = '003056d32c2554def87228bc3fd9668a'
 
-    def __init__(self, req=None, *, use_multiple_threads=False, concurrent_threads_count=30):
+    _json_decoder = json.JSONDecoder()
+
+    def __init__(self, req=None, *, use_multiple_threads=False, concurrent_threads_count=30, use_async=False,
+                 per_host_concurrency=8, full_json_dir=None, keep_full_json=True, journal=None, store=None,
+                 max_posts=None, posts_since=None, media_page_size=50):
         """
         __init__ method for the class.
 
         :param RequestHelper req: Request helper objects, if not supplied, instantiated automatically.
         :param int concurrent_threads_count: Number of threads to be used in download of data.
+        :param bool use_async: If True, asyncio event loop is used. The rate is limited by the scheduler of the
+                              RequestHelper.
+        :param int per_host_concurrency: Maximum number of requests in flight to Instagram when use_async is True.
+        :param str full_json_dir: If supplied, the full json of every account is stored there as gzipped file and
+                                  the output contains only its path in 'instagram_full_json_path'.
+        :param bool keep_full_json: If False and full_json_dir is not supplied, the full json is not kept at all and
+                                    the output contains only the projected fields.
+        :param journal: Journal instance or path to the journal file. If supplied, parsed profiles are recorded
+                        there and the next run with the same journal skips them.
+        :param ResultStore store: If supplied, the output is written there instead of the output attribute.
+        :param int max_posts: If supplied, the posts of every account are paged through (by the media cursor) until
+                              this number of posts. Only the first page (about 12 posts) is used otherwise.
+        :param posts_since: Unix timestamp or datetime. If supplied, the posts are paged through until the first post
+                            older than this. Paging is done by the threads, use_async is ignored then.
+        :param int media_page_size: Number of posts requested per page.
         """
 
         self.r = req or RequestHelper()
@@ -36,30 +59,59 @@ $                         # end of string
                                       'leave it to its default value.')
         self._use_multiple_threads = use_multiple_threads
         self._concurrent_threads_count = concurrent_threads_count
+        self._use_async = use_async
+        self._per_host_concurrency = per_host_concurrency
+        self._full_json_dir = full_json_dir
+        self._keep_full_json = keep_full_json
+        self._max_posts = max_posts
+        self._posts_since = posts_since.timestamp() if hasattr(posts_since, 'timestamp') else posts_since
+        self._media_page_size = media_page_size
+        if full_json_dir:
+            os.makedirs(full_json_dir, exist_ok=True)
+        self._set_journal(journal)
+        self._set_store(store)
 
         self.output = []
 
     def _run_multiple_threads(self, instagram_accounts_list):
         """
-        Wrapper for threads download in multiple threads. Not recommenced for instagram.
+        Wrapper for threads download in multiple threads. The rate is limited by the scheduler of the RequestHelper.
 
         :param list instagram_accounts_list: List of instagram accounts' ids.
+        :return list: Parsed profiles.
         """
+        from tqdm import tqdm
 
         print(f' - getting data from Instagram in {self._concurrent_threads_count} threads:')
-        self.output.extend(list(
+        return list(
             tqdm(ThreadPoolExecutor(self._concurrent_threads_count).map(self._parse_data_from_instagram_account,
-                                                                        instagram_accounts_list))))
+                                                                        instagram_accounts_list)))
 
     def _run_single_thread(self, instagram_accounts_list):
         """
         Wrapper for threads download.
 
         :param list instagram_accounts_list: List of instagram accounts' ids.
+        :return list: Parsed profiles.
         """
+        from tqdm import tqdm
+
         print(f' - getting data from Instagram:')
-        self.output.extend(
-            [self._parse_data_from_instagram_account(account) for account in tqdm(instagram_accounts_list)])
+        return [self._parse_data_from_instagram_account(account) for account in tqdm(instagram_accounts_list)]
+
+    def _run_async(self, instagram_accounts_list):
+        """
+        Wrapper for download on asyncio event loop.
+
+        :param list instagram_accounts_list: List of instagram accounts' ids.
+        :return list: Parsed profiles.
+        """
+        from async_engine import AsyncFetcher
+
+        print(f' - getting data from Instagram with {self._per_host_concurrency} concurrent requests:')
+        fetcher = AsyncFetcher(self.r, per_host_concurrency=self._per_host_concurrency)
+        return self._journaled_async(fetcher, instagram_accounts_list, key_for=lambda account_id: account_id,
+                                     url_for=self.profile_url, parse=self._parse_instagram_profile)
 
     def _parse_data_from_instagram_account(self, account_id):
         """
@@ -68,19 +120,40 @@ $                         # end of string
         :param str account_id:  instagram account name.
         :return dict:
         """
+        return self._journaled(account_id, lambda: self._parse_instagram_profile(
+            account_id, self.r.make_request(self.profile_url(account_id))))
+
+    def _parse_instagram_profile(self, account_id, r):
+        """
+        Parses the details from the downloaded profile page.
+
+        :param str account_id:  instagram account name.
+        :param requests.Response r: Downloaded profile page.
+        :return dict:
+        """
 
         output_dict = {'account': account_id}
 
-        instagram_json = self.get_instagram_data(account_id)
+        instagram_json = self.parse_instagram_data(r.content)
         if not instagram_json:
             return output_dict
 
+        media = instagram_json['edge_owner_to_timeline_media']
         output_dict['instagram_followers'] = instagram_json['edge_followed_by']['count']
-        output_dict['instagram_posts_count'] = instagram_json['edge_owner_to_timeline_media']['count']
+        output_dict['instagram_posts_count'] = media['count']
 
-        posts = instagram_json['edge_owner_to_timeline_media']['edges']
-        output_dict['instagram_posts_average_like'] = sum(p['node']['edge_liked_by']['count'] for p in posts) / len(
-            posts)
+        # likes and comments are aggregated page by page, the posts of the next pages are not kept
+        posts = media['edges']
+        likes, comments = RunningStats(), RunningStats()
+        if self._add_posts(posts, likes, comments) and self._follows_cursor:
+            self._follow_media_cursor(instagram_json.get('id'), media['page_info'], likes, comments)
+        output_dict['instagram_posts_analyzed'] = likes.count
+        for name, stats in (('like', likes), ('comments', comments)):
+            # no statistics for accounts without posts
+            output_dict[f'instagram_posts_average_{name}'] = stats.mean if stats.count else None
+            output_dict[f'instagram_posts_{name}_std'] = stats.std
+            output_dict[f'instagram_posts_{name}_median'] = stats.quantile(0.5)
+            output_dict[f'instagram_posts_{name}_p90'] = stats.quantile(0.9)
 
         # descriptions of photos for accessibility
         descriptions = (re.sub(r'^Image may contain:\s+|No photo description available\.', '',
@@ -88,9 +161,112 @@ $                         # end of string
         output_dict['instagram_classified_descriptions'] = ';'.join(d for d in descriptions if d)
 
         # as a backup, store the full json from instagram
-        output_dict['instagram_full_json'] = instagram_json
+        if self._full_json_dir:
+            output_dict['instagram_full_json_path'] = self._store_full_json(account_id, instagram_json)
+        elif self._keep_full_json:
+            output_dict['instagram_full_json'] = instagram_json
         return output_dict
 
+    @property
+    def _follows_cursor(self):
+        return self._max_posts is not None or self._posts_since is not None
+
+    def _add_posts(self, posts, likes, comments):
+        """
+        Adds the likes and comments of the posts (newest first) to the statistics.
+
+        :param list posts: Edges of the posts.
+        :param RunningStats likes: Statistics of the likes.
+        :param RunningStats comments: Statistics of the comments.
+        :return bool: False if max_posts or the horizon of posts_since was reached.
+        """
+        for post in posts:
+            node = post['node']
+            if self._max_posts is not None and likes.count >= self._max_posts:
+                return False
+            if self._posts_since is not None and node.get('taken_at_timestamp', 0) < self._posts_since:
+                return False
+            likes.add(node['edge_liked_by']['count'])
+            comments.add(node['edge_media_to_comment']['count'])
+        return True
+
+    def _follow_media_cursor(self, user_id, page_info, likes, comments):
+        """
+        Downloads the next pages of the posts and adds them to the statistics, until there are no more posts, or
+        max_posts or the horizon is reached. Paging stops at the first page which can not be downloaded.
+
+        :param str user_id: Instagram id of the user (number).
+        :param dict page_info: Page info of the first page with the media cursor.
+        :param RunningStats likes: Statistics of the likes.
+        :param RunningStats comments: Statistics of the comments.
+        """
+        while user_id and page_info.get('has_next_page') and page_info.get('end_cursor'):
+            first = self._media_page_size
+            if self._max_posts is not None:
+                first = min(first, self._max_posts - likes.count)
+                if first <= 0:
+                    return
+            try:
+                r = self.r.make_request(self.media_url(user_id, first, page_info['end_cursor']))
+            except Exception as e:
+                # the statistics of the pages downloaded so far are kept
+                warn(f'Encountered an exception: {type(e).__name__}: {e}')
+                return
+            if r.status_code != 200:
+                return
+            try:
+                media = json.loads(r.content)['data']['user']['edge_owner_to_timeline_media']
+            except (ValueError, KeyError, TypeError):
+                return
+            # an empty page would repeat the same cursor forever
+            if not media['edges'] or not self._add_posts(media['edges'], likes, comments):
+                return
+            page_info = media['page_info']
+
+    def _store_full_json(self, account_id, instagram_json):
+        """
+        Stores the full json of the account to the gzipped file.
+
+        :param str account_id: instagram account name.
+        :param dict instagram_json: Full json of the account.
+        :return str: Path to the file.
+        """
+        path = os.path.join(self._full_json_dir, f'{account_id}.json.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(instagram_json, f, ensure_ascii=False)
+        return path
+
+    @staticmethod
+    def load_full_json(path):
+        """
+        Loads the full json stored when full_json_dir was supplied.
+
+        :param str path: Value of 'instagram_full_json_path' from the output.
+        :return dict: Full json of the account.
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def profile_url(instagram_id):
+        """
+        :param str instagram_id: Instagram account id.
+        :return str: Url of the profile page.
+        """
+        return f'https://www.instagram.com/{instagram_id}/'
+
+    @classmethod
+    def media_url(cls, user_id, first, after):
+        """
+        :param str user_id: Instagram id of the user (number).
+        :param int first: Number of posts.
+        :param str after: Media cursor (end_cursor of the previous page).
+        :return str: Url of the page of the posts following the cursor.
+        """
+        variables = json.dumps({'id': user_id, 'first': first, 'after': after}, separators=(',', ':'))
+        return (f'https://www.instagram.com/graphql/query/?query_hash={cls.MEDIA_QUERY_HASH}'
+                f'&variables={quote(variables)}')
+
     def get_instagram_data(self, instagram_id):
         """
         Extract the json object from the page for the given account.
@@ -98,28 +274,50 @@ $                         # end of string
         :param str instagram_id: Instagram account id.
         :return dict: Outputs json loaded as dictionary.
         """
-        i_s = self.r.get_selector(f'https://www.instagram.com/{instagram_id}/')
-        if 'Sorry, this page' in i_s.get():
+        return self.parse_instagram_data(self.r.make_request(self.profile_url(instagram_id)).content)
+
+    def parse_instagram_data(self, content):
+        """
+        Extract the json object from the downloaded profile page. The page is searched as bytes for the start of
+        the json and the decoder stops at its end, so there is no html parsing and no regex backtracking.
+
+        :param bytes content: Raw body of the profile page.
+        :return dict: Outputs json loaded as dictionary, None if the page has no profile data.
+        """
+        if b'Sorry, this page' in content:
             # the instagram profile does not exist, see for example https://instagram.com/dafdsfasdfjefwollaskjf
             return None
-        # finding the json in the page
-        output_object = json.loads(
-            re.match(self.RGX_PATTERN_INSTAGRAM, i_s.xpath('/html/body/script[1]/text()').get(), re.VERBOSE)[
-                'json_obj'])
+        # finding the json in the page, it is missing e.g. on the login page shown instead of the profile
+        marker = content.find(self.SHARED_DATA_MARKER)
+        start = content.find(b'{', marker) if marker >= 0 else -1
+        if start < 0:
+            return None
+        end = content.find(b'</script>', start)
+        output_object, _ = self._json_decoder.raw_decode(content[start:end if end >= 0 else None].decode('utf-8'))
         # returning the part which contains data
         return output_object['entry_data']['ProfilePage'][0]['graphql']['user']
 
     def run(self, instagram_accounts_list):
         """
-        Triggers the download.
+        Triggers the download, output is stored in the output attribute (or in the ResultStore if supplied). Every
+        account is downloaded once, even if it is in the list several times (in any letter case).
 
         :param list instagram_accounts_list:  List of instagram accounts' ids.
         """
         start_time = time.time()
 
-        if self._use_multiple_threads:
-            self._run_multiple_threads(instagram_accounts_list=instagram_accounts_list)
+        distinct, index = self._deduplicate(instagram_accounts_list,
+                                            lambda account: canonical_account(account) or account)
+        if self._use_async and not self._follows_cursor:
+            results = self._run_async(instagram_accounts_list=distinct)
+        elif self._use_multiple_threads or self._use_async:
+            results = self._run_multiple_threads(instagram_accounts_list=distinct)
         else:
-            self._run_single_thread(instagram_accounts_list=instagram_accounts_list)
+            results = self._run_single_thread(instagram_accounts_list=distinct)
+        self._emit(fan_out(instagram_accounts_list, index, results,
+                           copy_for=lambda account, result: {**result, 'account': account}))
+        if self.journal is not None:
+            self.journal.flush()
 
+        self._record_run(time.time() - start_time)
         print(f'Data from Instagram pages finished in {round(time.time() - start_time, 3)}s.')
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+
+class Journal:
+    """
+    Append-only checkpoint journal of a download stage, stored as JSON lines. Every finished unit of work (a page,
+    an eshop, an account) is appended together with its result, so a run that dies halfway can be restarted and
+    skips everything that was already done. Writes are fsynced in batches, at most the last batch is lost on crash.
+    """
+
+    def __init__(self, path, *, fsync_every=50, fsync_interval=5.0):
+        """
+        __init__ method for the class.
+
+        :param str path: Path to the journal file, it is created if it does not exist.
+        :param int fsync_every: Number of records after which the file is fsynced.
+        :param float fsync_interval: Maximum number of seconds between two fsyncs.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._results = {}
+        self._load()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _load(self):
+        """
+        Reads the results recorded by the previous runs and cuts off the incomplete last line, if any.
+        """
+        if not os.path.exists(self.path):
+            return
+        # end of the last complete line, the appended records must not be glued to an incomplete one
+        end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # the previous run crashed while writing it
+                    break
+                end += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._results[record['k']] = record['v']
+        if end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._results
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._results[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def record(self, key, result):
+        """
+        Appends the result of the finished unit of work.
+
+        :param str key: Identifier of the unit of work, usually its url.
+        :param result: JSON serializable result.
+        """
+        line = json.dumps({'k': key, 'v': result}, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._results[key] = result
+            self._file.write(line)
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        """
+        Flushes and fsyncs the file. Must be called with the lock held.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def flush(self):
+        """
+        Makes sure all recorded results are on the disk.
+        """
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def close(self):
+        """
+        Flushes and closes the journal file.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,421 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# buckets of counts (e.g. likes of posts), every bucket is 25 % wider than the previous one
+COUNT_BUCKETS = (0.0,) + tuple(1.25 ** i for i in range(83))
+
+# stage being run, context variable is inherited by the asyncio tasks as well
+_stage = contextvars.ContextVar('stage', default='')
+
+# per-thread state: the time spent on the network within the current unit of work and by opening connections
+_state = threading.local()
+
+
+def _thread_state(name, default):
+    return getattr(_state, name, default)
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets, as in Prometheus. Observing a value costs a single binary search.
+    """
+
+    def __init__(self, buckets):
+        """
+        __init__ method for the class.
+
+        :param tuple buckets: Sorted upper bounds of the buckets, the +Inf bucket is added automatically.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimates the quantile by linear interpolation within its bucket.
+
+        :param float q: Quantile from 0 to 1.
+        :return float: Estimated value, None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank, cumulative = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    # the +Inf bucket has no upper bound
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class RunningStats:
+    """
+    Streaming statistics of a series of values: count, mean and variance (Welford's algorithm), minimum, maximum
+    and quantiles estimated by a Histogram. The values themselves are not kept.
+    """
+
+    def __init__(self, buckets=COUNT_BUCKETS):
+        """
+        __init__ method for the class.
+
+        :param tuple buckets: Buckets of the histogram estimating the quantiles.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = Histogram(buckets)
+        # sum of the squared differences from the mean
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.histogram.observe(value)
+
+    @property
+    def variance(self):
+        """
+        :return float: Sample variance, None for less than two values.
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self):
+        """
+        :return float: Sample standard deviation, None for less than two values.
+        """
+        return self.variance ** 0.5 if self.count > 1 else None
+
+    def quantile(self, q):
+        """
+        :param float q: Quantile from 0 to 1.
+        :return float: Estimated value within the observed range, None if nothing was observed.
+        """
+        value = self.histogram.quantile(q)
+        return None if value is None else min(max(value, self.min), self.max)
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms labeled by the stage and the host. RequestHelper records every
+    attempt (status code, connect/TTFB/transfer times, bytes, retries, waits, cache hits) and BaseDownload records
+    every unit of work and the time spent parsing it. The registry can be exported as JSON report or as Prometheus
+    text file.
+    """
+
+    def __init__(self, max_hosts=200):
+        """
+        __init__ method for the class.
+
+        :param int max_hosts: Maximum number of distinct host labels, the other hosts are counted as 'other'. It
+                              keeps the size of the registry bounded when crawling thousands of eshops.
+        """
+        self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._hosts = set()
+
+    def _host(self, url):
+        """
+        :param str url: Requested url.
+        :return str: Host label of the url.
+        """
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self._hosts:
+                if len(self._hosts) >= self.max_hosts:
+                    return 'other'
+                self._hosts.add(host)
+        return host
+
+    def increment(self, name, value=1, **labels):
+        """
+        :param str name: Name of the counter.
+        :param float value: Value added to the counter.
+        :param labels: Labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """
+        :param str name: Name of the histogram.
+        :param float value: Observed value.
+        :param tuple buckets: Buckets of the histogram, used when the histogram is created.
+        :param labels: Labels of the histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_attempt(self, url, outcome, attempt, seconds=None, connect=None, ttfb=None, size=None):
+        """
+        Records a single attempt of a request.
+
+        :param str url: Requested url.
+        :param outcome: Status code of the response or name of the exception.
+        :param int attempt: Number of the attempt, starting at 0.
+        :param float seconds: Total duration of the attempt.
+        :param float connect: Time spent by opening new connections (DNS, TCP and TLS), None if not known.
+        :param float ttfb: Time from sending the request to receiving the headers, without connect.
+        :param int size: Size of the body in bytes.
+        """
+        labels = {'stage': _stage.get(), 'host': self._host(url)}
+        self.increment('request_attempts_total', outcome=str(outcome), **labels)
+        if attempt:
+            self.increment('request_retries_total', **labels)
+        if seconds is None:
+            return
+        _state.network = _thread_state('network', 0.0) + seconds
+        if connect is not None:
+            self.observe('request_seconds', connect, phase='connect', **labels)
+        if ttfb is not None:
+            self.observe('request_seconds', ttfb, phase='ttfb', **labels)
+            self.observe('request_seconds', seconds - ttfb - (connect or 0.0), phase='transfer', **labels)
+        self.observe('request_seconds', seconds, phase='total', **labels)
+        if size is not None:
+            self.observe('response_bytes', size, buckets=BYTES_BUCKETS, **labels)
+
+    def record_wait(self, url, seconds):
+        """
+        Records the time waited for the rate limiter or before a retry.
+
+        :param str url: Requested url.
+        :param float seconds: Waited time.
+        """
+        if seconds <= 0:
+            return
+        _state.network = _thread_state('network', 0.0) + seconds
+        self.observe('wait_seconds', seconds, stage=_stage.get(), host=self._host(url))
+
+    def record_cache(self, url, result):
+        """
+        :param str url: Requested url.
+        :param str result: 'hit', 'revalidated' or 'miss'.
+        """
+        self.increment('cache_requests_total', result=result, stage=_stage.get(), host=self._host(url))
+
+    def record_redirect(self, url):
+        """
+        :param str url: Requested url, which was sent directly to its known redirect target.
+        """
+        self.increment('redirect_cache_hits_total', stage=_stage.get(), host=self._host(url))
+
+    def record_proxy(self, proxy, outcome):
+        """
+        :param str proxy: Host and port of the proxy, without the credentials.
+        :param str outcome: 'ok', 'blocked' or 'failed'.
+        """
+        self.increment('proxy_requests_total', proxy=proxy, outcome=outcome)
+
+    def record_dns(self, result, seconds=None):
+        """
+        :param str result: 'hit', 'negative_hit', 'resolved', 'nxdomain' or 'error'.
+        :param float seconds: Duration of the lookup, None for the cache hits.
+        """
+        self.increment('dns_lookups_total', result=result)
+        if seconds is not None:
+            self.observe('dns_seconds', seconds, result=result)
+
+    @contextmanager
+    def unit(self, stage):
+        """
+        Measures a unit of work of the stage (a page, an eshop, an account). Requests made within it are labeled by
+        the stage and the time not spent on the network is recorded as parse time.
+
+        :param str stage: Name of the stage.
+        """
+        previous_network = _thread_state('network', 0.0)
+        _state.network = 0.0
+        start_time = time.perf_counter()
+        try:
+            with stage_label(stage):
+                yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.increment('units_total', stage=stage, source='download')
+            self.observe('unit_seconds', seconds, stage=stage)
+            self.observe('parse_seconds', max(0.0, seconds - _state.network), stage=stage)
+            _state.network = previous_network
+
+    def to_dict(self):
+        """
+        :return dict: Report with all counters and histograms (with estimated quantiles).
+        """
+        with self._lock:
+            counters = [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+            histograms = [(name, dict(labels), histogram.to_dict())
+                          for (name, labels), histogram in self._histograms.items()]
+        report = {'counters': {}, 'histograms': {}}
+        for name, labels, value in sorted(counters, key=lambda item: (item[0], sorted(item[1].items()))):
+            report['counters'].setdefault(name, []).append({'labels': labels, 'value': value})
+        for name, labels, value in sorted(histograms, key=lambda item: (item[0], sorted(item[1].items()))):
+            report['histograms'].setdefault(name, []).append({'labels': labels, **value})
+        return report
+
+    def to_prometheus(self, namespace='crawler'):
+        """
+        :param str namespace: Prefix of the metric names.
+        :return str: All metrics in the Prometheus text exposition format.
+        """
+        def format_labels(labels, **extra):
+            labels = {**labels, **extra}
+            return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+        report = self.to_dict()
+        lines = []
+        for name, series in report['counters'].items():
+            lines.append(f'# TYPE {namespace}_{name} counter')
+            lines.extend(f'{namespace}_{name}{format_labels(s["labels"])} {s["value"]}' for s in series)
+        for name, series in report['histograms'].items():
+            lines.append(f'# TYPE {namespace}_{name} histogram')
+            for s in series:
+                cumulative = 0
+                for bound, count in s['buckets'].items():
+                    cumulative += count
+                    lines.append(f'{namespace}_{name}_bucket{format_labels(s["labels"], le=bound)} {cumulative}')
+                lines.append(f'{namespace}_{name}_sum{format_labels(s["labels"])} {s["sum"]}')
+                lines.append(f'{namespace}_{name}_count{format_labels(s["labels"])} {s["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        """
+        :param str path: Path to the JSON report.
+        """
+        _write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path, namespace='crawler'):
+        """
+        Writes the metrics for the textfile collector of the Prometheus node exporter.
+
+        :param str path: Path to the .prom file.
+        :param str namespace: Prefix of the metric names.
+        """
+        _write_atomically(path, self.to_prometheus(namespace))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._hosts.clear()
+
+
+@contextmanager
+def stage_label(stage):
+    """
+    Labels the requests made within the block (and by the asyncio tasks created within it) by the stage.
+
+    :param str stage: Name of the stage.
+    """
+    token = _stage.set(stage)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomically(path, text):
+    """
+    Writes to a temporary file first, so readers never see a half-written file.
+    """
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def connect_seconds():
+    """
+    :return float: Total time the current thread spent by opening new connections.
+    """
+    return _thread_state('connect', 0.0)
+
+
+class _TimedConnectionMixin:
+    """
+    Adds the time of opening the connection (DNS, TCP and TLS) to the state of the current thread.
+    """
+
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _state.connect = connect_seconds() + time.perf_counter() - start_time
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections measure the time of opening, see connect_seconds.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+
+# registry shared by all RequestHelpers which do not get their own
+METRICS = Metrics()
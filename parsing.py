@@ -0,0 +1,133 @@
+import re
+import threading
+
+# lxml and parsel are imported when the first page is parsed, so importing the stages stays fast
+
+# charset declared in the Content-Type header or in the <meta> tag
+_RGX_HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_RGX_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+# only the beginning of the document is searched for the <meta> tag
+_META_SNIFF_BYTES = 4096
+
+# lxml parsers must not be used by several threads at once, so every thread has its own
+_parsers = threading.local()
+
+
+class Extractor:
+    """
+    XPath (or CSS) expression compiled once and evaluated directly on lxml elements, so the expression is not parsed
+    again for every page and no parsel.Selector wrappers are created for the results. The expression is compiled on
+    the first use, the extractors are defined at the import of the stages.
+    """
+
+    def __init__(self, xpath=None, *, css=None):
+        """
+        __init__ method for the class.
+
+        :param str xpath: XPath expression.
+        :param str css: CSS expression, can be used instead of xpath. Supports parsel's ::text and ::attr() extensions.
+        """
+        if (xpath is None) == (css is None):
+            raise ValueError('Exactly one of xpath and css has to be supplied.')
+        self._xpath = xpath
+        self._css = css
+        self._compiled = None
+
+    @property
+    def xpath(self):
+        """
+        :return str: The XPath expression, translated from the CSS one if needed.
+        """
+        if self._xpath is None:
+            from parsel.csstranslator import HTMLTranslator
+            self._xpath = HTMLTranslator().css_to_xpath(self._css)
+        return self._xpath
+
+    def getall(self, node):
+        """
+        Evaluates the expression.
+
+        :param node: parsel.Selector or lxml element.
+        :return list: Strings (for text and attributes) or lxml elements.
+        """
+        if self._compiled is None:
+            from lxml import etree
+            # smart_strings=False -> plain strings without the reference to their parent element
+            self._compiled = etree.XPath(self.xpath, smart_strings=False)
+        # parsel.Selector wraps the lxml element in its root attribute
+        return self._compiled(getattr(node, 'root', node))
+
+    def get(self, node, default=None):
+        """
+        Evaluates the expression and returns the first result.
+
+        :param node: parsel.Selector or lxml element.
+        :param default: Value returned if nothing matches.
+        :return: String (for text and attributes) or lxml element.
+        """
+        results = self.getall(node)
+        return results[0] if results else default
+
+
+def detect_encoding(content, content_type=None):
+    """
+    Finds the encoding of the html document without decoding it. Content-Type header wins, then the <meta> tag at
+    the beginning of the document, utf-8 otherwise.
+
+    :param bytes content: Raw body of the document.
+    :param str content_type: Value of the Content-Type header.
+    :return str: Name of the encoding.
+    """
+    match = _RGX_HEADER_CHARSET.search(content_type or '')
+    if match:
+        return match[1]
+    match = _RGX_META_CHARSET.search(content[:_META_SNIFF_BYTES])
+    if match:
+        return match[1].decode('ascii')
+    return 'utf-8'
+
+
+def _parser(encoding):
+    """
+    Returns lxml html parser for the encoding, parsers are cached per thread.
+    """
+    from lxml import etree
+
+    parsers = _parsers.__dict__
+    if encoding not in parsers:
+        try:
+            parsers[encoding] = etree.HTMLParser(encoding=encoding, remove_comments=True, huge_tree=True)
+        except LookupError:
+            parsers[encoding] = etree.HTMLParser(encoding='utf-8', remove_comments=True, huge_tree=True)
+    return parsers[encoding]
+
+
+def parse_html(content, encoding=None):
+    """
+    Parses the raw html into lxml tree, the body is decoded by lxml itself.
+
+    :param bytes content: Raw body of the document.
+    :param str encoding: Encoding of the document, detected if not supplied.
+    :return lxml.etree._Element: Root element of the document.
+    """
+    from lxml import etree
+
+    root = None
+    if content.strip():
+        root = etree.fromstring(content, parser=_parser(encoding or detect_encoding(content)))
+    # lxml returns None for documents without any element
+    return root if root is not None else etree.fromstring(b'<html/>', parser=_parser('utf-8'))
+
+
+def selector_from_bytes(content, content_type=None):
+    """
+    Builds parsel.Selector from the raw body without decoding it to str first.
+
+    :param bytes content: Raw body of the document.
+    :param str content_type: Value of the Content-Type header.
+    :return parsel.Selector: Selector object
+    """
+    from parsel import Selector
+
+    return Selector(root=parse_html(content, detect_encoding(content, content_type)))
@@ -0,0 +1,159 @@
+import queue
+import threading
+
+
+# marks the end of the stream in the queues
+_DONE = object()
+
+
+class _Failure:
+    """
+    Wraps an exception raised in a stage, so it travels through the queues to the consumer.
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues. Every stage runs in its own threads and passes each record to the
+    next stage as soon as it is done with it, so the records can be consumed incrementally. When a queue is full,
+    the stage in front of it waits (backpressure).
+
+    Usage::
+
+        p = Pipeline(source_function, queue_size=100)
+        p.add_stage(download_detail, workers=4)
+        p.add_stage(download_eshop, workers=30)
+        for record in p:
+            ...
+    """
+
+    def __init__(self, source, *, queue_size=100):
+        """
+        __init__ method for the class.
+
+        :param callable source: Function without arguments returning an iterable of records for the first stage.
+        :param int queue_size: Maximum number of records waiting between two stages.
+        """
+        self._source = source
+        self._queue_size = queue_size
+        self._stages = []
+
+    def add_stage(self, func, *, workers=1):
+        """
+        Appends a stage to the pipeline.
+
+        :param callable func: Function taking a record and returning the record for the next stage.
+        :param int workers: Number of threads of the stage.
+        :return Pipeline: self, so the calls can be chained.
+        """
+        self._stages.append((func, workers))
+        return self
+
+    # number of seconds a blocked thread waits before it checks whether the pipeline was stopped
+    POLL_INTERVAL = 0.1
+
+    @classmethod
+    def _put(cls, out_queue, record, stop):
+        """
+        Puts the record to the queue, waits while it is full.
+
+        :return bool: False if the pipeline was stopped before the record was put.
+        """
+        while not stop.is_set():
+            try:
+                out_queue.put(record, timeout=cls.POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @classmethod
+    def _get(cls, in_queue, stop):
+        """
+        Takes the next record from the queue, waits while it is empty.
+
+        :return: The record, _DONE if the pipeline was stopped.
+        """
+        while not stop.is_set():
+            try:
+                return in_queue.get(timeout=cls.POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _feed(self, out_queue, downstream_workers, stop):
+        """
+        Puts the records from the source to the first queue.
+        """
+        try:
+            for record in self._source():
+                if not self._put(out_queue, record, stop):
+                    return
+        except Exception as e:
+            self._put(out_queue, _Failure(e), stop)
+        for _ in range(downstream_workers):
+            self._put(out_queue, _DONE, stop)
+
+    @classmethod
+    def _work(cls, func, in_queue, out_queue, stop):
+        """
+        Single worker of a stage, processes records until the end of the stream or until the pipeline is stopped.
+        """
+        while True:
+            record = cls._get(in_queue, stop)
+            if record is _DONE:
+                return
+            if not isinstance(record, _Failure):
+                try:
+                    record = func(record)
+                except Exception as e:
+                    record = _Failure(e)
+            if not cls._put(out_queue, record, stop):
+                return
+
+    @classmethod
+    def _finish(cls, threads, out_queue, downstream_workers, stop):
+        """
+        Waits for all workers of the stage and then signals the end of the stream to the next stage.
+        """
+        for thread in threads:
+            thread.join()
+        for _ in range(downstream_workers):
+            cls._put(out_queue, _DONE, stop)
+
+    def __iter__(self):
+        """
+        Starts all stages and yields the records leaving the last stage in the order they are finished. When the
+        iteration ends early (break, close, an exception), the threads are stopped once they finish their current
+        record.
+
+        :raises Exception: The first exception raised by the source or any stage.
+        """
+        queues = [queue.Queue(self._queue_size) for _ in range(len(self._stages) + 1)]
+        # the consumer reading the last queue counts as a single worker
+        workers_count = [workers for _, workers in self._stages] + [1]
+        stop = threading.Event()
+
+        threading.Thread(target=self._feed, args=(queues[0], workers_count[0], stop), daemon=True).start()
+        for index, (func, workers) in enumerate(self._stages):
+            threads = [threading.Thread(target=self._work, args=(func, queues[index], queues[index + 1], stop),
+                                        daemon=True)
+                       for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            threading.Thread(target=self._finish, args=(threads, queues[index + 1], workers_count[index + 1], stop),
+                             daemon=True).start()
+
+        try:
+            while True:
+                record = queues[-1].get()
+                if record is _DONE:
+                    return
+                if isinstance(record, _Failure):
+                    raise record.exception
+                yield record
+        finally:
+            stop.set()
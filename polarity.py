@@ -0,0 +1,303 @@
+import glob
+import json
+import os
+import re
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# number of hashed term columns, distinct terms falling to the same column are counted together
+N_FEATURES = 2 ** 20
+
+# statistics kept for every hashed term
+COLUMNS = ('positive_count', 'negative_count', 'positive_docs', 'negative_docs', 'rating_sum', 'rated_docs')
+
+# words of at least two letters, digits and underscores are not part of the words (Czech letters are)
+_RGX_WORD = re.compile(r'[^\W\d_]{2,}')
+
+# separator of the texts of a chunk, which is split at once
+_SEPARATOR = '\x00'
+
+
+def _hash_terms(terms, n_features):
+    """
+    Hashes the terms by crc32, which is the same in every process (unlike the built-in hash).
+
+    :param terms: Distinct terms.
+    :param int n_features: Number of hashed term columns.
+    :return numpy.ndarray: Column of every term.
+    """
+    return np.fromiter((zlib.crc32(term.encode()) for term in terms), np.int64, len(terms)) % n_features
+
+
+def _local_matrix(texts):
+    """
+    :param list texts: Texts of the reviews.
+    :return tuple: Term-document matrix (documents in rows, term counts in columns) with a column for every distinct
+                   term of the texts, and the distinct terms.
+    """
+    if not texts:
+        return sparse.csr_matrix((0, 0)), np.array([], dtype=object)
+    # the chunk is split by whitespace at once, starting by the separator, so the separator is the raw token 0
+    text = f' {_SEPARATOR} '.join(text.replace(_SEPARATOR, ' ') if text else '' for text in texts)
+    codes, raw_tokens = pd.factorize(np.array(f'{_SEPARATOR} {text}'.split(), dtype=object))
+    rows = np.cumsum(codes == 0) - 1
+    raw_matrix = sparse.csr_matrix((np.ones(len(codes)), (rows, codes)), shape=(len(texts), len(raw_tokens)))
+
+    # only the distinct raw tokens are split to the lowercase words (e.g. 'Rychlé,levné!' to 'rychlé' and 'levné')
+    # and the matrix of the raw tokens is multiplied by the matrix of their words
+    words = [_RGX_WORD.findall(token.lower()) for token in raw_tokens.tolist()]
+    word_codes, terms = pd.factorize(np.array(list(chain.from_iterable(words)), dtype=object))
+    raw_rows = np.repeat(np.arange(len(words)), [len(token_words) for token_words in words])
+    mapping = sparse.csr_matrix((np.ones(len(word_codes)), (raw_rows, word_codes)), shape=(len(words), len(terms)))
+    return (raw_matrix @ mapping).tocsr(), terms
+
+
+def term_document_matrix(texts, n_features=N_FEATURES):
+    """
+    :param list texts: Texts of the reviews.
+    :param int n_features: Number of hashed term columns.
+    :return scipy.sparse.csr_matrix: Hashed term-document matrix, documents in rows and term counts in columns.
+    """
+    matrix, terms = _local_matrix(texts)
+    matrix = matrix.tocoo()
+    columns = _hash_terms(terms, n_features)
+    return sparse.csr_matrix((matrix.data, (matrix.row, columns[matrix.col])), shape=(matrix.shape[0], n_features))
+
+
+def _chunk_stats(texts, ratings, n_features, positive_min, negative_max):
+    """
+    Computes the statistics of a single chunk of reviews, runs in the worker processes.
+
+    :return tuple: Hashed columns of the terms of the chunk, their statistics (one row per COLUMNS), number of
+                   positive, negative and rated reviews, and the terms by their columns.
+    """
+    matrix, terms = _local_matrix(texts)
+    ratings = np.array([np.nan if rating is None else rating for rating in ratings], dtype=float)
+    rated = ~np.isnan(ratings)
+    positive = rated & (np.nan_to_num(ratings) >= positive_min)
+    negative = rated & (np.nan_to_num(ratings) <= negative_max)
+
+    present = matrix.copy()
+    present.data[:] = 1
+    counts = matrix.T @ np.column_stack([positive, negative]).astype(float)
+    docs = present.T @ np.column_stack([positive, negative, np.where(rated, ratings, 0.0), rated]).astype(float)
+
+    columns = _hash_terms(terms, n_features)
+    return (columns, np.vstack([counts.T, docs.T]), np.array([positive.sum(), negative.sum(), rated.sum()]),
+            dict(zip(columns.tolist(), terms.tolist())))
+
+
+class TermStats:
+    """
+    Per-term polarity statistics of the reviews: occurrences and documents in positive and negative reviews and the
+    mean rating of the reviews containing the term. Terms are hashed to a fixed number of columns, so the memory does
+    not grow with the number of reviews. The statistics are updated chunk by chunk and partial statistics (e.g. of
+    different files or processes) can be merged.
+    """
+
+    def __init__(self, n_features=N_FEATURES, *, positive_min=4.0, negative_max=2.0, keep_terms=True):
+        """
+        __init__ method for the class.
+
+        :param int n_features: Number of hashed term columns.
+        :param float positive_min: Reviews with at least this rating are positive.
+        :param float negative_max: Reviews with at most this rating are negative.
+        :param bool keep_terms: If True, the first term seen in every column is kept, so the results show terms
+                                instead of the column numbers.
+        """
+        self.n_features = n_features
+        self.positive_min = positive_min
+        self.negative_max = negative_max
+        self.keep_terms = keep_terms
+        self.values = np.zeros((len(COLUMNS), n_features))
+        # number of positive, negative and rated reviews
+        self.docs = np.zeros(3)
+        self.terms = {}
+
+    def update(self, texts, ratings):
+        """
+        Adds a chunk of reviews.
+
+        :param list texts: Texts of the reviews.
+        :param list ratings: Ratings of the reviews, None for unrated.
+        :return TermStats: self
+        """
+        self._add(*_chunk_stats(texts, ratings, self.n_features, self.positive_min, self.negative_max))
+        return self
+
+    def _add(self, columns, values, docs, terms):
+        """
+        Adds the statistics of a chunk returned by _chunk_stats.
+        """
+        # columns can repeat if two terms of the chunk have the same hash
+        np.add.at(self.values, (slice(None), columns), values)
+        self.docs += docs
+        if self.keep_terms:
+            for column, term in terms.items():
+                self.terms.setdefault(column, term)
+
+    def merge(self, other):
+        """
+        Adds the statistics of other reviews.
+
+        :param TermStats other: Statistics with the same number of features and rating thresholds.
+        :return TermStats: self
+        """
+        if (other.n_features, other.positive_min, other.negative_max) != \
+                (self.n_features, self.positive_min, self.negative_max):
+            raise ValueError('Only statistics with the same n_features, positive_min and negative_max can be merged.')
+        self.values += other.values
+        self.docs += other.docs
+        if self.keep_terms:
+            for column, term in other.terms.items():
+                self.terms.setdefault(column, term)
+        return self
+
+    def log_odds(self, prior=100.0):
+        """
+        Log-odds ratio of the term being in positive rather than negative reviews, with the informative Dirichlet
+        prior proportional to the frequency of the term in all reviews (Monroe et al., Fightin' Words).
+
+        :param float prior: Strength of the prior, in number of words.
+        :return tuple: Log-odds ratio and its z-score for every column, positive values mean positive terms.
+        """
+        positive, negative = self.values[0], self.values[1]
+        positive_total, negative_total = positive.sum(), negative.sum()
+        total = positive_total + negative_total
+        alpha = prior * (positive + negative) / total if total else np.zeros(self.n_features)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = (np.log((positive + alpha) / (positive_total + prior - positive - alpha))
+                     - np.log((negative + alpha) / (negative_total + prior - negative - alpha)))
+            z_score = delta / np.sqrt(1 / (positive + alpha) + 1 / (negative + alpha))
+        return delta, z_score
+
+    def table(self, min_count=5, prior=100.0):
+        """
+        :param int min_count: Minimum number of occurrences of the term in positive and negative reviews.
+        :param float prior: Strength of the prior of the log-odds ratio.
+        :return pandas.DataFrame: Statistics of the terms, indexed by the term (or by the column if not kept).
+        """
+        columns = np.flatnonzero(self.values[0] + self.values[1] >= max(min_count, 1))
+        delta, z_score = self.log_odds(prior)
+        rated = self.values[5, columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_rating = np.where(rated > 0, self.values[4, columns] / rated, np.nan)
+        df = pd.DataFrame({name: self.values[i, columns] for i, name in enumerate(COLUMNS) if name != 'rating_sum'})
+        df['mean_rating'] = mean_rating
+        df['log_odds'] = delta[columns]
+        df['z_score'] = z_score[columns]
+        df.index = pd.Index([self.terms.get(column, column) for column in columns.tolist()], name='term')
+        return df
+
+    def most_polar(self, n=20, min_count=5, prior=100.0):
+        """
+        :param int n: Number of terms.
+        :return tuple: DataFrames of the n most positive and the n most negative terms by the z-score.
+        """
+        df = self.table(min_count, prior)
+        return df.nlargest(n, 'z_score'), df.nsmallest(n, 'z_score')
+
+    def __getstate__(self):
+        # only the used columns are pickled, so the statistics are cheap to send between the processes
+        state = self.__dict__.copy()
+        columns = np.flatnonzero(self.values.any(axis=0))
+        state['values'] = (columns, self.values[:, columns])
+        return state
+
+    def __setstate__(self, state):
+        columns, values = state['values']
+        state['values'] = np.zeros((len(COLUMNS), state['n_features']))
+        state['values'][:, columns] = values
+        self.__dict__.update(state)
+
+    def save(self, path):
+        """
+        Saves the statistics, so they can be updated or merged later.
+
+        :param str path: Path to the .npz file.
+        """
+        columns = np.flatnonzero(self.values.any(axis=0))
+        np.savez_compressed(path, columns=columns, values=self.values[:, columns], docs=self.docs,
+                            config=np.array([self.n_features, self.positive_min, self.negative_max]),
+                            terms=np.array(json.dumps({str(k): v for k, v in self.terms.items()}, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param str path: Path to the .npz file written by save.
+        :return TermStats: Loaded statistics.
+        """
+        with np.load(path) as data:
+            n_features, positive_min, negative_max = data['config']
+            stats = cls(int(n_features), positive_min=float(positive_min), negative_max=float(negative_max))
+            stats.values[:, data['columns']] = data['values']
+            stats.docs = data['docs']
+            stats.terms = {int(k): v for k, v in json.loads(str(data['terms'])).items()}
+        return stats
+
+
+def read_chunks(path, chunk_size=10000, fields=('text',)):
+    """
+    Reads the reviews in chunks, either from the JSON lines file written by Reviews or from the 'reviews' stage of
+    the ResultStore directory.
+
+    :param str path: Path to the JSON lines file or to the ResultStore directory.
+    :param int chunk_size: Number of reviews in a chunk.
+    :param tuple fields: Fields joined to the text of the review, 'text', 'pros' and 'cons'.
+    :return generator: Texts and ratings of every chunk.
+    """
+    def text(review):
+        return ' '.join(' '.join(value) if isinstance(value, list) else value or ''
+                        for value in (review[field] for field in fields))
+
+    if os.path.isdir(path):
+        import pyarrow.parquet as pq
+
+        for part in sorted(glob.glob(os.path.join(path, 'reviews', 'part-*.parquet'))):
+            for batch in pq.ParquetFile(part).iter_batches(chunk_size, columns=[*fields, 'rating']):
+                reviews = batch.to_pylist()
+                yield [text(review) for review in reviews], [review['rating'] for review in reviews]
+        return
+
+    with open(path, encoding='utf-8') as f:
+        while True:
+            reviews = [json.loads(line) for line in islice(f, chunk_size)]
+            if not reviews:
+                return
+            yield [text(review) for review in reviews], [review['rating'] for review in reviews]
+
+
+def analyze(chunks, *, processes=None, stats=None, **kwargs):
+    """
+    Computes the polarity statistics of the chunks of reviews in worker processes.
+
+    :param iterable chunks: Texts and ratings of the chunks, e.g. read_chunks.
+    :param int processes: Number of worker processes, os.cpu_count() if None, 1 runs in this process.
+    :param TermStats stats: Statistics updated by the chunks, new TermStats(**kwargs) if None.
+    :return TermStats: Updated statistics.
+    """
+    stats = stats if stats is not None else TermStats(**kwargs)
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        for texts, ratings in chunks:
+            stats.update(texts, ratings)
+        return stats
+
+    with ProcessPoolExecutor(processes) as executor:
+        pending = set()
+        for texts, ratings in chunks:
+            # a few chunks per process are read ahead, the rest of the file stays on the disk
+            if len(pending) >= 2 * processes:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats._add(*future.result())
+            pending.add(executor.submit(_chunk_stats, texts, ratings, stats.n_features, stats.positive_min,
+                                        stats.negative_max))
+        for future in pending:
+            stats._add(*future.result())
+    return stats
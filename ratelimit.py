@@ -0,0 +1,211 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when the host failed too many times in a row and requests to it are suspended.
+    """
+
+
+def parse_retry_after(value):
+    """
+    Parses the value of Retry-After header, which is either number of seconds or HTTP date.
+
+    :param str value: Value of the header.
+    :return float: Number of seconds to wait, None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _HostState:
+    """
+    Token bucket and circuit breaker state of a single host.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+        self.consecutive_failures = 0
+        self.opened_at = None
+        # monotonic time the probe request of the half-open circuit was let through, None if there is none
+        self.probe_started = None
+
+
+class HostScheduler:
+    """
+    Per-host politeness control shared by all threads (and the asyncio backend) of one RequestHelper.
+
+    Every host has its own token bucket. The rate grows additively after every successful response and is cut
+    multiplicatively when the host throttles (429/503), so each site runs at the highest rate it tolerates (AIMD).
+    Retry-After is honoured and a host failing repeatedly is suspended for a while (circuit breaker). After the
+    cooldown a single probe request is let through; a probe which never reports its result (see release) stops
+    blocking the host after another cooldown.
+    """
+
+    # status codes telling us that we go too fast
+    THROTTLE_STATUS_CODES = {429, 503}
+
+    def __init__(self, *, initial_rate=5.0, min_rate=0.2, max_rate=50.0, burst=5, additive_increase=0.5,
+                 multiplicative_decrease=0.5, domain_rates=None, failure_threshold=5, cooldown=60.0):
+        """
+        __init__ method for the class.
+
+        :param float initial_rate: Requests per second to a host before any response is seen.
+        :param float min_rate: Lower bound of the rate.
+        :param float max_rate: Upper bound of the rate.
+        :param int burst: Size of the token bucket.
+        :param float additive_increase: Increase of the rate after every successful response.
+        :param float multiplicative_decrease: Factor applied to the rate when the host throttles.
+        :param dict domain_rates: Mapping of domain to its initial rate, e.g. {'instagram.com': 0.5}. Subdomains match
+                                  too.
+        :param int failure_threshold: Number of consecutive failures after which the circuit opens.
+        :param float cooldown: Number of seconds the circuit stays open before a probe request is allowed.
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.domain_rates = domain_rates or {}
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def host_of(url):
+        """
+        :param str url: Url
+        :return str: Lowercase host name of the url.
+        """
+        return (urlsplit(url).hostname or '').lower()
+
+    def _state(self, host):
+        """
+        Returns state of the host, creates it if needed. Must be called with the lock held.
+        """
+        state = self._hosts.get(host)
+        if state is None:
+            rate = self.initial_rate
+            for domain, domain_rate in self.domain_rates.items():
+                if host == domain or host.endswith('.' + domain):
+                    rate = domain_rate
+                    break
+            state = self._hosts[host] = _HostState(rate, self.burst)
+        return state
+
+    def reserve(self, url):
+        """
+        Reserves a slot for the request to the url. The caller has to wait the returned number of seconds before
+        sending the request (time.sleep or asyncio.sleep).
+
+        :param str url: Url to be requested.
+        :return float: Number of seconds to wait.
+        :raises CircuitOpenError: If the host is suspended.
+        """
+        host = self.host_of(url)
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+
+            if state.opened_at is not None:
+                probing = state.probe_started is not None and now - state.probe_started < self.cooldown
+                if now - state.opened_at < self.cooldown or probing:
+                    raise CircuitOpenError(f'Requests to {host} are suspended after '
+                                           f'{state.consecutive_failures} consecutive failures.')
+                # half-open, only a single probe request is let through
+                state.probe_started = now
+
+            # refill the bucket and take one token, the bucket can go negative, which means waiting
+            state.tokens = min(state.burst, state.tokens + (now - state.updated_at) * state.rate)
+            state.updated_at = now
+            state.tokens -= 1
+            wait = -state.tokens / state.rate if state.tokens < 0 else 0.0
+            return max(wait, state.blocked_until - now)
+
+    def record(self, url, status_code=None, retry_after=None):
+        """
+        Records the result of the request, so the rate and the circuit breaker can be adjusted.
+
+        :param str url: Requested url.
+        :param int status_code: Status code of the response, None if the request failed with an exception.
+        :param float retry_after: Number of seconds from Retry-After header, if any.
+        """
+        host = self.host_of(url)
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            state.probe_started = None
+
+            if retry_after:
+                state.blocked_until = max(state.blocked_until, now + retry_after)
+
+            if status_code in self.THROTTLE_STATUS_CODES:
+                state.rate = max(self.min_rate, state.rate * self.multiplicative_decrease)
+                state.tokens = min(state.tokens, 0)
+                self._failure(state, now)
+            elif status_code is None or status_code >= 500:
+                self._failure(state, now)
+            else:
+                state.rate = min(self.max_rate, state.rate + self.additive_increase)
+                state.consecutive_failures = 0
+                state.opened_at = None
+
+    def release(self, url):
+        """
+        Gives up the slot reserved for the request which was not sent or whose result is unknown (e.g. no proxy was
+        available, the request was cancelled), so the probe of the suspended host can go out again.
+
+        :param str url: Requested url.
+        """
+        with self._lock:
+            state = self._hosts.get(self.host_of(url))
+            if state is not None:
+                state.probe_started = None
+
+    def _failure(self, state, now):
+        """
+        Counts the failure and opens the circuit if there were too many. Must be called with the lock held.
+        """
+        state.consecutive_failures += 1
+        if state.consecutive_failures >= self.failure_threshold:
+            state.opened_at = now
+
+    @staticmethod
+    def backoff(attempt, base=1.0, cap=60.0):
+        """
+        Exponential backoff with full jitter.
+
+        :param int attempt: Number of the failed attempt, starting at 0.
+        :param float base: Wait time after the first failure.
+        :param float cap: Maximum wait time.
+        :return float: Number of seconds to wait before the next attempt.
+        """
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    @property
+    def rates(self):
+        """
+        :return dict: Current rate (requests per second) for every host seen so far.
+        """
+        with self._lock:
+            return {host: state.rate for host, state in self._hosts.items()}
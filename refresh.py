@@ -0,0 +1,317 @@
+"""
+Incremental refresh of the dataset for recurring crawls. The history of every entity (Heureka detail page, eshop
+page, Instagram profile) is kept in a SQLite file: when it was fetched, the hash of its parsed record and how often
+the record changed. Every run downloads the Heureka listing pages, estimates the probability that each known entity
+has changed since its last fetch, and refetches only the most probable changes weighted by the importance of the
+eshop (number of its reviews), within the request budget. New entities are always fetched. The other entities are
+taken from the history, so the result is the full dataset.
+
+Usage from the repository root::
+
+    python -m refresh --history crawl/history.sqlite --count 2000 --budget 500 --output results.csv
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from canonical import canonical_account, url_key
+from heureka import Heureka
+from eshop_web import EshopWebsite
+from instagram import Instagram
+
+# fields which are not compared when looking for changes
+VOLATILE_FIELDS = {'instagram_full_json', 'instagram_full_json_path'}
+
+# stages of the dataset, in the order they depend on each other
+STAGES = ('heureka', 'eshop', 'instagram')
+
+
+def content_hash(record):
+    """
+    :param dict record: Parsed record of the entity.
+    :return str: Hash of the record without the volatile fields.
+    """
+    stable = {key: value for key, value in record.items() if key not in VOLATILE_FIELDS}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RefreshHistory:
+    """
+    History of the fetched entities stored in SQLite. The changes of an entity are modelled as a Poisson process,
+    its rate is estimated from the changes observed between the fetches, with a prior for the entities fetched only
+    a few times.
+    """
+
+    def __init__(self, path='refresh_history.sqlite', *, prior_changes=1.0, prior_seconds=7 * 24 * 3600):
+        """
+        __init__ method for the class.
+
+        :param str path: Path to the SQLite file, it is created if it does not exist.
+        :param float prior_changes: Number of changes assumed before the first fetch.
+        :param float prior_seconds: Time in which the prior changes are assumed. The default prior is a change per
+                                    week, so the rate of a rarely fetched entity is not estimated from a few fetches
+                                    only.
+        """
+        self.path = path
+        self.prior_changes = prior_changes
+        self.prior_seconds = prior_seconds
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                first_fetch REAL NOT NULL,
+                last_fetch REAL NOT NULL,
+                fetches INTEGER NOT NULL,
+                changes INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (stage, key)
+            );
+        """)
+
+    def _row(self, stage, key):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT first_fetch, last_fetch, fetches, changes, content_hash, record FROM entities '
+                'WHERE stage = ? AND key = ?', (stage, key)).fetchone()
+
+    def __contains__(self, stage_key):
+        return self._row(*stage_key) is not None
+
+    def record(self, stage, key):
+        """
+        :param str stage: Name of the stage.
+        :param str key: Key of the entity.
+        :return dict: The last fetched record of the entity, None if it was never fetched.
+        """
+        row = self._row(stage, key)
+        return json.loads(row[5]) if row is not None else None
+
+    def change_rate(self, stage, key):
+        """
+        :return float: Estimated number of changes of the entity per second, None if it was never fetched.
+        """
+        row = self._row(stage, key)
+        if row is None:
+            return None
+        first_fetch, last_fetch, _, changes = row[:4]
+        return (changes + self.prior_changes) / (last_fetch - first_fetch + self.prior_seconds)
+
+    def change_probability(self, stage, key, now=None):
+        """
+        :param float now: Unix time, current time if None.
+        :return float: Probability the entity has changed since its last fetch, 1 if it was never fetched.
+        """
+        row = self._row(stage, key)
+        if row is None:
+            return 1.0
+        rate = self.change_rate(stage, key)
+        return 1 - math.exp(-rate * max(0.0, (now or time.time()) - row[1]))
+
+    def plan(self, candidates, budget, now=None, min_probability=0.0):
+        """
+        Selects the entities worth fetching within the budget, by the probability of change times the importance.
+
+        :param list candidates: Dictionaries with 'stage', 'key', 'importance' and optionally 'cost' (number of
+                                requests, 1 by default).
+        :param int budget: Maximum number of requests.
+        :param float now: Unix time, current time if None.
+        :param float min_probability: Entities less probably changed are not fetched even if the budget allows.
+        :return list: Selected candidates in the order of priority, with 'probability' and 'priority' added.
+        """
+        now = now or time.time()
+        scored = []
+        for candidate in candidates:
+            probability = self.change_probability(candidate['stage'], candidate['key'], now)
+            if probability < min_probability:
+                continue
+            priority = probability * (1 + math.log1p(max(candidate.get('importance') or 0, 0)))
+            scored.append({**candidate, 'probability': probability, 'priority': priority})
+        scored.sort(key=lambda candidate: candidate['priority'], reverse=True)
+
+        selected = []
+        for candidate in scored:
+            cost = candidate.get('cost', 1)
+            if cost <= budget:
+                selected.append(candidate)
+                budget -= cost
+        return selected
+
+    def observe(self, stage, key, record, now=None):
+        """
+        Records the fetched record of the entity.
+
+        :param str stage: Name of the stage.
+        :param str key: Key of the entity.
+        :param dict record: Parsed record.
+        :param float now: Unix time of the fetch, current time if None.
+        :return bool: True if the record has changed since the last fetch (or was fetched for the first time).
+        """
+        now = now or time.time()
+        digest = content_hash(record)
+        data = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            row = self._connection.execute('SELECT content_hash FROM entities WHERE stage = ? AND key = ?',
+                                           (stage, key)).fetchone()
+            if row is None:
+                self._connection.execute('INSERT INTO entities VALUES (?, ?, ?, ?, 1, 0, ?, ?)',
+                                         (stage, key, now, now, digest, data))
+                return True
+            changed = row[0] != digest
+            self._connection.execute(
+                'UPDATE entities SET last_fetch = ?, fetches = fetches + 1, changes = changes + ?, content_hash = ?, '
+                'record = ? WHERE stage = ? AND key = ?', (now, int(changed), digest, data, stage, key))
+            return changed
+
+    def counts(self):
+        """
+        :return dict: Number of entities and their fetches and changes by the stage.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT stage, COUNT(*), SUM(fetches), SUM(changes) FROM entities GROUP BY stage').fetchall()
+        return {stage: {'entities': entities, 'fetches': fetches, 'changes': changes}
+                for stage, entities, fetches, changes in rows}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _list_eshops(h, count_of_eshops):
+    """
+    :return tuple: Eshops from the listing pages and the number of downloaded pages.
+    """
+    eshops, pages = [], 0
+    while len(eshops) < count_of_eshops:
+        page = h._download_list_page()[:count_of_eshops - len(eshops)]
+        pages += 1
+        if not page:
+            break
+        eshops.extend(page)
+    return eshops, pages
+
+
+def refresh(history, count_of_eshops=30, req=None, *, budget=1000, min_probability=0.05, threads=10, now=None):
+    """
+    Refreshes the dataset of download_all within the request budget, see the module documentation.
+
+    :param RefreshHistory history: History of the entities, or path to its SQLite file.
+    :param int count_of_eshops: Number of eshops to include.
+    :param RequestHelper req: a Request helper class to be passed
+    :param int budget: Maximum number of requests refetching the known entities (listing pages included, retries
+                       not counted), the new entities are fetched on top of it.
+    :param float min_probability: Entities less probably changed are not fetched even if the budget allows.
+    :param int threads: Number of threads downloading the Heureka detail pages.
+    :param float now: Unix time of the run, current time if None.
+    :return tuple: pandas.DataFrame with the same columns as download_all and dictionary with the number of
+                   fetched and changed entities by the stage.
+    """
+    import pandas as pd
+
+    if isinstance(history, str):
+        history = RefreshHistory(history)
+    now = now or time.time()
+    stats = {stage: {'fetched': 0, 'changed': 0} for stage in STAGES}
+
+    def observe(stage, key, record):
+        stats[stage]['fetched'] += 1
+        stats[stage]['changed'] += history.observe(stage, key, record, now)
+
+    h = Heureka(req=req)
+    e = EshopWebsite(req=req)
+    i = Instagram(req=req, keep_full_json=False)
+
+    # listing pages are always downloaded, they show new eshops and the number of reviews (the importance)
+    eshops, pages = _list_eshops(h, count_of_eshops)
+    budget -= pages
+    importance = {eshop['inner_link']: eshop.get('reviews') or 0 for eshop in eshops}
+
+    # candidates known from the history compete for the budget, new entities are fetched regardless of it
+    candidates, new = [], []
+    for eshop in eshops:
+        detail = history.record('heureka', eshop['inner_link'])
+        weight = importance[eshop['inner_link']]
+        if detail is None:
+            new.append(eshop)
+            continue
+        candidates.append({'stage': 'heureka', 'key': eshop['inner_link'], 'eshop': eshop, 'importance': weight})
+        website = history.record('eshop', url_key(detail['link'])) if detail.get('link') else None
+        if website is not None:
+            candidates.append({'stage': 'eshop', 'key': url_key(detail['link']), 'url': detail['link'],
+                               'importance': weight})
+            if website['instagram']:
+                candidates.append({'stage': 'instagram', 'key': canonical_account(website['instagram']),
+                                   'account': website['instagram'], 'importance': weight})
+    plan = history.plan(candidates, budget, now, min_probability)
+
+    # Heureka detail pages, the eshop pages not in the history yet are fetched too
+    details = [candidate['eshop'] for candidate in plan if candidate['stage'] == 'heureka'] + new
+    with ThreadPoolExecutor(threads) as executor:
+        for eshop in executor.map(h._download_eshop_detail, details):
+            observe('heureka', eshop['inner_link'], eshop)
+    websites = {candidate['key']: candidate['url'] for candidate in plan if candidate['stage'] == 'eshop'}
+    for eshop in details:
+        if eshop.get('link') and ('eshop', url_key(eshop['link'])) not in history:
+            websites.setdefault(url_key(eshop['link']), eshop['link'])
+
+    # eshop pages, the Instagram accounts not in the history yet are fetched too
+    e.run(list(websites.values()))
+    accounts = {candidate['key']: candidate['account'] for candidate in plan if candidate['stage'] == 'instagram'}
+    for website in e.output:
+        observe('eshop', url_key(website['url']), website)
+        account = canonical_account(website['instagram']) if website['instagram'] else None
+        if account and ('instagram', account) not in history:
+            accounts.setdefault(account, website['instagram'])
+
+    i.run(list(accounts.values()))
+    for profile in i.output:
+        observe('instagram', canonical_account(profile['account']) or profile['account'], profile)
+
+    # the dataset is joined from the fresh records and the kept ones
+    rows = []
+    for eshop in eshops:
+        row = {**eshop, **(history.record('heureka', eshop['inner_link']) or {})}
+        website = history.record('eshop', url_key(row['link'])) if row.get('link') else None
+        if website is not None:
+            row.update(website)
+            if website['instagram']:
+                profile = history.record('instagram', canonical_account(website['instagram']) or website['instagram'])
+                row.update((key, value) for key, value in (profile or {}).items() if key != 'account')
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('link'), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', default='refresh_history.sqlite', help='Path to the history SQLite file.')
+    parser.add_argument('--count', type=int, default=30, help='Number of eshops.')
+    parser.add_argument('--budget', type=int, default=1000, help='Maximum number of requests.')
+    parser.add_argument('--min-probability', type=float, default=0.05,
+                        help='Entities less probably changed are not fetched.')
+    parser.add_argument('--output', default='results.csv', help='Path to the CSV file with the dataset.')
+    args = parser.parse_args()
+
+    history = RefreshHistory(args.history)
+    df, stats = refresh(history, args.count, budget=args.budget, min_probability=args.min_probability)
+    df.to_csv(args.output)
+    for stage, counts in stats.items():
+        print(f'{stage:10} fetched {counts["fetched"]:6}   changed {counts["changed"]:6}')
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
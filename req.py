@@ -1,10 +1,30 @@
 import random
 import time
-from functools import lru_cache
+from urllib.parse import urlsplit
 from warnings import warn
 
 import requests
-from parsel import Selector
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from cache import ResponseCache
+from canonical import RedirectCache
+from metrics import METRICS, TimedHTTPAdapter, connect_seconds
+from ratelimit import HostScheduler, CircuitOpenError, parse_retry_after
+from parsing import selector_from_bytes
+from proxies import ProxyPool, NoProxyAvailableError, proxy_label
+from resolver import DNSCache, UnresolvableHostError
+
+try:
+    # urllib3 decodes brotli transparently only when one of these packages is available
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
 
 
 class RequestHelper:
@@ -12,7 +32,34 @@ class RequestHelper:
     This class attempts to enable to make requests more easily.
     """
 
-    def __init__(self, timeout=10, maximum_retries=5, verify=True, proxy_list=None, disable_debug_print=False):
+    # responses with these status codes are retried
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+    # hosts kept on the same proxy by the default proxy pool, Instagram does not like sessions hopping between IPs
+    STICKY_HOSTS = ('instagram.com',)
+
+    # seconds between the checks for a free proxy on the event loop
+    PROXY_POLL_INTERVAL = 0.05
+
+    # size of the chunks the streamed bodies are read by
+    CHUNK_SIZE = 16 * 1024
+
+    # headers mocking real-world browser
+    HEADERS = {
+        'cache-control': 'max-age=0',
+        'upgrade-insecure-requests': '1',
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/73.0.3683.86 Safari/537.36',
+        'dnt': '1',
+        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,'
+                  'image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
+        'accept-encoding': ACCEPT_ENCODING,
+        'accept-language': 'en,cs;q=0.9,sk;q=0.8,en-GB;q=0.7,en-US;q=0.6',
+    }
+
+    def __init__(self, timeout=10, maximum_retries=5, verify=True, proxy_list=None, disable_debug_print=False,
+                 cache=None, pool_connections=100, pool_maxsize=30, pool_block=False, scheduler=None,
+                 backoff_base=2.0, backoff_cap=60.0, metrics=None, redirects=None, proxy_pool=None,
+                 resolver=None):
         """
         __init__ method for RequestHelper class
 
@@ -20,53 +67,463 @@ class RequestHelper:
         :param int maximum_retries: Maximum retries on URL opening.
         :param bool verify: If set to false, skips https verification.
         :param list proxy_list: List of strings of proxies to be used for opening urls.
+        :param cache: ResponseCache instance or path to the SQLite cache file. If not supplied, responses are cached
+                      in memory for the lifetime of the object. False disables caching.
+        :param int pool_connections: Number of per-host connection pools kept alive.
+        :param int pool_maxsize: Maximum number of keep-alive connections per host.
+        :param bool pool_block: If True, never open more than pool_maxsize connections to a single host, threads
+                                wait for a free connection instead.
+        :param HostScheduler scheduler: Per-host rate limiter and circuit breaker shared by all threads. If not
+                                        supplied, one with default settings is created. False disables it.
+        :param float backoff_base: Wait time after the first failed attempt, doubled with every next attempt.
+        :param float backoff_cap: Maximum wait time between attempts.
+        :param Metrics metrics: Registry recording timings, sizes, status codes, retries and cache hits of all
+                                requests. If not supplied, the shared metrics.METRICS is used. False disables it.
+        :param RedirectCache redirects: Cache of the redirect chains, the urls known to redirect are requested at
+                                        their target directly. If not supplied, one is created. False disables it.
+        :param ProxyPool proxy_pool: Pool choosing the proxy of every attempt by its health. If not supplied, one is
+                                     created from proxy_list. False picks the proxies of proxy_list at random.
+        :param DNSCache resolver: Cache of the DNS lookups of all connections, the hostnames which do not exist are
+                                  not requested at all. If not supplied, one is created. False disables it.
         """
         self.proxy_list = proxy_list
+        if proxy_pool is None and proxy_list:
+            proxy_pool = ProxyPool(proxy_list, sticky=self.STICKY_HOSTS)
+        self.proxy_pool = proxy_pool or None
         self.timeout = timeout
         self.maximum_retries = maximum_retries
         self.verify = verify
         self._disable_debug_print = disable_debug_print
 
-    @lru_cache(maxsize=5000, typed=False)
-    def make_request(self, url):
+        if cache is None:
+            cache = ResponseCache(':memory:')
+        elif isinstance(cache, str):
+            cache = ResponseCache(cache)
+        self.cache = cache or None
+
+        self.scheduler = HostScheduler() if scheduler is None else scheduler or None
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.metrics = METRICS if metrics is None else metrics or None
+        self.redirects = RedirectCache() if redirects is None else redirects or None
+        self.resolver = DNSCache(metrics=self.metrics) if resolver is None else resolver or None
+
+        # one session shared by all threads, urllib3 pools underneath are thread-safe and keep the connections alive
+        self.session = requests.Session()
+        adapter_class = TimedHTTPAdapter if self.metrics else HTTPAdapter
+        adapter = adapter_class(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        if self.resolver is not None:
+            self.resolver.install(adapter)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def make_request(self, url, *, max_bytes=None, stop=None, headers=None):
         """
         Making requests with retry logic and headers mocking real-world browser
 
         :param str url: Url to open
-        :return requests.Response: Response object
+        :param int max_bytes: Maximum size of the (decompressed) body. If supplied, the body is streamed and the rest
+                              of it is not downloaded.
+        :param callable stop: Function taking the body read so far (bytearray) and the offset of the last chunk in
+                              it. If supplied, the body is streamed and reading stops as soon as it returns True.
+        :param dict headers: Additional headers of the request, e.g. Range. Such requests bypass the cache.
+        :return requests.Response: Response object, its truncated attribute is True if the body was not read whole.
         """
-        headers = {
-            'cache-control': 'max-age=0',
-            'upgrade-insecure-requests': '1',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-                          '(KHTML, like Gecko) Chrome/73.0.3683.86 Safari/537.36',
-            'dnt': '1',
-            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,'
-                      'image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
-            'accept-encoding': 'gzip, deflate',
-            'accept-language': 'en,cs;q=0.9,sk;q=0.8,en-GB;q=0.7,en-US;q=0.6',
-        }
+        extra_headers = headers
+        headers = {**self.HEADERS, **(extra_headers or {})}
+        stream = max_bytes is not None or stop is not None
+        url = self._resolve_redirect(url)
+        if not self.is_resolvable(url):
+            raise UnresolvableHostError(f'Host of {url} does not exist.')
+
+        # fresh responses are served from the cache, stale ones are revalidated by the server
+        cached = self._cached(url) if not extra_headers else None
+        if cached is not None:
+            if cached.is_fresh:
+                return cached.to_response()
+            headers.update(cached.validators())
 
         # a basic logic for retries of failed requests
         for attempt in range(self.maximum_retries):
+            proxy = None
             try:
-                proxy_dict = None
-                if self.proxy_list:
-                    proxy_host = random.choice(self.proxy_list)
-                    proxy_dict = {'http': proxy_host, 'https': proxy_host}
+                self._sleep(url, self._reserve(url))
+                proxy = self._acquire_proxy(url)
                 if not self._disable_debug_print:
                     print(f'Attempt {attempt} for {url}.')
 
                 # request for the url
-                r = requests.get(url, headers=headers, timeout=self.timeout, verify=self.verify, proxies=proxy_dict)
-                return r
+                start_time, connect_start = time.perf_counter(), connect_seconds()
+                r = self.session.get(url, headers=headers, timeout=self.timeout, verify=self.verify,
+                                     proxies={'http': proxy, 'https': proxy} if proxy else None, stream=stream)
+                if stream:
+                    self._read_body(r, max_bytes, stop)
             except Exception as e:
-                # if the number of attempts is not reached, issue a warning, sleep and then continue
-                if attempt < self.maximum_retries - 1:
-                    time.sleep(10)
-                    warn(f'Encountered an exception: {type(e).__name__}: {e}')
+                self._record_attempt(url, type(e).__name__, attempt)
+                self._release_proxy(proxy)
+                # a dead proxy is not the fault of the host, the next attempt goes through another proxy right away
+                if isinstance(e, requests.exceptions.ProxyError) and self._retry_proxy(attempt):
                     continue
+                # if the number of attempts is not reached, issue a warning, sleep and then continue
+                self._sleep(url, self._wait_after_exception(url, e, attempt))
+                continue
+
+            # elapsed ends when the headers are parsed, the body is read after that
+            connect = connect_seconds() - connect_start
+            self._record_attempt(url, r.status_code, attempt, time.perf_counter() - start_time, connect,
+                                 r.elapsed.total_seconds() - connect, len(r.content))
+            # the proxy refused the request, the next attempt goes through another one right away
+            blocked = self._release_proxy(proxy, r, time.perf_counter() - start_time)
+            if blocked and self._retry_proxy(attempt):
+                continue
+
+            wait = self._wait_after_response(url, r, attempt)
+            if wait is not None:
+                self._sleep(url, wait)
+                continue
+
+            if cached is not None and r.status_code == 304:
+                self.cache.revalidated(cached)
+                return cached.to_response()
+            self._store(url, r, [(hop.url, hop.status_code) for hop in r.history])
+            return r
+
+    def _read_body(self, r, max_bytes=None, stop=None):
+        """
+        Reads the body of the streamed response chunk by chunk, decompressed on the fly, and closes the connection
+        as soon as the body is long enough, so the rest of it is not downloaded.
+
+        :param requests.Response r: Response requested with stream=True.
+        :param int max_bytes: Maximum size of the body.
+        :param callable stop: See make_request.
+        """
+        body, r.truncated = bytearray(), False
+        for chunk in r.iter_content(self.CHUNK_SIZE):
+            start = len(body)
+            body += chunk
+            if self._body_complete(body, start, max_bytes, stop):
+                r.truncated = True
+                r.close()
+                break
+        r._content = bytes(body)
+        r._content_consumed = True
+
+    @staticmethod
+    def _body_complete(body, start, max_bytes, stop):
+        """
+        :param bytearray body: Body read so far, cut to max_bytes in place.
+        :param int start: Offset of the last chunk in the body.
+        :return bool: True if the rest of the body should not be read.
+        """
+        if max_bytes is not None and len(body) >= max_bytes:
+            del body[max_bytes:]
+            return True
+        return stop is not None and stop(body, start)
+
+    def prefetch(self, urls):
+        """
+        Starts resolving the hostnames of the urls in the background, so the lookups are done before the requests.
+
+        :param urls: Iterable of urls.
+        """
+        if self._resolves_locally():
+            self.resolver.prefetch(urlsplit(url).hostname for url in urls if url)
+
+    def is_resolvable(self, url):
+        """
+        Waits for the lookup of the hostname of the url (see prefetch).
+
+        :param str url: Url to be requested.
+        :return bool: False if the hostname of the url does not exist, True if it goes through a proxy.
+        """
+        host = urlsplit(url).hostname
+        return not self._resolves_locally() or not host or self.resolver.is_resolvable(host)
+
+    def _resolves_locally(self):
+        """
+        :return bool: True if the hostnames are resolved by the DNS cache, the proxies resolve them by themselves.
+        """
+        return self.resolver is not None and not (self.proxy_pool or self.proxy_list)
+
+    def _resolve_redirect(self, url):
+        """
+        :param str url: Url to be requested.
+        :return str: Known target of the redirects of the url, the url itself if there is none.
+        """
+        if self.redirects is None:
+            return url
+        target = self.redirects.resolve(url)
+        if target != url and self.metrics:
+            self.metrics.record_redirect(url)
+        return target
+
+    def _store(self, url, r, hops):
+        """
+        Stores the response to the cache and its redirect chain to the redirect cache. The redirected response is
+        cached under its final url too, so the request for the final url is served from the cache.
+
+        :param str url: Requested url.
+        :param requests.Response r: Final response.
+        :param list hops: Url and status code of every redirect response.
+        """
+        # partial bodies must not be served to the requests for the whole page
+        if self.cache and not getattr(r, 'truncated', False) and r.status_code != 206:
+            self.cache.store(url, r)
+            if hops and r.url != url:
+                self.cache.store(r.url, r)
+        if hops and self.redirects is not None:
+            self.redirects.record(hops, r.url)
+
+    def _cached(self, url):
+        """
+        Looks the url up in the cache and records the result.
+
+        :param str url: Url to be requested.
+        :return CachedResponse: Cached response, None if there is none or caching is disabled.
+        """
+        if not self.cache:
+            return None
+        cached = self.cache.get(url)
+        if self.metrics:
+            self.metrics.record_cache(url, 'miss' if cached is None else 'hit' if cached.is_fresh else 'revalidated')
+        return cached
+
+    def _sleep(self, url, seconds):
+        """
+        Sleeps before the request and records the waited time.
+
+        :param str url: Url to be requested.
+        :param float seconds: Number of seconds to sleep.
+        """
+        time.sleep(seconds)
+        if self.metrics:
+            self.metrics.record_wait(url, seconds)
+
+    def _record_attempt(self, url, outcome, attempt, *args):
+        """
+        Passes the attempt to the metrics, see Metrics.record_attempt.
+        """
+        if self.metrics:
+            self.metrics.record_attempt(url, outcome, attempt, *args)
+
+    def _reserve(self, url):
+        """
+        Asks the scheduler for a slot for the request.
+
+        :param str url: Url to be requested.
+        :return float: Number of seconds to wait before sending the request.
+        """
+        return self.scheduler.reserve(url) if self.scheduler else 0.0
+
+    def _acquire_proxy(self, url):
+        """
+        :param str url: Url to be requested.
+        :return str: Url of the proxy for the attempt, None if no proxies are used.
+        :raises NoProxyAvailableError: If no proxy of the pool becomes available in time.
+        """
+        if self.proxy_pool:
+            return self.proxy_pool.acquire(url)
+        return random.choice(self.proxy_list) if self.proxy_list else None
+
+    def _release_proxy(self, proxy, r=None, seconds=None):
+        """
+        Returns the proxy to the pool and records the result of the attempt.
+
+        :param str proxy: Url of the proxy, None if the attempt went without it.
+        :param requests.Response r: Response of the attempt, None if the attempt raised an exception.
+        :param float seconds: Duration of the attempt.
+        :return bool: True if the proxy failed or refused the request, the status codes of the target (429 included)
+                      are left to _wait_after_response.
+        """
+        if proxy is None:
+            return False
+        failed = r is None or ProxyPool.is_proxy_failure(r.status_code, r.headers)
+        if self.proxy_pool:
+            self.proxy_pool.release(proxy, not failed, seconds)
+        if self.metrics:
+            self.metrics.record_proxy(proxy_label(proxy), 'ok' if not failed else 'failed' if r is None
+                                      else 'blocked')
+        return failed
+
+    def _retry_proxy(self, attempt):
+        """
+        :param int attempt: Number of the failed attempt, starting at 0.
+        :return bool: True if the attempt should be repeated through another proxy of the pool without waiting.
+        """
+        return self.proxy_pool is not None and attempt < self.maximum_retries - 1
+
+    def _wait_after_exception(self, url, e, attempt):
+        """
+        Records the failed attempt and decides how long to wait before the next one.
+
+        :param str url: Requested url.
+        :param Exception e: Exception raised by the attempt.
+        :param int attempt: Number of the attempt, starting at 0.
+        :return float: Number of seconds to wait.
+        :raises Exception: The original exception, if it is the last attempt or the host is suspended.
+        """
+        if isinstance(e, CircuitOpenError):
+            raise e
+        if isinstance(e, NoProxyAvailableError):
+            # the request was not sent, the host is not to blame
+            if self.scheduler:
+                self.scheduler.release(url)
+            raise e
+        if self.scheduler:
+            self.scheduler.record(url)
+        if attempt >= self.maximum_retries - 1:
+            raise e
+        warn(f'Encountered an exception: {type(e).__name__}: {e}')
+        return HostScheduler.backoff(attempt, self.backoff_base, self.backoff_cap)
+
+    def _wait_after_response(self, url, r, attempt):
+        """
+        Records the response and decides whether the request should be retried.
+
+        :param str url: Requested url.
+        :param requests.Response r: Received response.
+        :param int attempt: Number of the attempt, starting at 0.
+        :return float: Number of seconds to wait before the next attempt, None if the response should be returned.
+        """
+        retry_after = parse_retry_after(r.headers.get('retry-after'))
+        if self.scheduler:
+            self.scheduler.record(url, r.status_code, retry_after)
+        if r.status_code not in self.RETRY_STATUS_CODES:
+            return None
+        if attempt >= self.maximum_retries - 1:
+            warn(f'Giving up on {url} after {self.maximum_retries} attempts, last status code {r.status_code}.')
+            return None
+        return max(HostScheduler.backoff(attempt, self.backoff_base, self.backoff_cap), retry_after or 0.0)
+
+    async def make_request_async(self, session, url, *, max_bytes=None, stop=None, headers=None):
+        """
+        The same as make_request, but uses aiohttp session, so it can be awaited from the event loop.
+
+        :param aiohttp.ClientSession session: Session used for the request, it also defines the timeout.
+        :param str url: Url to open
+        :param int max_bytes: See make_request.
+        :param callable stop: See make_request.
+        :param dict headers: See make_request.
+        :return requests.Response: Response object
+        """
+        import asyncio
+        import aiohttp
+
+        extra_headers = headers
+        headers = {**self.HEADERS, **(extra_headers or {})}
+        url = self._resolve_redirect(url)
+        host = urlsplit(url).hostname
+        if self._resolves_locally() and host and not await self.resolver.is_resolvable_async(host):
+            raise UnresolvableHostError(f'Host of {url} does not exist.')
+
+        cached = self._cached(url) if not extra_headers else None
+        if cached is not None:
+            if cached.is_fresh:
+                return cached.to_response()
+            headers.update(cached.validators())
+
+        for attempt in range(self.maximum_retries):
+            proxy = None
+            try:
+                await self._sleep_async(url, self._reserve(url))
+                # aiohttp supports only a single (http) proxy per request
+                proxy = await self._acquire_proxy_async(url)
+                if not self._disable_debug_print:
+                    print(f'Attempt {attempt} for {url}.')
+
+                start_time = time.perf_counter()
+                async with session.get(url, headers=headers, proxy=proxy,
+                                       ssl=bool(self.verify)) as resp:
+                    # aiohttp does not tell the connect time, it is included in TTFB
+                    ttfb = time.perf_counter() - start_time
+                    r = requests.Response()
+                    r.url = str(resp.url)
+                    r.status_code = resp.status
+                    r.headers = CaseInsensitiveDict(resp.headers)
+                    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+                    r.truncated = False
+                    if max_bytes is None and stop is None:
+                        r._content = await resp.read()
+                    else:
+                        # the connection is closed on leaving the block if the body was not read whole
+                        body = bytearray()
+                        async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                            start = len(body)
+                            body += chunk
+                            if self._body_complete(body, start, max_bytes, stop):
+                                r.truncated = True
+                                break
+                        r._content = bytes(body)
+                    hops = [(str(hop.url), hop.status) for hop in resp.history]
+            except asyncio.CancelledError:
+                # the slots are returned, neither the proxy nor the host is to blame
+                if proxy and self.proxy_pool:
+                    self.proxy_pool.release(proxy, None)
+                if self.scheduler:
+                    self.scheduler.release(url)
                 raise
+            except Exception as e:
+                self._record_attempt(url, type(e).__name__, attempt)
+                self._release_proxy(proxy)
+                if isinstance(e, (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError)) and \
+                        self._retry_proxy(attempt):
+                    continue
+                await self._sleep_async(url, self._wait_after_exception(url, e, attempt))
+                continue
+
+            self._record_attempt(url, r.status_code, attempt, time.perf_counter() - start_time, None, ttfb,
+                                 len(r.content))
+            blocked = self._release_proxy(proxy, r, time.perf_counter() - start_time)
+            if blocked and self._retry_proxy(attempt):
+                continue
+            wait = self._wait_after_response(url, r, attempt)
+            if wait is not None:
+                await self._sleep_async(url, wait)
+                continue
+
+            if cached is not None and r.status_code == 304:
+                self.cache.revalidated(cached)
+                return cached.to_response()
+            self._store(url, r, hops)
+            return r
+
+    async def _acquire_proxy_async(self, url):
+        """
+        The same as _acquire_proxy, but does not block the event loop while all the proxies are busy.
+        """
+        import asyncio
+
+        if not self.proxy_pool:
+            return self._acquire_proxy(url)
+        deadline = time.monotonic() + self.proxy_pool.acquire_timeout
+        while True:
+            try:
+                return self.proxy_pool.acquire(url, timeout=0)
+            except NoProxyAvailableError:
+                if time.monotonic() >= deadline:
+                    raise
+            await asyncio.sleep(self.PROXY_POLL_INTERVAL)
+
+    async def _sleep_async(self, url, seconds):
+        """
+        The same as _sleep, but does not block the event loop.
+        """
+        import asyncio
+
+        await asyncio.sleep(seconds)
+        if self.metrics:
+            self.metrics.record_wait(url, seconds)
+
+    @staticmethod
+    def to_selector(r):
+        """
+        Returns selector object for the downloaded response. The body is parsed from bytes, so it is never decoded
+        to str.
+
+        :param requests.Response r: Response object
+        :return parsel.Selector: Selector object
+        """
+        return selector_from_bytes(r.content, r.headers.get('content-type'))
 
     def get_selector(self, url):
         """
@@ -75,4 +532,4 @@ class RequestHelper:
         :return parsel.Selector: Selector object
         """
         r = self.make_request(url=url)
-        return Selector(r.text)
+        return self.to_selector(r)
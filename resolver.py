@@ -0,0 +1,308 @@
+"""
+In-process DNS cache of RequestHelper. The eshop stage contacts a new domain for every eshop, so a large crawl
+resolves thousands of hostnames. The cache resolves them in a thread pool ahead of the requests (see prefetch),
+shares a lookup in progress between all its callers, keeps the addresses for their TTL and remembers the hostnames
+which do not exist (NXDOMAIN), so the requests to them fail at once instead of being retried.
+
+The TTLs of the records are known only if dnspython is installed, otherwise the addresses are kept for the default
+TTL. The system resolver (hosts file, search domains) is always used when dnspython has no answer.
+"""
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+
+class UnresolvableHostError(RequestsConnectionError):
+    """
+    Raised instead of sending the request to a hostname which does not exist.
+    """
+
+
+# errors of getaddrinfo meaning that the hostname does not exist (or has no address), they are cached
+NEGATIVE_ERRORS = {socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)}
+
+
+class _Entry:
+    """
+    Addresses of a hostname, or the error of its lookup, until they expire.
+    """
+
+    __slots__ = ('addresses', 'error', 'expires')
+
+    def __init__(self, addresses, error, expires):
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+
+
+class DNSCache:
+    """
+    Thread-safe DNS cache with negative caching and concurrent prefetch, shared by all threads (and the asyncio
+    backend) of one RequestHelper.
+    """
+
+    def __init__(self, *, ttl=300.0, min_ttl=30.0, max_ttl=3600.0, negative_ttl=600.0, timeout=5.0, max_workers=32,
+                 metrics=None):
+        """
+        __init__ method for the class.
+
+        :param float ttl: Number of seconds the addresses are kept if their TTL is not known.
+        :param float min_ttl: Lower bound of the TTL of the records, very short TTLs would defeat the cache.
+        :param float max_ttl: Upper bound of the TTL of the records.
+        :param float negative_ttl: Number of seconds a hostname which does not exist is remembered.
+        :param float timeout: Maximum number of seconds the request waits for the lookup of its hostname.
+        :param int max_workers: Number of threads resolving the hostnames.
+        :param Metrics metrics: Registry recording the lookups, None disables it.
+        """
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.metrics = metrics
+
+        self._entries = {}
+        # hostname -> Future of the lookup in progress
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='dns')
+        self._dns_resolver = dns.resolver.Resolver() if dns is not None else None
+
+    @staticmethod
+    def _normalize(host):
+        return host.rstrip('.').lower()
+
+    @staticmethod
+    def _is_ip(host):
+        try:
+            ipaddress.ip_address(host.strip('[]'))
+        except ValueError:
+            return False
+        return True
+
+    def lookup(self, host):
+        """
+        Starts the lookup of the hostname unless it is cached or in progress already.
+
+        :param str host: Hostname.
+        :return concurrent.futures.Future: Future of the list of the addresses, its exception is socket.gaierror if
+                                           the lookup failed.
+        """
+        future = Future()
+        if self._is_ip(host):
+            future.set_result([host.strip('[]')])
+            return future
+        host = self._normalize(host)
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None and entry.expires > time.monotonic():
+                self._record('negative_hit' if entry.error else 'hit')
+                if entry.error:
+                    future.set_exception(entry.error)
+                else:
+                    future.set_result(entry.addresses)
+                return future
+            if host not in self._pending:
+                self._pending[host] = self._executor.submit(self._resolve_and_store, host)
+            return self._pending[host]
+
+    def resolve(self, host):
+        """
+        :param str host: Hostname.
+        :return list: Addresses of the hostname.
+        :raises socket.gaierror: If the hostname cannot be resolved (in time).
+        """
+        try:
+            return self.lookup(host).result(self.timeout)
+        except FutureTimeoutError:
+            raise socket.gaierror(socket.EAI_AGAIN, f'Resolving {host} timed out') from None
+
+    def prefetch(self, hosts):
+        """
+        Starts the lookups of the hostnames in the background and returns at once.
+
+        :param hosts: Iterable of hostnames, None items are skipped.
+        :return int: Number of the distinct hostnames.
+        """
+        distinct = {host for host in hosts if host}
+        for host in distinct:
+            self.lookup(host)
+        return len(distinct)
+
+    def is_resolvable(self, host):
+        """
+        Waits for the lookup of the hostname.
+
+        :param str host: Hostname.
+        :return bool: False if the hostname does not exist, True otherwise (even if the lookup timed out).
+        """
+        try:
+            self.resolve(host)
+        except socket.gaierror as e:
+            return not self.is_negative(e)
+        return True
+
+    @staticmethod
+    def is_negative(e):
+        """
+        :param socket.gaierror e: Error of the lookup.
+        :return bool: True if the error means that the hostname does not exist.
+        """
+        return e.errno in NEGATIVE_ERRORS
+
+    def _resolve_and_store(self, host):
+        """
+        Resolves the hostname in the thread pool and stores the result.
+        """
+        start_time = time.perf_counter()
+        addresses, error, ttl = None, None, 0.0
+        try:
+            addresses, ttl = self._query(host)
+            result = 'resolved'
+        except (OSError, UnicodeError) as e:
+            # e.g. a label of the hostname longer than 63 characters
+            error = e if isinstance(e, socket.gaierror) else socket.gaierror(socket.EAI_FAIL, str(e))
+            result = 'nxdomain' if self.is_negative(error) else 'error'
+            # temporary failures are not cached, the next request tries again
+            ttl = self.negative_ttl if self.is_negative(error) else 0.0
+        with self._lock:
+            if ttl > 0:
+                self._entries[host] = _Entry(addresses, error, time.monotonic() + ttl)
+            del self._pending[host]
+            self._record(result, time.perf_counter() - start_time)
+        if error is not None:
+            raise error
+        return addresses
+
+    def _query(self, host):
+        """
+        :param str host: Normalized hostname.
+        :return tuple: Addresses of the hostname and their TTL.
+        :raises socket.gaierror: If the hostname cannot be resolved.
+        """
+        if self._dns_resolver is not None:
+            try:
+                answer = self._dns_resolver.resolve(host, 'A', lifetime=self.timeout)
+                return [record.address for record in answer], min(self.max_ttl, max(self.min_ttl, answer.rrset.ttl))
+            except dns.exception.DNSException:
+                # no A record (IPv6 only), the hosts file, the search domains, ... are left to the system resolver
+                pass
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos)), self.ttl
+
+    def _record(self, result, seconds=None):
+        if self.metrics:
+            self.metrics.record_dns(result, seconds)
+
+    def install(self, adapter):
+        """
+        Makes the connections of the requests adapter resolve their hosts by the cache.
+
+        :param requests.adapters.HTTPAdapter adapter: Adapter mounted to the session.
+        """
+        manager = adapter.poolmanager
+        manager.pool_classes_by_scheme = {
+            scheme: type(pool_class.__name__, (pool_class,), {'ConnectionCls': type(
+                pool_class.ConnectionCls.__name__, (_ResolvingConnectionMixin, pool_class.ConnectionCls),
+                {'resolver': self})})
+            for scheme, pool_class in manager.pool_classes_by_scheme.items()}
+
+    async def resolve_async(self, host, port=0, family=socket.AF_INET):
+        """
+        Resolver of aiohttp.TCPConnector, see aiohttp.abc.AbstractResolver.
+
+        :return list: Address dictionaries of aiohttp.
+        """
+        import asyncio
+
+        future = asyncio.wrap_future(self.lookup(host))
+        try:
+            # the lookup is shared with other requests, it must not be cancelled by the timeout of this one
+            addresses = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.gaierror(socket.EAI_AGAIN, f'Resolving {host} timed out') from None
+        results = []
+        for address in addresses:
+            address_family = socket.AF_INET6 if ':' in address else socket.AF_INET
+            if family in (socket.AF_UNSPEC, address_family):
+                results.append({'hostname': host, 'host': address, 'port': port, 'family': address_family,
+                                'proto': 0, 'flags': socket.AI_NUMERICHOST})
+        if not results:
+            raise socket.gaierror(socket.EAI_NONAME, f'No address of {host} in the requested family')
+        return results
+
+    async def is_resolvable_async(self, host):
+        """
+        The same as is_resolvable, but does not block the event loop.
+        """
+        try:
+            await self.resolve_async(host, family=socket.AF_UNSPEC)
+        except socket.gaierror as e:
+            return not self.is_negative(e)
+        return True
+
+    def aiohttp_resolver(self):
+        """
+        :return: Object passed as the resolver of aiohttp.TCPConnector.
+        """
+        return _AiohttpResolver(self)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _AiohttpResolver:
+    """
+    Resolver of aiohttp.TCPConnector backed by the DNSCache, the cache outlives the connector.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return await self._cache.resolve_async(host, port, family)
+
+    async def close(self):
+        pass
+
+
+class _ResolvingConnectionMixin:
+    """
+    Connects urllib3 connection to the address from the DNSCache instead of calling getaddrinfo.
+    """
+
+    # DNSCache set by DNSCache.install
+    resolver = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = self.resolver.resolve(host)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        # TLS (SNI, certificate) keeps using the hostname, only the connected address changes; the addresses are
+        # tried in turn like getaddrinfo results are, the error of the last one is raised
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (ConnectTimeoutError, NewConnectionError):
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from req import RequestHelper
+from base import BaseDownload
+from heureka import Heureka
+from parsing import Extractor
+
+
+class Reviews(BaseDownload):
+    """
+    Downloads the text reviews of the eshops from their Heureka review pages (the 'inner_link' of Heureka output).
+    The review pages of all eshops are downloaded concurrently and the reviews are written to the disk in chunks,
+    so the memory use does not grow with the number of reviews.
+    """
+
+    STAGE = 'reviews'
+
+    _REVIEWS = Extractor(css='li.c-post')
+    _REVIEW_RATING = Extractor('.//div[@class="c-post__rating"]/text()')
+    _REVIEW_TEXT = Extractor('.//p[@class="c-post__summary"]//text()')
+    _REVIEW_PROS = Extractor('.//ul[contains(@class, "c-attributes-list--positive")]/li//text()')
+    _REVIEW_CONS = Extractor('.//ul[contains(@class, "c-attributes-list--negative")]/li//text()')
+    _REVIEW_DATE = Extractor('.//time/@datetime')
+    _TOTAL_COUNT = Extractor('//*[@id="filtr"]/div/nav/ul/li[1]/a/@data-count')
+    _NEXT_PAGE = Extractor('//nav[contains(@class, "c-pagination")]//a[@rel="next"]/@href')
+
+    def __init__(self, req=None, *, max_reviews_per_shop=100, concurrent_threads_count=10, path='reviews.jsonl',
+                 chunk_size=1000, store=None):
+        """
+        __init__ method for the class.
+
+        :param RequestHelper req: Request helper objects, if not supplied, instantiated automatically.
+        :param int max_reviews_per_shop: Maximum number of reviews downloaded for a single eshop, None for all.
+        :param int concurrent_threads_count: Number of threads downloading the review pages. The rate is limited by
+                                             the scheduler of the RequestHelper.
+        :param str path: Path to the JSON lines file the reviews are appended to, if store is not supplied. The reviews
+                         of the downloaded eshops written there by a previous run are replaced.
+        :param int chunk_size: Number of reviews written to the file at once.
+        :param ResultStore store: If supplied, the reviews are written to its 'reviews' stage instead of the file.
+        """
+
+        self.r = req or RequestHelper()
+        if not isinstance(self.r, RequestHelper):
+            raise NotImplementedError('Only RequestHelper instance can be passed in req argument, otherwise'
+                                      'leave it to its default value.')
+
+        self.max_reviews_per_shop = max_reviews_per_shop
+        self._concurrent_threads_count = concurrent_threads_count
+        self.path = path
+        self._chunk_size = chunk_size
+        self._set_store(store)
+
+        self._lock = threading.Lock()
+        self._chunk = []
+
+        # number of downloaded reviews per eshop, the reviews themselves are on the disk
+        self.output = []
+
+    def _download_review_page(self, inner_link, page_url, limit=None):
+        """
+        Downloads and parses a single review page and writes its reviews.
+
+        :param str inner_link: Link to the Heureka page of the eshop.
+        :param str page_url: Url of the review page.
+        :param int limit: Maximum number of reviews taken from the page, all if None.
+        :return dict: Number of written reviews in 'count', number of reviews on the page in 'per_page', total number
+                      of reviews of the eshop in 'total' and link to the next page in 'next_link'.
+        """
+        with self._unit():
+            sel = self.r.get_selector(page_url)
+            reviews = self._parse_reviews(sel, inner_link)
+            total = self._TOTAL_COUNT.get(sel)
+            next_link = self._NEXT_PAGE.get(sel)
+        written = reviews[:limit] if limit is not None else reviews
+        self._emit(written)
+        return {'count': len(written),
+                'per_page': len(reviews),
+                'total': int(re.sub(r'&nbsp;|\s+', '', total)) if total else len(reviews),
+                'next_link': urljoin(page_url, next_link) if next_link else None}
+
+    @staticmethod
+    def _parse_reviews(sel, inner_link):
+        """
+        Parses the reviews from the review page.
+
+        :param parsel.Selector sel: Input selector object.
+        :param str inner_link: Link to the Heureka page of the eshop, stored with every review.
+        :return list: Reviews with rating, text, pros, cons and date.
+        """
+        output = []
+        for review in Reviews._REVIEWS.getall(sel):
+            rating = Reviews._REVIEW_RATING.get(review)
+            output.append({
+                'inner_link': inner_link,
+                'rating': float(rating.replace(',', '.')) if rating else None,
+                'text': ' '.join(t.strip() for t in Reviews._REVIEW_TEXT.getall(review) if t.strip()),
+                'pros': [t.strip() for t in Reviews._REVIEW_PROS.getall(review) if t.strip()],
+                'cons': [t.strip() for t in Reviews._REVIEW_CONS.getall(review) if t.strip()],
+                'date': Reviews._REVIEW_DATE.get(review),
+            })
+        return output
+
+    def _emit(self, records):
+        """
+        Writes the reviews to the ResultStore, or appends them to the chunk of the file.
+
+        :param list records: Reviews.
+        """
+        if self.store is not None:
+            self.store.extend(self.STAGE, records)
+            return
+        with self._lock:
+            self._chunk.extend(records)
+            if len(self._chunk) >= self._chunk_size:
+                self._write_chunk()
+
+    def _write_chunk(self):
+        """
+        Appends the chunk to the file. Must be called with the lock held.
+        """
+        if not self._chunk:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(review, ensure_ascii=False) + '\n' for review in self._chunk)
+        self._chunk.clear()
+
+    def _remove_reviews(self, inner_links):
+        """
+        Removes the reviews of the eshops from the file written by a previous run, so the run replaces them instead of
+        appending them again. The reviews of the other eshops are kept.
+
+        :param inner_links: Collection of the links to the Heureka pages of the eshops.
+        """
+        if self.store is not None or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f, open(self.path + '.tmp', 'w', encoding='utf-8') as kept:
+            for line in f:
+                try:
+                    if json.loads(line)['inner_link'] in inner_links:
+                        continue
+                except ValueError:
+                    # incomplete last line of a crashed run
+                    continue
+                kept.write(line)
+        os.replace(self.path + '.tmp', self.path)
+
+    def _other_pages(self, first_page):
+        """
+        :param dict first_page: Result of the first review page.
+        :return list: Number and review limit of every other page needed, with respect to max_reviews_per_shop.
+        """
+        per_page = first_page['per_page']
+        wanted = first_page['total']
+        if self.max_reviews_per_shop is not None:
+            wanted = min(wanted, self.max_reviews_per_shop)
+        if not per_page or wanted <= per_page:
+            return []
+        return [(page, min(per_page, wanted - (page - 1) * per_page))
+                for page in range(2, math.ceil(wanted / per_page) + 1)]
+
+    def run(self, inner_links):
+        """
+        Triggers the download. First review pages of all eshops are requested at once and the other pages are
+        requested as soon as the first page tells how many of them are needed. Number of reviews per eshop is
+        stored in the output attribute, the reviews in the file (or in the ResultStore if supplied).
+
+        :param list inner_links: Links to the Heureka pages of the eshops ('inner_link' of Heureka output).
+        """
+        from tqdm import tqdm
+
+        start_time = time.time()
+        print(f' - getting Heureka reviews in {self._concurrent_threads_count} threads:')
+
+        counts = {inner_link: 0 for inner_link in inner_links}
+        self._remove_reviews(counts.keys())
+        with ThreadPoolExecutor(self._concurrent_threads_count) as executor, tqdm(total=len(counts)) as progress:
+            first_pages = {executor.submit(self._download_review_page, inner_link, inner_link,
+                                           self.max_reviews_per_shop): inner_link
+                           for inner_link in counts}
+            other_pages = {}
+            for future in as_completed(first_pages):
+                inner_link, first_page = first_pages[future], future.result()
+                counts[inner_link] += first_page['count']
+                # urls of the other pages are derived from the second one, as for the listing pages
+                page_url = Heureka._listing_page_url_builder(first_page['next_link'])
+                if page_url is not None:
+                    for page, limit in self._other_pages(first_page):
+                        future = executor.submit(self._download_review_page, inner_link, page_url(page), limit)
+                        other_pages[future] = inner_link
+                progress.update()
+
+            for future in as_completed(other_pages):
+                counts[other_pages[future]] += future.result()['count']
+
+        with self._lock:
+            self._write_chunk()
+        self.output.extend({'inner_link': inner_link, 'reviews_downloaded': count}
+                           for inner_link, count in counts.items())
+
+        self._record_run(time.time() - start_time)
+        print(f'Reviews from Heureka finished in {round(time.time() - start_time, 3)}s.')
@@ -0,0 +1,328 @@
+"""
+Sharded crawl: a coordinator splits Heureka categories into work units (ranges of listing pages) and puts them
+to a work queue stored in a SQLite file. Any number of worker processes, on this machine or on other machines
+sharing the directory, pull the units, run the Heureka -> eshop -> Instagram stages for them and write partial
+outputs, which are merged and deduplicated at the end.
+
+Usage from the repository root::
+
+    python -m shard plan --queue crawl/queue.sqlite --category elektronika --category hobby --count 2000
+    python -m shard run --queue crawl/queue.sqlite --output crawl/parts --processes 8
+    python -m shard merge --output crawl/parts --to results.csv
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import traceback
+
+from heureka import Heureka
+from eshop_web import EshopWebsite
+from instagram import Instagram
+from req import RequestHelper
+
+
+class WorkQueue:
+    """
+    Work queue stored in SQLite file, no broker is needed. A claimed unit is leased to the worker; if the worker dies,
+    the lease expires and another worker takes the unit over.
+    """
+
+    def __init__(self, path, *, lease_seconds=3600, max_attempts=3):
+        """
+        __init__ method for the class.
+
+        :param str path: Path to the SQLite file, it is created if it does not exist.
+        :param float lease_seconds: Number of seconds after which a claimed but unfinished unit is given to another
+                                    worker.
+        :param int max_attempts: Number of attempts after which the failing unit is not claimed anymore.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # autocommit mode, the transactions are started explicitly
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS units_status ON units(status);
+        """)
+
+    def put(self, payloads):
+        """
+        Adds the work units to the queue.
+
+        :param list payloads: JSON serializable descriptions of the units.
+        """
+        with self._connection:
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._connection.executemany('INSERT INTO units (payload) VALUES (?)',
+                                         [(json.dumps(payload),) for payload in payloads])
+
+    def claim(self, worker):
+        """
+        Claims the next unit for the worker.
+
+        :param str worker: Identifier of the worker.
+        :return tuple: Id, payload and the attempt number of the unit, None if there is nothing to do.
+        """
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock, so no other worker can claim the same unit
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            # the worker of the last attempt died, the unit is not retried anymore
+            self._connection.execute(
+                "UPDATE units SET status = 'failed', error = COALESCE(error, 'Lease expired.') "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts))
+            row = self._connection.execute(
+                "SELECT id, payload, attempts FROM units WHERE attempts < ? AND "
+                "(status = 'pending' OR (status = 'running' AND lease_until < ?)) ORDER BY id LIMIT 1",
+                (self.max_attempts, now)).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE units SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE id = ?", (worker, now + self.lease_seconds, row[0]))
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        return (row[0], json.loads(row[1]), row[2] + 1) if row is not None else None
+
+    def complete(self, unit_id, worker, attempt):
+        """
+        :param int unit_id: Id of the finished unit.
+        :param str worker: Identifier of the worker which claimed the unit.
+        :param int attempt: Attempt number returned by claim.
+        :return bool: False if the lease expired and the unit was taken over by another attempt in the meantime.
+        """
+        return self._connection.execute(
+            "UPDATE units SET status = 'done', error = NULL WHERE id = ? AND status = 'running' AND worker = ? "
+            "AND attempts = ?", (unit_id, worker, attempt)).rowcount > 0
+
+    def fail(self, unit_id, worker, attempt, error):
+        """
+        Returns the unit to the queue, so it can be retried (up to max_attempts).
+
+        :param int unit_id: Id of the failed unit.
+        :param str worker: Identifier of the worker which claimed the unit.
+        :param int attempt: Attempt number returned by claim.
+        :param str error: Description of the error.
+        :return bool: False if the lease expired and the unit was taken over by another attempt in the meantime.
+        """
+        return self._connection.execute(
+            "UPDATE units SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+            (self.max_attempts, error, unit_id, worker, attempt)).rowcount > 0
+
+    def counts(self):
+        """
+        :return dict: Number of units in each status.
+        """
+        return dict(self._connection.execute('SELECT status, COUNT(*) FROM units GROUP BY status').fetchall())
+
+    def close(self):
+        self._connection.close()
+
+
+def plan(queue, categories, count_of_eshops, *, pages_per_unit=5, req=None):
+    """
+    Splits the categories into work units and puts them to the queue. The first listing page of every category is
+    downloaded to find out how the urls of the other listing pages look like.
+
+    :param WorkQueue queue: Queue for the units.
+    :param list categories: Heureka categories or urls of their listing pages, None stands for all eshops.
+    :param int count_of_eshops: Number of eshops to crawl in every category.
+    :param int pages_per_unit: Number of listing pages in one unit.
+    :param RequestHelper req: a Request helper class to be passed
+    :return int: Number of units put to the queue.
+    """
+    units = []
+    for category in categories:
+        h = Heureka(req=req, category=category)
+        first_page = h._download_listing(h.start_url)
+        page_url = h._listing_page_url_builder(first_page['next_link'])
+        pages_needed = math.ceil(count_of_eshops / Heureka.ESHOPS_PER_PAGE) if page_url else 1
+
+        # every page is described by its url and the number of eshops taken from it
+        pages = [[h.start_url if page == 1 else page_url(page),
+                  min(Heureka.ESHOPS_PER_PAGE, count_of_eshops - (page - 1) * Heureka.ESHOPS_PER_PAGE)]
+                 for page in range(1, pages_needed + 1)]
+        units.extend({'category': category, 'pages': pages[i:i + pages_per_unit]}
+                     for i in range(0, len(pages), pages_per_unit))
+    queue.put(units)
+    return len(units)
+
+
+def process_unit(unit, req=None):
+    """
+    Runs all stages for a single unit.
+
+    :param dict unit: Description of the unit created by plan.
+    :param RequestHelper req: a Request helper class to be passed
+    :return list: Dictionaries with the same fields as the rows of download_all.
+    """
+    h = Heureka(req=req, category=unit['category'])
+    e = EshopWebsite(req=req)
+    i = Instagram(req=req)
+
+    eshops = [eshop for page_url, limit in unit['pages'] for eshop in h._download_listing(page_url)['eshops'][:limit]]
+    for eshop in eshops:
+        eshop['category'] = unit['category']
+        h._download_eshop_detail(eshop)
+
+    e.run(sorted({eshop['link'] for eshop in eshops}))
+    websites = {website['url']: website for website in e.output}
+
+    i.run(sorted({website['instagram'] for website in e.output if website['instagram']}))
+    accounts = {account.pop('account'): account for account in i.output}
+
+    for eshop in eshops:
+        website = websites[eshop['link']]
+        eshop['url'] = website['url']
+        eshop['instagram'] = website['instagram']
+        eshop.update(accounts.get(website['instagram'], {}))
+    return eshops
+
+
+def run_worker(queue_path, output_dir, *, worker=None, req_kwargs=None):
+    """
+    Pulls the units from the queue until it is empty and writes the result of every unit to its own file in
+    the output_dir.
+
+    :param str queue_path: Path to the SQLite file of the queue.
+    :param str output_dir: Directory for the partial outputs.
+    :param str worker: Identifier of the worker, host name and process id by default.
+    :param dict req_kwargs: Keyword arguments for the RequestHelper of the worker.
+    :return int: Number of processed units.
+    """
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    os.makedirs(output_dir, exist_ok=True)
+    queue = WorkQueue(queue_path)
+    req = RequestHelper(**(req_kwargs or {'disable_debug_print': True}))
+
+    processed = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            break
+        unit_id, unit, attempt = claimed
+        try:
+            records = process_unit(unit, req=req)
+        except Exception:
+            queue.fail(unit_id, worker, attempt, traceback.format_exc())
+            continue
+
+        # written to a temporary file first, so a crashed worker never leaves half of the output behind
+        path = os.path.join(output_dir, f'part-{unit_id:06d}.jsonl')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(path + '.tmp', path)
+        if queue.complete(unit_id, worker, attempt):
+            processed += 1
+
+    queue.close()
+    return processed
+
+
+def run_local(queue_path, output_dir, processes=None, req_kwargs=None):
+    """
+    Runs the workers in the given number of processes on this machine.
+
+    :param str queue_path: Path to the SQLite file of the queue.
+    :param str output_dir: Directory for the partial outputs.
+    :param int processes: Number of worker processes, number of cores by default.
+    :param dict req_kwargs: Keyword arguments for the RequestHelper of the workers.
+    :return int: Number of processed units.
+    """
+    processes = processes or os.cpu_count()
+    with multiprocessing.Pool(processes) as pool:
+        results = [pool.apply_async(run_worker, (queue_path, output_dir), {'req_kwargs': req_kwargs})
+                   for _ in range(processes)]
+        return sum(result.get() for result in results)
+
+
+def merge_outputs(output_dir):
+    """
+    Merges the partial outputs, every eshop is kept only once.
+
+    :param str output_dir: Directory with the partial outputs.
+    :return list: Dictionaries with the same fields as the rows of download_all.
+    """
+    records = {}
+    for name in sorted(os.listdir(output_dir)):
+        if not (name.startswith('part-') and name.endswith('.jsonl')):
+            continue
+        with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                records.setdefault(record['inner_link'], record)
+    return list(records.values())
+
+
+def load_results(output_dir):
+    """
+    Merges the partial outputs into the DataFrame indexed by the eshop link, as download_all does.
+
+    :param str output_dir: Directory with the partial outputs.
+    :return pandas.DataFrame: Data frame with all the data
+    """
+    # pandas is needed only for the final merge, the workers do not import it
+    import pandas as pd
+
+    return pd.DataFrame(merge_outputs(output_dir)).set_index('link')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help='Split the categories into units and put them to the queue.')
+    plan_parser.add_argument('--queue', required=True, help='Path to the SQLite file of the queue.')
+    plan_parser.add_argument('--category', action='append',
+                             help='Heureka category, can be repeated. All eshops if not supplied.')
+    plan_parser.add_argument('--count', type=int, default=100, help='Number of eshops in every category.')
+    plan_parser.add_argument('--pages-per-unit', type=int, default=5, help='Number of listing pages in one unit.')
+
+    for name, help_text in (('worker', 'Run a single worker.'), ('run', 'Run workers in several processes.')):
+        worker_parser = commands.add_parser(name, help=help_text)
+        worker_parser.add_argument('--queue', required=True, help='Path to the SQLite file of the queue.')
+        worker_parser.add_argument('--output', required=True, help='Directory for the partial outputs.')
+        if name == 'run':
+            worker_parser.add_argument('--processes', type=int, help='Number of processes, number of cores by default.')
+
+    merge_parser = commands.add_parser('merge', help='Merge the partial outputs to a CSV file.')
+    merge_parser.add_argument('--output', required=True, help='Directory with the partial outputs.')
+    merge_parser.add_argument('--to', required=True, help='Path to the CSV file.')
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        queue = WorkQueue(args.queue)
+        count = plan(queue, args.category or [None], args.count, pages_per_unit=args.pages_per_unit,
+                     req=RequestHelper(disable_debug_print=True))
+        print(f'{count} units planned, queue: {queue.counts()}')
+    elif args.command == 'worker':
+        print(f'{run_worker(args.queue, args.output)} units processed.')
+    elif args.command == 'run':
+        print(f'{run_local(args.queue, args.output, args.processes)} units processed.')
+    else:
+        load_results(args.output).to_csv(args.to)
+
+
+if __name__ == '__main__':
+    main()
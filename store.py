@@ -0,0 +1,257 @@
+import glob
+import json
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# repeated strings (categories, instagram accounts) are dictionary encoded
+_CATEGORICAL = pa.dictionary(pa.int32(), pa.string())
+
+# typed columns of the stages, keys not listed here are not stored
+SCHEMAS = {
+    'heureka': pa.schema([
+        ('link', pa.string()),
+        ('inner_link', pa.string()),
+        ('name', pa.string()),
+        ('category', _CATEGORICAL),
+        ('reviews', pa.int64()),
+        ('rating', pa.float64()),
+        ('reviews_negative_count', pa.int64()),
+        ('reviews_positive_count', pa.int64()),
+    ]),
+    'eshop': pa.schema([
+        ('url', pa.string()),
+        ('instagram', _CATEGORICAL),
+    ]),
+    'instagram': pa.schema([
+        ('account', _CATEGORICAL),
+        ('instagram_followers', pa.int64()),
+        ('instagram_posts_count', pa.int64()),
+        ('instagram_posts_analyzed', pa.int64()),
+        ('instagram_posts_average_like', pa.float64()),
+        ('instagram_posts_like_std', pa.float64()),
+        ('instagram_posts_like_median', pa.float64()),
+        ('instagram_posts_like_p90', pa.float64()),
+        ('instagram_posts_average_comments', pa.float64()),
+        ('instagram_posts_comments_std', pa.float64()),
+        ('instagram_posts_comments_median', pa.float64()),
+        ('instagram_posts_comments_p90', pa.float64()),
+        ('instagram_classified_descriptions', pa.string()),
+        ('instagram_full_json_path', pa.string()),
+        # full json kept inline is stored serialized, offloading it by Instagram(full_json_dir=...) is preferred
+        ('instagram_full_json', pa.large_string()),
+    ]),
+    'reviews': pa.schema([
+        ('inner_link', _CATEGORICAL),
+        ('rating', pa.float64()),
+        ('text', pa.string()),
+        ('pros', pa.list_(pa.string())),
+        ('cons', pa.list_(pa.string())),
+        ('date', pa.string()),
+    ]),
+}
+
+# stages joined by merge, the reviews are written on their own by download_reviews
+DATASET_STAGES = ('heureka', 'eshop', 'instagram')
+
+
+class ResultStore:
+    """
+    Stores the outputs of the stages to Parquet files in the directory, one subdirectory per stage. Records are
+    buffered and written in batches (one row group per batch), so a stage never needs to keep all its records in
+    memory. The stages are joined by merge into a single Parquet file, which is loaded by the load function.
+    """
+
+    def __init__(self, directory, *, batch_size=1000, stages=None):
+        """
+        __init__ method for the class.
+
+        :param str directory: Directory for the Parquet files, it is created if it does not exist. Stage files
+                              left there by the previous store are replaced.
+        :param int batch_size: Number of records buffered before they are written as a row group.
+        :param tuple stages: Stages written by this store, all of SCHEMAS if None. Files of the other stages are kept,
+                             an empty tuple only reads the directory.
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        self.stages = tuple(SCHEMAS if stages is None else stages)
+        for stage in self.stages:
+            os.makedirs(os.path.join(directory, stage), exist_ok=True)
+            for part in self._parts(stage):
+                os.remove(part)
+
+        self._lock = threading.Lock()
+        self._buffers = {stage: [] for stage in self.stages}
+        self._writers = {}
+        self._written_parts = {stage: 0 for stage in self.stages}
+
+    @property
+    def results_path(self):
+        """
+        :return str: Path to the merged Parquet file.
+        """
+        return os.path.join(self.directory, 'results.parquet')
+
+    def _parts(self, stage):
+        """
+        :param str stage: Name of the stage, one of SCHEMAS.
+        :return list: Paths to the Parquet files of the stage in the order they were written.
+        """
+        return sorted(glob.glob(os.path.join(self.directory, stage, 'part-*.parquet')))
+
+    def append(self, stage, record):
+        """
+        Appends a single record of the stage.
+
+        :param str stage: Name of the stage, one of SCHEMAS.
+        :param dict record: Record produced by the stage, keys not in the schema are ignored.
+        """
+        self.extend(stage, [record])
+
+    def extend(self, stage, records):
+        """
+        Appends the records of the stage.
+
+        :param str stage: Name of the stage, one of SCHEMAS.
+        :param records: Iterable of records produced by the stage.
+        """
+        for record in records:
+            with self._lock:
+                self._buffers[stage].append(record)
+                if len(self._buffers[stage]) >= self.batch_size:
+                    self._write(stage)
+
+    def _write(self, stage):
+        """
+        Writes the buffered records of the stage as a row group. Must be called with the lock held.
+        """
+        buffer = self._buffers[stage]
+        if not buffer:
+            return
+        schema = SCHEMAS[stage]
+        columns = []
+        for field in schema:
+            values = [record.get(field.name) for record in buffer]
+            if field.name == 'instagram_full_json':
+                values = [json.dumps(value, ensure_ascii=False) if value is not None else None for value in values]
+            columns.append(pa.array(values, type=field.type))
+
+        if stage not in self._writers:
+            # a new part is started after every flush, the flushed parts are complete files
+            path = os.path.join(self.directory, stage, f'part-{self._written_parts[stage]:05d}.parquet')
+            self._written_parts[stage] += 1
+            self._writers[stage] = pq.ParquetWriter(path, schema)
+        self._writers[stage].write_table(pa.Table.from_arrays(columns, schema=schema))
+        buffer.clear()
+
+    def column(self, stage, name):
+        """
+        Reads a single column of the stage, the buffered records are written first.
+
+        :param str stage: Name of the stage, one of SCHEMAS.
+        :param str name: Name of the column.
+        :return list: Values of the column.
+        """
+        self.flush()
+        return self._read(stage, columns=[name]).column(name).to_pylist()
+
+    def flush(self):
+        """
+        Writes all buffered records and closes the files, so they can be read. Next records start new files.
+        """
+        with self._lock:
+            for stage in self.stages:
+                self._write(stage)
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+    def merge(self, batch_size=10000):
+        """
+        Joins the stages into the single file, the same way as download_all joins its DataFrames: every Heureka
+        record gets the eshop and Instagram columns if its eshop has an Instagram account. Heureka records are
+        streamed in batches, only the key indexes and the (much smaller) eshop and Instagram tables are in memory.
+
+        :param int batch_size: Number of Heureka records joined at once.
+        :return str: Path to the merged Parquet file.
+        """
+        self.flush()
+        eshops = self._read('eshop')
+        accounts = self._read('instagram')
+
+        # first occurrence of every key wins
+        eshop_index = _index(eshops.column('url').to_pylist())
+        account_index = _index(accounts.column('account').to_pylist())
+        instagram_of_eshop = eshops.column('instagram').to_pylist()
+        account_columns = [name for name in accounts.column_names if name != 'account']
+
+        schema = pa.schema(list(SCHEMAS['heureka']) + list(SCHEMAS['eshop'])
+                           + [accounts.schema.field(name) for name in account_columns])
+        batches = (batch for part in self._parts('heureka')
+                   for batch in pq.ParquetFile(part, memory_map=True).iter_batches(batch_size))
+        with pq.ParquetWriter(self.results_path, schema) as writer:
+            for batch in batches:
+                eshop_rows, account_rows = [], []
+                for link in batch.column('link').to_pylist():
+                    eshop_row = eshop_index.get(link)
+                    account_row = account_index.get(instagram_of_eshop[eshop_row]) if eshop_row is not None else None
+                    # eshops without Instagram data are left out of the joined columns, as in download_all
+                    eshop_rows.append(eshop_row if account_row is not None else None)
+                    account_rows.append(account_row)
+                eshop_rows = pa.array(eshop_rows, type=pa.int64())
+                account_rows = pa.array(account_rows, type=pa.int64())
+                columns = (batch.columns
+                           + [eshops.column(name).take(eshop_rows) for name in eshops.column_names]
+                           + [accounts.column(name).take(account_rows) for name in account_columns])
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        return self.results_path
+
+    def _read(self, stage, columns=None):
+        """
+        :param str stage: Name of the stage, one of SCHEMAS.
+        :param list columns: Columns to read, all by default.
+        :return pyarrow.Table: Table of the stage, empty if nothing was stored.
+        """
+        schema = SCHEMAS[stage]
+        if columns is not None:
+            schema = pa.schema([schema.field(name) for name in columns])
+        tables = [pq.read_table(part, columns=columns, memory_map=True) for part in self._parts(stage)]
+        return pa.concat_tables(tables) if tables else schema.empty_table()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _index(keys):
+    """
+    :param list keys: Values of the key column.
+    :return dict: Row of the first occurrence of every key.
+    """
+    index = {}
+    for row, key in enumerate(keys):
+        if key is not None:
+            index.setdefault(key, row)
+    return index
+
+
+def load(path, columns=None):
+    """
+    Loads the merged results to the DataFrame indexed by the eshop link, the file is read through memory map.
+
+    :param str path: Path to the merged Parquet file or to the directory of the ResultStore.
+    :param list columns: Columns to load, all by default.
+    :return pandas.DataFrame: Data frame with all the data
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'results.parquet')
+    if columns is not None and 'link' not in columns:
+        columns = ['link'] + list(columns)
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas().set_index('link')
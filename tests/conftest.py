@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the repository are imported as top-level modules, as by the notebook and the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.server import ReplayServer  # noqa: E402
+from req import RequestHelper  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def server():
+    with ReplayServer(pages=3) as server:
+        yield server
+
+
+@pytest.fixture
+def req():
+    """
+    RequestHelper giving up quickly, without the shared metrics.
+    """
+    return RequestHelper(timeout=2, maximum_retries=2, disable_debug_print=True, backoff_base=0.01, metrics=False)
@@ -0,0 +1,57 @@
+import os
+
+import requests
+
+from cache import ResponseCache
+
+
+def response(url, content, status_code=200):
+    r = requests.Response()
+    r.url = url
+    r.status_code = status_code
+    r._content = content
+    r.headers['Content-Type'] = 'text/html'
+    return r
+
+
+def test_store_and_get():
+    cache = ResponseCache(':memory:')
+    cache.store('http://example.com/', response('http://example.com/', b'<html>page</html>'))
+    entry = cache.get('http://example.com/')
+    assert entry.content == b'<html>page</html>'
+    assert entry.is_fresh
+    assert cache.get('http://example.com/other') is None
+
+
+def test_running_size_matches_table():
+    cache = ResponseCache(':memory:')
+    for index in range(20):
+        # the bodies of the odd urls are shared, every url is stored twice with a different body
+        cache.store(f'http://example.com/{index}', response('', os.urandom(100) if index % 2 else b'shared'))
+        cache.store(f'http://example.com/{index}', response('', os.urandom(200)))
+    assert cache._size == cache._total_size() == cache.stats['size_bytes']
+    cache.clear()
+    assert cache._size == cache.stats['size_bytes'] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(':memory:', max_size_bytes=3000, compression_level=0)
+    for index in range(10):
+        cache.store(f'http://example.com/{index}', response('', os.urandom(1000)))
+        cache.get('http://example.com/0')
+    assert cache.stats['size_bytes'] <= 3000
+    assert cache._size == cache._total_size()
+    assert cache.get('http://example.com/0') is not None
+    assert cache.get('http://example.com/9') is not None
+    assert cache.get('http://example.com/1') is None
+
+
+def test_table_is_not_summed_below_the_limit(monkeypatch):
+    cache = ResponseCache(':memory:')
+
+    def total_size():
+        raise AssertionError('The table is summed on store.')
+
+    monkeypatch.setattr(cache, '_total_size', total_size)
+    for index in range(10):
+        cache.store(f'http://example.com/{index}', response('', os.urandom(100)))
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from canonical import RedirectCache, SingleFlight, canonical_account, deduplicate, fan_out, url_key
+
+
+def test_url_key():
+    assert url_key('HTTPS://www.Obchod.cz/kontakt/#top') == 'obchod.cz/kontakt'
+    assert url_key('obchod.cz:443/?utm_source=x&page=2&gclid=y') == 'obchod.cz:443?page=2'
+    assert url_key('https://obchod.cz:443//a//b/') == 'obchod.cz/a/b'
+
+
+def test_canonical_account():
+    assert canonical_account('Obchod.CZ/') == 'obchod.cz'
+    assert canonical_account('p') is None
+    assert canonical_account('') is None
+
+
+def test_deduplicate_and_fan_out():
+    items = ['https://obchod.cz/', 'http://www.obchod.cz', 'https://jiny.cz/']
+    distinct, index = deduplicate(items, url_key)
+    assert distinct == ['https://obchod.cz/', 'https://jiny.cz/']
+    results = fan_out(items, index, ['a', 'b'], copy_for=lambda item, result: (item, result))
+    assert results == [(items[0], 'a'), (items[1], 'a'), (items[2], 'b')]
+
+
+def test_single_flight_calls_once():
+    single_flight, calls = SingleFlight(), []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'result'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight.call('key', work))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['result'] * 8
+    assert len(calls) == 1
+
+
+def test_single_flight_retries_failed_call():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise ValueError
+
+    try:
+        single_flight.call('key', fail)
+    except ValueError:
+        pass
+    assert single_flight.call('key', lambda: 'ok') == 'ok'
+
+
+def test_redirect_cache():
+    redirects = RedirectCache(ttl=0.05)
+    redirects.record([('http://a/', 301), ('https://a/', 301)], 'https://a/home')
+    redirects.record([('http://b/', 302)], 'https://b/')
+    assert redirects.resolve('http://a/') == 'https://a/home'
+    assert redirects.resolve('https://a/') == 'https://a/home'
+    assert redirects.resolve('http://b/') == 'https://b/'
+    time.sleep(0.06)
+    assert redirects.resolve('http://b/') == 'http://b/'
+    assert redirects.resolve('http://a/') == 'https://a/home'
@@ -0,0 +1,43 @@
+import glob
+import os
+
+import pytest
+
+import download
+from heureka import Heureka
+from instagram import Instagram
+
+
+@pytest.fixture
+def replay(server, monkeypatch):
+    """
+    Points the stages to the ReplayServer.
+    """
+    monkeypatch.setattr(Heureka, 'START_URL', server.heureka_url)
+    monkeypatch.setattr(Instagram, 'profile_url', staticmethod(server.instagram_url))
+    monkeypatch.setattr(Instagram, 'media_url', staticmethod(server.instagram_media_url))
+    return server
+
+
+def review_parts(store_dir):
+    return glob.glob(os.path.join(store_dir, 'reviews', 'part-*.parquet'))
+
+
+def test_download_all_keeps_reviews_in_store(replay, req, tmp_path):
+    pytest.importorskip('pyarrow')
+    store_dir = str(tmp_path)
+    df = download.download_all(5, req=req, store_dir=store_dir)
+    download.download_reviews(df['inner_link'].tolist(), req=req, max_reviews_per_shop=5, store_dir=store_dir)
+    parts = review_parts(store_dir)
+    assert parts
+
+    download.download_all(5, req=req, store_dir=store_dir)
+    assert review_parts(store_dir) == parts
+
+
+def test_pipelined_download_all_matches_staged(replay, req):
+    staged = download.download_all(10, req=req)
+    pipelined = download.download_all(10, req=req, pipelined=True)
+    assert list(pipelined.columns) == list(staged.columns)
+    assert sorted(pipelined.index) == sorted(staged.index)
+    assert pipelined.loc[staged.index].equals(staged)
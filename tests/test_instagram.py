@@ -0,0 +1,81 @@
+import pytest
+import requests
+
+from benchmarks.server import ReplayServer, LocalServer
+from instagram import Instagram
+
+ACCOUNT = 'obchod_cz'
+
+
+class FailingMediaServer(ReplayServer):
+    """
+    ReplayServer answering the media pages after the given offset by 500.
+    """
+
+    def __init__(self, *args, fail_after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail_after = fail_after
+
+    def respond(self, path):
+        if '/instagram/graphql/query/' in path and f'offset-{self.fail_after}' in path:
+            return 500, {}, b'Internal Server Error'
+        return super().respond(path)
+
+
+def instagram_for(server, req, media_url=None, **kwargs):
+    """
+    :return Instagram: Instagram stage pointed to the server.
+    """
+    cls = type('Instagram', (Instagram,), {'profile_url': staticmethod(server.instagram_url),
+                                           'media_url': staticmethod(media_url or server.instagram_media_url)})
+    return cls(req, keep_full_json=False, media_page_size=50, **kwargs)
+
+
+def parse(instagram, account=ACCOUNT):
+    return instagram._parse_data_from_instagram_account(account)
+
+
+def test_media_paging(server, req):
+    result = parse(instagram_for(server, req, max_posts=112))
+    assert result['instagram_posts_average_like'] is not None
+    assert result != parse(instagram_for(server, req, max_posts=12))
+
+
+def test_failed_media_page_keeps_previous_pages(server, req):
+    expected = parse(instagram_for(server, req, max_posts=62))
+    with FailingMediaServer(fail_after=62) as failing:
+        result = parse(instagram_for(failing, req, max_posts=112))
+    assert result == expected
+
+
+@pytest.fixture(scope='module')
+def dead_media_url():
+    # the port of a stopped server refuses the connections
+    dead = LocalServer()
+    url = dead.url + 'graphql/'
+    dead.stop()
+    return lambda user_id, first, after: url
+
+
+def test_unreachable_media_page_keeps_first_page(server, req, dead_media_url):
+    expected = parse(instagram_for(server, req, max_posts=12))
+    with pytest.warns(UserWarning, match='Encountered an exception'):
+        result = parse(instagram_for(server, req, media_url=dead_media_url, max_posts=112))
+    assert result == expected
+
+
+def test_unreachable_media_page_does_not_fail_threaded_run(server, req, dead_media_url):
+    instagram = instagram_for(server, req, media_url=dead_media_url, max_posts=112, use_multiple_threads=True)
+    with pytest.warns(UserWarning):
+        instagram.run([ACCOUNT, 'other_account'])
+    assert len(instagram.output) == 2
+    assert all(profile['instagram_posts_average_like'] is not None for profile in instagram.output)
+
+
+def test_page_without_profile_data(server, req):
+    instagram = instagram_for(server, req)
+    assert instagram.parse_instagram_data(b'<html><script>var config = {"a": 1};</script></html>') is None
+    assert instagram.parse_instagram_data(b'<html><script>window._sharedData = ;</script></html>') is None
+    login_page = requests.Response()
+    login_page._content = b'<html><body>Log in</body></html>'
+    assert instagram._parse_instagram_profile(ACCOUNT, login_page) == {'account': ACCOUNT}
@@ -0,0 +1,40 @@
+from eshop_web import EshopWebsite
+from journal import Journal
+
+
+def test_results_survive_reopening(tmp_path):
+    path = str(tmp_path / 'stage.jsonl')
+    with Journal(path) as journal:
+        journal.record('a', {'x': 1})
+        journal.record('b', None)
+        journal.record('a', {'x': 2})
+    journal = Journal(path)
+    assert len(journal) == 2
+    assert journal['a'] == {'x': 2}
+    assert 'b' in journal and journal['b'] is None
+    journal.close()
+
+
+def test_incomplete_last_line_is_cut_off(tmp_path):
+    path = tmp_path / 'stage.jsonl'
+    path.write_text('{"k": "a", "v": 1}\n{"k": "b", "v"', encoding='utf-8')
+    with Journal(str(path)) as journal:
+        assert 'b' not in journal
+        journal.record('c', 3)
+    assert path.read_text(encoding='utf-8') == '{"k": "a", "v": 1}\n{"k": "c", "v": 3}\n'
+    with Journal(str(path)) as journal:
+        assert journal['c'] == 3
+
+
+def test_rerun_with_journal_skips_finished_work(server, req, tmp_path):
+    urls = [f'{server.url}eshop/shop{index}/' for index in range(5)]
+    path = str(tmp_path / 'eshop.jsonl')
+    first = EshopWebsite(req, concurrent_threads_count=2, journal=path, max_pages_per_site=1)
+    first.run(urls)
+    first.journal.close()
+
+    requests_before = sum(server.counts.values())
+    second = EshopWebsite(req, concurrent_threads_count=2, journal=path, max_pages_per_site=1)
+    second.run(urls)
+    assert sum(server.counts.values()) == requests_before
+    assert second.output == first.output
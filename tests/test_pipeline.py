@@ -0,0 +1,51 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def test_records_pass_all_stages():
+    pipeline = Pipeline(lambda: range(100), queue_size=5).add_stage(lambda x: x * 2, workers=4) \
+        .add_stage(lambda x: x + 1, workers=2)
+    assert sorted(pipeline) == [x * 2 + 1 for x in range(100)]
+
+
+def test_exception_of_stage_reaches_consumer():
+    def fail(x):
+        if x == 3:
+            raise ValueError('stage failed')
+        return x
+
+    with pytest.raises(ValueError, match='stage failed'):
+        list(Pipeline(lambda: range(10)).add_stage(fail))
+
+
+def test_exception_of_source_reaches_consumer():
+    def source():
+        yield 1
+        raise KeyError('source failed')
+
+    with pytest.raises(KeyError):
+        list(Pipeline(source).add_stage(lambda x: x))
+
+
+def test_threads_stop_when_consumer_stops():
+    threads_before = threading.active_count()
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.01)
+        return x
+
+    for record in Pipeline(itertools.count, queue_size=5).add_stage(slow, workers=3):
+        if record > 10:
+            break
+    time.sleep(Pipeline.POLL_INTERVAL * 3)
+    processed = len(calls)
+    time.sleep(Pipeline.POLL_INTERVAL * 3)
+    assert len(calls) == processed
+    assert threading.active_count() == threads_before
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.server import LocalServer, ProxyServer
+from proxies import NoProxyAvailableError, ProxyPool
+from ratelimit import CircuitOpenError, HostScheduler, parse_retry_after
+from req import RequestHelper
+
+URL = 'http://example.com/page'
+
+
+def opened_scheduler(cooldown=0.05):
+    """
+    :return HostScheduler: Scheduler with the circuit of example.com open.
+    """
+    scheduler = HostScheduler(failure_threshold=1, cooldown=cooldown)
+    scheduler.reserve(URL)
+    scheduler.record(URL, 500)
+    return scheduler
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('not a date') is None
+    assert parse_retry_after(None) is None
+
+
+def test_throttling_cuts_the_rate():
+    scheduler = HostScheduler(initial_rate=4.0, multiplicative_decrease=0.5)
+    scheduler.record(URL, 429, retry_after=0.2)
+    assert scheduler.rates['example.com'] == 2.0
+    assert scheduler.reserve(URL) >= 0.1
+
+
+def test_circuit_lets_single_probe_through():
+    scheduler = opened_scheduler()
+    with pytest.raises(CircuitOpenError):
+        scheduler.reserve(URL)
+    time.sleep(0.06)
+    scheduler.reserve(URL)
+    with pytest.raises(CircuitOpenError):
+        scheduler.reserve(URL)
+    scheduler.record(URL, 200)
+    scheduler.reserve(URL)
+
+
+def test_released_probe_can_go_out_again():
+    scheduler = opened_scheduler()
+    time.sleep(0.06)
+    scheduler.reserve(URL)
+    scheduler.release(URL)
+    scheduler.reserve(URL)
+
+
+def test_lost_probe_expires_after_cooldown():
+    scheduler = opened_scheduler()
+    time.sleep(0.06)
+    scheduler.reserve(URL)
+    time.sleep(0.06)
+    scheduler.reserve(URL)
+
+
+def suspended_request_helper(target, proxy):
+    """
+    :return tuple: RequestHelper with the circuit of the target open and its only proxy taken, and the proxy pool.
+    """
+    pool = ProxyPool([proxy.url.rstrip('/')], max_concurrency=1, acquire_timeout=0)
+    req = RequestHelper(maximum_retries=1, disable_debug_print=True, metrics=False, cache=False, proxy_pool=pool,
+                        scheduler=HostScheduler(failure_threshold=1, cooldown=0.05))
+    req.scheduler.reserve(target.url)
+    req.scheduler.record(target.url, 500)
+    pool.acquire(target.url)
+    time.sleep(0.06)
+    return req, pool
+
+
+def test_probe_without_proxy_does_not_suspend_host():
+    with LocalServer() as target, ProxyServer() as proxy:
+        req, pool = suspended_request_helper(target, proxy)
+        with pytest.raises(NoProxyAvailableError):
+            req.make_request(target.url)
+        pool.release(proxy.url.rstrip('/'), None)
+        assert req.make_request(target.url).status_code == 200
+
+
+def test_cancelled_async_probe_does_not_suspend_host():
+    pytest.importorskip('aiohttp')
+    import aiohttp
+
+    with LocalServer(latency=1.0) as target:
+        req = RequestHelper(maximum_retries=1, disable_debug_print=True, metrics=False, cache=False,
+                            scheduler=HostScheduler(failure_threshold=1, cooldown=0.05))
+        req.scheduler.reserve(target.url)
+        req.scheduler.record(target.url, 500)
+        time.sleep(0.06)
+
+        async def cancelled_probe():
+            async with aiohttp.ClientSession() as session:
+                task = asyncio.ensure_future(req.make_request_async(session, target.url))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(cancelled_probe())
+        req.scheduler.reserve(target.url)
@@ -0,0 +1,72 @@
+import socket
+import threading
+import time
+
+import requests
+
+from benchmarks.server import LocalServer
+from resolver import DNSCache
+
+
+class StubCache(DNSCache):
+    """
+    DNSCache answering from the dictionary of the hostnames instead of the network.
+    """
+
+    def __init__(self, hosts, **kwargs):
+        super().__init__(**kwargs)
+        self.hosts = hosts
+        self.queries = []
+        self._queries_lock = threading.Lock()
+
+    def _query(self, host):
+        with self._queries_lock:
+            self.queries.append(host)
+        time.sleep(0.02)
+        if host not in self.hosts:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return self.hosts[host], self.ttl
+
+
+def test_lookups_are_cached_and_shared():
+    cache = StubCache({'obchod.cz': ['127.0.0.1']})
+    assert cache.prefetch(['obchod.cz', 'Obchod.cz.', None]) == 2
+    assert cache.resolve('OBCHOD.cz') == ['127.0.0.1']
+    assert cache.resolve('obchod.cz') == ['127.0.0.1']
+    assert cache.queries == ['obchod.cz']
+
+
+def test_missing_host_is_cached_as_negative():
+    cache = StubCache({})
+    assert not cache.is_resolvable('missing.cz')
+    assert not cache.is_resolvable('missing.cz')
+    assert cache.queries == ['missing.cz']
+
+
+def test_temporary_failure_is_not_cached():
+    cache = StubCache({})
+
+    def query(host):
+        raise socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+
+    cache._query = query
+    assert cache.is_resolvable('flaky.cz')
+    assert len(cache) == 0
+
+
+def test_ip_address_is_not_resolved():
+    cache = StubCache({})
+    assert cache.resolve('127.0.0.1') == ['127.0.0.1']
+    assert cache.queries == []
+
+
+def test_connection_falls_back_to_the_next_address():
+    with LocalServer() as server:
+        port = server.url.rsplit(':', 1)[1].rstrip('/')
+        # nothing listens on 127.0.0.2, the connection is refused
+        cache = StubCache({'multi.test': ['127.0.0.2', '127.0.0.1']})
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter()
+        cache.install(adapter)
+        session.mount('http://', adapter)
+        assert session.get(f'http://multi.test:{port}/', timeout=2).status_code == 200
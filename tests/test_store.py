@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from store import DATASET_STAGES, ResultStore, load  # noqa: E402
+
+ESHOPS = [
+    {'link': 'https://a.cz/', 'name': 'A', 'inner_link': 'https://heureka.cz/a/', 'reviews': 10},
+    {'link': 'https://b.cz/', 'name': 'B', 'inner_link': 'https://heureka.cz/b/', 'reviews': 5},
+    {'link': 'https://c.cz/', 'name': 'C', 'inner_link': 'https://heureka.cz/c/', 'reviews': 1},
+]
+WEBSITES = [
+    {'url': 'https://a.cz/', 'instagram': 'a_shop'},
+    {'url': 'https://b.cz/', 'instagram': None},
+    {'url': 'https://c.cz/', 'instagram': 'c_shop'},
+]
+PROFILES = [{'account': 'a_shop', 'instagram_followers': 100}]
+
+
+def test_merge_joins_stages_like_download_all(tmp_path):
+    with ResultStore(str(tmp_path), batch_size=2, stages=DATASET_STAGES) as store:
+        store.extend('heureka', ESHOPS)
+        store.extend('eshop', WEBSITES)
+        store.extend('instagram', PROFILES)
+        assert store.column('heureka', 'link') == [eshop['link'] for eshop in ESHOPS]
+        df = load(store.merge())
+    assert list(df.index) == [eshop['link'] for eshop in ESHOPS]
+    assert df.loc['https://a.cz/', 'instagram_followers'] == 100
+    # eshops without Instagram data are left out of the joined columns
+    assert df['instagram'].isna().tolist() == [False, True, True]
+
+
+def test_stages_of_other_stores_are_kept(tmp_path):
+    with ResultStore(str(tmp_path), stages=('reviews',)) as store:
+        store.append('reviews', {'inner_link': 'https://heureka.cz/a/', 'rating': 5.0, 'text': 'ok'})
+    with ResultStore(str(tmp_path), stages=DATASET_STAGES) as store:
+        store.extend('heureka', ESHOPS)
+    assert ResultStore(str(tmp_path), stages=()).column('reviews', 'text') == ['ok']